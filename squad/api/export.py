@@ -0,0 +1,93 @@
+import csv
+import json
+
+from django.http import StreamingHttpResponse
+
+from squad.core.utils import join_name
+
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+TEST_FIELDS = ['id', 'test_run', 'environment', 'suite', 'name', 'short_name', 'status', 'result', 'has_known_issues']
+
+
+def __status__(result, has_known_issues):
+    # same as Test.status
+    if result:
+        return 'pass'
+    elif result is None:
+        return 'skip'
+    elif has_known_issues:
+        return 'xfail'
+    else:
+        return 'fail'
+
+
+def build_tests_rows(build, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields one dict per test in the build, with the suite, test and
+    environment names joined in the database. A server-side cursor is used
+    (where supported), so memory usage does not depend on the size of the
+    build.
+    """
+    tests = build.tests.values_list(
+        'id',
+        'test_run_id',
+        'environment__slug',
+        'metadata__suite',
+        'metadata__name',
+        'result',
+        'has_known_issues',
+    ).order_by('id')
+
+    for test_id, test_run_id, environment, suite, name, result, has_known_issues in tests.iterator(chunk_size=chunk_size):
+        yield {
+            'id': test_id,
+            'test_run': test_run_id,
+            'environment': environment,
+            'suite': suite,
+            'name': join_name(suite, name),
+            'short_name': name,
+            'status': __status__(result, has_known_issues),
+            'result': result,
+            'has_known_issues': has_known_issues,
+        }
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+
+class Echo(object):
+    """
+    File-like object for csv.writer that just returns what is written to it
+    """
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows, fields):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([row[f] for f in fields])
+
+
+def build_tests_response(build, export_format):
+    """
+    Returns a streaming response with all tests of the build, either as
+    newline-delimited JSON (`ndjson`) or `csv`.
+    """
+    rows = build_tests_rows(build)
+    if export_format == 'csv':
+        content = csv_lines(rows, TEST_FIELDS)
+        content_type = 'text/csv; charset=utf-8'
+    else:
+        content = ndjson_lines(rows)
+        content_type = 'application/x-ndjson; charset=utf-8'
+
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="build-%d-tests.%s"' % (build.id, export_format)
+    return response
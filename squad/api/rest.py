@@ -15,6 +15,7 @@ from squad.core.models import (
     Group,
     Project,
     ProjectStatus,
+    ProjectStatusChange,
     Build,
     TestRun,
     Environment,
@@ -53,7 +54,8 @@ from rest_framework.response import Response
 from rest_framework.reverse import reverse as rest_reverse
 from rest_framework.permissions import AllowAny
 from squad.compat import ComplexFilterBackend
-from squad.api.utils import CursorPaginationWithPageSize
+from squad.api.utils import CursorPaginationWithPageSize, KeysetPagination
+from squad.api.export import build_tests_response
 
 import rest_framework_filters as filters
 
@@ -146,6 +148,7 @@ class TestRunFilter(filters.FilterSet):
                   'environment_id': ['exact', 'in'],
                   'data_processed': ['exact'],
                   'status_recorded': ['exact'],
+                  'processing_status': ['exact', 'in'],
                   'created_at': ['exact', 'lt', 'lte', 'gt', 'gte'],
                   'datetime': ['exact', 'lt', 'lte', 'gt', 'gte'],
                   'completed': ['exact']}
@@ -301,6 +304,11 @@ class API(routers.APIRootView):
       take the `count` and `next` fields of the response into account so you can
       navigate to the rest of the objects.
 
+    * Lists paginated with `limit` and `offset` get slower the further into
+      the list you go. Pass `pagination=cursor` to get keyset (cursor)
+      pagination instead, and follow the `next` links from there. Responses
+      in this mode have no `count` field.
+
     * Only public projects are available through the API without
       authentication. Non-public projects require authentication using a valid
       API token, and the corresponding user account must also have access to
@@ -708,43 +716,37 @@ class ProjectViewSet(viewsets.ModelViewSet):
 
 class ProjectStatusSerializer(DynamicFieldsModelSerializer, serializers.HyperlinkedModelSerializer):
 
+    regressions = serializers.SerializerMethodField()
+    fixes = serializers.SerializerMethodField()
+    metric_regressions = serializers.SerializerMethodField()
+    metric_fixes = serializers.SerializerMethodField()
+
+    def __changes__(self, name, changes):
+        enriched_details = self.context.get('enriched_details', None)
+        if not changes:
+            return None
+        if enriched_details:
+            for env in enriched_details.keys():
+                env_changes = changes.get(env, None)
+                if env_changes:
+                    enriched_details[env].update({name: env_changes})
+        return json.dumps(changes)
+
+    def get_regressions(self, instance):
+        return self.__changes__('regressions', instance.get_regressions())
+
+    def get_fixes(self, instance):
+        return self.__changes__('fixes', instance.get_fixes())
+
+    def get_metric_regressions(self, instance):
+        return self.__changes__('metric_regressions', instance.get_metric_regressions())
+
+    def get_metric_fixes(self, instance):
+        return self.__changes__('metric_fixes', instance.get_metric_fixes())
+
     def to_representation(self, instance):
         ret = super().to_representation(instance)
-        enriched_details = self.context.get('enriched_details', None)
-        if instance.regressions is not None:
-            regressions = instance.get_regressions()
-            if enriched_details:
-                for env in enriched_details.keys():
-                    env_regressions = regressions.get(env, None)
-                    if env_regressions:
-                        enriched_details[env].update({'regressions': env_regressions})
-            ret['regressions'] = json.dumps(regressions)
-        if instance.fixes is not None:
-            fixes = instance.get_fixes()
-            if enriched_details:
-                for env in enriched_details.keys():
-                    env_fixes = fixes.get(env, None)
-                    if env_fixes:
-                        enriched_details[env].update({'fixes': env_fixes})
-            ret['fixes'] = json.dumps(instance.get_fixes())
-
-        if instance.metric_regressions is not None:
-            metric_regressions = instance.get_metric_regressions()
-            if enriched_details:
-                for env in enriched_details.keys():
-                    env_regressions = metric_regressions.get(env, None)
-                    if env_regressions:
-                        enriched_details[env].update({'metric_regressions': env_regressions})
-            ret['metric_regressions'] = json.dumps(metric_regressions)
-        if instance.metric_fixes is not None:
-            metric_fixes = instance.get_metric_fixes()
-            if enriched_details:
-                for env in enriched_details.keys():
-                    env_fixes = metric_fixes.get(env, None)
-                    if env_fixes:
-                        enriched_details[env].update({'metric_fixes': env_fixes})
-            ret['metric_fixes'] = json.dumps(metric_fixes)
-        ret['details'] = enriched_details
+        ret['details'] = self.context.get('enriched_details', None)
         return ret
 
     class Meta:
@@ -778,7 +780,7 @@ class ProjectStatusSerializer(DynamicFieldsModelSerializer, serializers.Hyperlin
 
 
 class ProjectStatusViewSet(viewsets.ModelViewSet):
-    queryset = ProjectStatus.objects
+    queryset = ProjectStatus.objects.prefetch_related(ProjectStatusChange.prefetch())
     serializer_class = ProjectStatusSerializer
     filterset_fields = ('build',)
     filter_fields = filterset_fields  # TODO: remove when django-filters 1.x is not supported anymore
@@ -863,6 +865,10 @@ class BuildSerializer(DynamicFieldsModelSerializer, serializers.HyperlinkedModel
         fields = '__all__'
 
 
+class BuildPagination(KeysetPagination):
+    ordering = ('-datetime', '-id')
+
+
 class BuildViewSet(NestedViewSetMixin, ModelViewSet):
     """
     List of all builds in the system. Only builds belonging to public projects
@@ -904,6 +910,11 @@ class BuildViewSet(NestedViewSetMixin, ModelViewSet):
 
         Returns list of Test objects belonging to this build. List is paginated
 
+     * `api/builds/<id>/tests.ndjson` and `api/builds/<id>/tests.csv` GET
+
+        Streams all tests of this build at once, as newline-delimited JSON
+        or CSV. Unlike `tests`, the list is not paginated.
+
      * `api/builds/<id>/failures_with_confidence` GET
 
        List of failing tests with confidence scores. For each failure SQUAD will look back
@@ -957,6 +968,7 @@ class BuildViewSet(NestedViewSetMixin, ModelViewSet):
     filter_class = filterset_class  # TODO: remove when django-filters 1.x is not supported anymore
     search_fields = ('version',)
     ordering_fields = ('id', 'version', 'created_at', 'datetime')
+    pagination_class = BuildPagination
 
     def get_queryset(self):
         # Squeeze a few ms from this query if user wants less fields
@@ -1022,6 +1034,10 @@ class BuildViewSet(NestedViewSetMixin, ModelViewSet):
         except ProjectStatus.DoesNotExist:
             raise NotFound()
 
+    @action(detail=True, methods=['get'], suffix='tests export', url_path=r'tests\.(?P<export_format>ndjson|csv)')
+    def tests_export(self, request, pk=None, export_format=None):
+        return build_tests_response(self.get_object(), export_format)
+
     @action(detail=True, methods=['get'], suffix='failures_with_confidence')
     def failures_with_confidence(self, request, pk=None):
         build = self.get_object()
@@ -1033,27 +1049,30 @@ class BuildViewSet(NestedViewSetMixin, ModelViewSet):
             'id', 'metadata__suite', 'metadata__name', 'environment__slug',
         ).distinct()
 
-        page = self.paginate_queryset(failures)
+        paginator = KeysetPagination(ordering='id')
+        page = paginator.paginate_queryset(failures, request)
         releases_only = request.GET.get("releases_only")
         fwc = failures_with_confidence(build.project, build, page, releases_only=releases_only)
         serializer = FailuresWithConfidenceSerializer(fwc, many=True, context={'request': request})
-        return self.get_paginated_response(serializer.data)
+        return paginator.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['get'], suffix='test runs')
     def testruns(self, request, pk=None):
         testruns = self.get_object().test_runs.prefetch_related(
             Prefetch("status", queryset=Status.objects.filter(suite=None))
         ).order_by("-id")
-        page = self.paginate_queryset(testruns)
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(testruns, request)
         serializer = TestRunSerializer(page, many=True, context={'request': request})
-        return self.get_paginated_response(serializer.data)
+        return paginator.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['get'], suffix='test jobs')
     def testjobs(self, request, pk=None):
         testjobs = self.get_object().test_jobs.prefetch_related('backend').order_by('-id')
-        page = self.paginate_queryset(testjobs)
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(testjobs, request)
         serializer = TestJobSerializer(page, many=True, context={'request': request})
-        return self.get_paginated_response(serializer.data)
+        return paginator.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['get'], suffix='test jobs summary')
     def testjobs_summary(self, request, pk=None):
@@ -1549,6 +1568,7 @@ class TestRunViewSet(ModelViewSet):
         "job_status",
         "data_processed",
         "status_recorded",
+        "processing_status",
         "environment",
     )
     filter_fields = filterset_fields  # TODO: remove when django-filters 1.x is not supported anymore
@@ -14,6 +14,9 @@ from squad.core.models import slug_pattern, group_slug_pattern
 schema_view = get_schema_view(title="SQUAD API")
 
 urlpatterns = [
+    # same as the builds/<id>/tests.<format>/ action, but without the trailing
+    # slash, which would otherwise be taken as a format suffix by the router
+    url(r'^builds/(?P<pk>[0-9]+)/tests\.(?P<export_format>ndjson|csv)$', rest.BuildViewSet.as_view({'get': 'tests_export'})),
     url(r'^', include(rest.router.urls)),
     url(r'^schema/', schema_view),
     url(r'^auth/', include('rest_framework.urls', namespace='rest_framework')),
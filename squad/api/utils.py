@@ -1,5 +1,5 @@
 from squad.compat import RestFrameworkFilterBackend
-from rest_framework.pagination import CursorPagination
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
 from rest_framework.renderers import BrowsableAPIRenderer
 
 
@@ -14,6 +14,62 @@ class CursorPaginationWithPageSize(CursorPagination):
     ordering = '-id'
 
 
+class KeysetPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination, unless the client opts into keyset (cursor)
+    pagination by passing `pagination=cursor` in the query string. Following
+    the `next` links from there keeps the `cursor` parameter, which also
+    selects keyset pagination.
+
+    Keyset pagination does not count the objects nor skip over `offset` rows,
+    so fetching any page costs the same regardless of how deep into the list
+    it is. Objects are ordered by `ordering`, unless the view is sorted with
+    the `ordering` query parameter.
+    """
+    pagination_query_param = 'pagination'
+    ordering = '-id'
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = ordering
+        self.cursor_paginator = None
+
+    def use_cursor(self, request):
+        params = request.query_params
+        return CursorPagination.cursor_query_param in params or \
+            params.get(self.pagination_query_param) == 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.use_cursor(request):
+            self.cursor_paginator = None
+            return super().paginate_queryset(queryset, request, view)
+
+        self.cursor_paginator = CursorPaginationWithPageSize()
+        self.cursor_paginator.ordering = self.get_ordering(request, queryset, view)
+        self.cursor_paginator.max_page_size = self.max_limit
+        page = self.cursor_paginator.paginate_queryset(queryset, request)
+        self.display_page_controls = self.cursor_paginator.display_page_controls
+        return page
+
+    def get_ordering(self, request, queryset, view):
+        for backend in getattr(view, 'filter_backends', []):
+            if hasattr(backend, 'get_ordering'):
+                ordering = backend().get_ordering(request, queryset, view)
+                if ordering:
+                    return tuple(ordering)
+        return self.ordering
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.to_html()
+        return super().to_html()
+
+
 # ref: https://bradmontgomery.net/blog/disabling-forms-django-rest-frameworks-browsable-api/
 class BrowsableAPIRendererWithoutForms(BrowsableAPIRenderer):
     """Renders the browsable api, but excludes the forms."""
@@ -3,6 +3,7 @@ from django.core.exceptions import ValidationError
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.http import HttpResponse
+from django.urls import reverse
 import json
 import logging
 
@@ -90,7 +91,12 @@ def add_test_run(request, group_slug, project_slug, version, environment_slug):
     for key, field in uploads.items():
         if field in request.FILES:
             f = request.FILES[field]
-            test_run_data[key] = read_file_upload(f).decode('utf-8')
+            if key == 'metadata_file':
+                test_run_data[key] = read_file_upload(f).decode('utf-8')
+            else:
+                # tests, metrics and logs can be large; they are validated,
+                # stored and parsed incrementally, straight from the upload
+                test_run_data[key] = f
         elif field in request.POST:
             test_run_data[key] = request.POST[field]
 
@@ -105,13 +111,17 @@ def add_test_run(request, group_slug, project_slug, version, environment_slug):
     if 'attachment' in request.FILES:
         attachments = {}
         for f in request.FILES.getlist('attachment'):
-            attachments[f.name] = read_file_upload(f)
+            attachments[f.name] = f
         test_run_data['attachments'] = attachments
 
+    # with async=true, the test run is only stored here and processed later
+    # by a worker; its progress is available from the API
+    asynchronous = request.POST.get('async', 'false').lower() in ['1', 'true', 'yes']
+
     receive = ReceiveTestRun(project)
 
     try:
-        testrun, build = receive(**test_run_data)
+        testrun, build = receive(asynchronous=asynchronous, **test_run_data)
         log_addition(request, testrun, "Test Run created")
         if build:
             log_addition(request, build, "Build created")
@@ -119,6 +129,11 @@ def add_test_run(request, group_slug, project_slug, version, environment_slug):
         logger.warning(request.get_full_path() + ": " + str(e))
         return HttpResponse(str(e), status=400)
 
+    if asynchronous:
+        response = HttpResponse(str(testrun.id), status=202)
+        response['Location'] = request.build_absolute_uri(reverse('testrun-detail', args=[testrun.id]))
+        return response
+
     return HttpResponse(str(testrun.id), status=201)
 
 
@@ -18,6 +18,7 @@ else:
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", "squad.settings")
 
 from django.conf import settings  # noqa
+from squad.profiling import profile_task  # noqa
 
 
 class MemoryUseLoggingTask(Task):
@@ -25,7 +26,8 @@ class MemoryUseLoggingTask(Task):
     def __call__(self, *args, **kwargs):
         ram0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # in kB
         try:
-            return super(MemoryUseLoggingTask, self).__call__(*args, **kwargs)
+            with profile_task(self):
+                return super(MemoryUseLoggingTask, self).__call__(*args, **kwargs)
         finally:
             ram = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # in kB
             diff = ram - ram0
@@ -15,7 +15,7 @@ poll_backends.short_description = "Poll selected backends"
 
 
 class BackendAdmin(NoDeleteListingModelAdmin):
-    list_display = ('name', 'url', 'implementation_type', 'listen_enabled', 'poll_enabled', 'poll_interval', 'max_fetch_attempts')
+    list_display = ('name', 'url', 'implementation_type', 'listen_enabled', 'poll_enabled', 'poll_interval', 'max_fetch_attempts', 'max_inflight_fetches')
     actions = [poll_backends]
 
 
@@ -1,19 +1,23 @@
 import asyncio
 import aiohttp
 import json
+import tempfile
 import re
 import requests
 import ssl
 import socket
+import threading
 import traceback
 import yaml
 import xmlrpc
 import zmq
 
+from array import array
 from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
 from dateutil.parser import isoparse
 from contextlib import contextmanager
-from io import BytesIO, TextIOWrapper, StringIO
+from io import BytesIO, StringIO
 from zmq.utils.strtypes import u
 
 from xmlrpc import client as xmlrpclib
@@ -30,6 +34,14 @@ from squad.ci.backend.null import Backend as BaseBackend
 description = "LAVA"
 timeout_variable_name = "TIMEOUT"
 DEFAULT_TIMEOUT = 60
+fetch_concurrency_variable_name = "FETCH_CONCURRENCY"
+DEFAULT_FETCH_CONCURRENCY = 4
+# logs bigger than this are spooled to disk while they are downloaded
+LOG_SPOOL_SIZE = 8 * 1024 * 1024
+LOG_CHUNK_SIZE = 64 * 1024
+# level of a log entry as LAVA writes them, see Backend.__parse_log__
+log_entry_level = re.compile(rb'- \{"dt": "[^"]*", "lvl": "([a-z]+)"')
+log_target_levels = (b'target', b'feedback')
 
 
 class RequestsTransport(xmlrpclib.SafeTransport):
@@ -41,10 +53,13 @@ class RequestsTransport(xmlrpclib.SafeTransport):
     # change our user agent to reflect Requests
     user_agent = "Python XMLRPC with Requests (python-requests.org)"
 
-    def __init__(self, use_https=True, cert=None, verify=None, *args, **kwargs):
+    def __init__(self, use_https=True, cert=None, verify=None, session=None, *args, **kwargs):
         self.cert = cert
         self.verify = verify
         self.use_https = use_https
+        # requests are made through `session` if given, so that its pooled
+        # connections are reused, and with a new connection each otherwise
+        self.session = session
         self.timeout = socket._GLOBAL_DEFAULT_TIMEOUT
         if 'timeout' in kwargs:
             self.timeout = kwargs.pop('timeout')
@@ -57,11 +72,12 @@ class RequestsTransport(xmlrpclib.SafeTransport):
         """
         headers = {'User-Agent': self.user_agent}
         url = self._build_url(host, handler)
+        http = self.session or requests
         try:
-            resp = requests.post(url, data=request_body, headers=headers,
-                                 stream=True,
-                                 cert=self.cert, verify=self.verify,
-                                 timeout=self.timeout)
+            resp = http.post(url, data=request_body, headers=headers,
+                             stream=True,
+                             cert=self.cert, verify=self.verify,
+                             timeout=self.timeout)
         except ValueError:
             raise
         except Exception:
@@ -74,7 +90,10 @@ class RequestsTransport(xmlrpclib.SafeTransport):
                                               str(e), resp.headers)
             else:
                 self.verbose = verbose
-                return self.parse_response(resp.raw)
+                with resp:
+                    # closing the response puts the connection back in the
+                    # pool of the session
+                    return self.parse_response(resp.raw)
 
     def _build_url(self, host, handler):
         """
@@ -85,6 +104,45 @@ class RequestsTransport(xmlrpclib.SafeTransport):
         return '%s://%s/%s' % (scheme, host, handler)
 
 
+class IndexedLog(object):
+    """
+    Index of the line offsets of a (binary, seekable) log file, built in a
+    single pass over the file. With it, reading any range of lines is a
+    single seek and read, instead of a scan from the start of the file.
+    """
+
+    def __init__(self, log):
+        self.log = log
+        # offsets[n] is where line n + 1 starts; the last item is the
+        # size of the file
+        self.offsets = array('Q', [0])
+        log.seek(0)
+        offset = 0
+        for line in log:
+            offset += len(line)
+            self.offsets.append(offset)
+        log.seek(0)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def lines(self, first, last):
+        """
+        Returns lines `first` to `last` (1-based, inclusive) with their line
+        endings, as bytes.
+        """
+        first = max(first, 1)
+        last = min(last, len(self))
+        if first > last:
+            return []
+
+        start = self.offsets[first - 1]
+        self.log.seek(start)
+        data = self.log.read(self.offsets[last] - start)
+        self.log.seek(0)
+        return [data[self.offsets[n] - start:self.offsets[n + 1] - start] for n in range(first - 1, last)]
+
+
 class Backend(BaseBackend):
 
     # ------------------------------------------------------------------------
@@ -139,15 +197,28 @@ class Backend(BaseBackend):
                 test_job.ended_at = end_time
                 test_job.failure = None
                 test_job.save()
-                data['results'] = self.__get_testjob_results_yaml__(test_job.job_id)
 
-                # fetch logs
-                raw_logs = BytesIO()
+                # download the full log while the results are retrieved
+                log_downloader = ThreadPoolExecutor(max_workers=1)
+                abandon_log = threading.Event()
+                full_log = log_downloader.submit(self.__download_full_log__, test_job.job_id, abandon_log)
+                try:
+                    data['results'] = self.__get_testjob_results_yaml__(test_job.job_id)
+                except BaseException:
+                    # don't wait for a log that won't be used
+                    abandon_log.set()
+                    full_log.cancel()
+                    raise
+                finally:
+                    log_downloader.shutdown(wait=False)
+
                 try:
-                    raw_logs = BytesIO(self.__download_full_log__(test_job.job_id))
+                    raw_logs = full_log.result()
                 except Exception:
+                    raw_logs = BytesIO()
                     self.log_warn(("Logs for job %s are not available" % test_job.job_id) + "\n" + traceback.format_exc())
-                return self.__parse_results__(data, test_job, raw_logs)
+                with raw_logs:
+                    return self.__parse_results__(data, test_job, raw_logs)
         except xmlrpc.client.ProtocolError as error:
             raise TemporaryFetchIssue(self.url_remove_token(str(error)))
         except xmlrpc.client.Fault as fault:
@@ -249,6 +320,8 @@ class Backend(BaseBackend):
         super(Backend, self).__init__(data)
         self.complete_statuses = ['Complete', 'Incomplete', 'Canceled', 'Finished']
         self.__proxy__ = None
+        self.__session__ = None
+        self.__session_lock__ = threading.Lock()
         self.use_xml_rpc = True
         url = None
         self.authentication = None
@@ -297,25 +370,77 @@ class Backend(BaseBackend):
     @property
     def proxy(self):
         if self.__proxy__ is None:
-            url = urlsplit(self.data.url)
-            endpoint = '%s://%s:%s@%s%s' % (
-                url.scheme,
-                self.data.username,
-                self.data.token,
-                url.netloc,
-                url.path
-            )
-            use_https = True
-            if url.scheme == 'http':
-                use_https = False
-            proxy_timeout = self.settings.get(timeout_variable_name, DEFAULT_TIMEOUT)
-            self.__proxy__ = xmlrpclib.ServerProxy(
-                endpoint,
-                transport=RequestsTransport(timeout=proxy_timeout, use_https=use_https, use_builtin_types=True),
-                use_builtin_types=True
-            )
+            self.__proxy__ = self.__new_proxy__()
         return self.__proxy__
 
+    def __new_proxy__(self, session=None):
+        url = urlsplit(self.data.url)
+        endpoint = '%s://%s:%s@%s%s' % (
+            url.scheme,
+            self.data.username,
+            self.data.token,
+            url.netloc,
+            url.path
+        )
+        use_https = True
+        if url.scheme == 'http':
+            use_https = False
+        proxy_timeout = self.settings.get(timeout_variable_name, DEFAULT_TIMEOUT)
+        return xmlrpclib.ServerProxy(
+            endpoint,
+            transport=RequestsTransport(timeout=proxy_timeout, use_https=use_https, session=session, use_builtin_types=True),
+            use_builtin_types=True
+        )
+
+    @property
+    def fetch_concurrency(self):
+        return max(1, int(self.settings.get(fetch_concurrency_variable_name, DEFAULT_FETCH_CONCURRENCY)))
+
+    @property
+    def session(self):
+        """
+        HTTP session shared by all requests made while fetching, so that
+        connections to the LAVA server are reused. The connection pool is big
+        enough for the concurrent results requests plus the log download.
+
+        It is first used from those concurrent threads, so it is created
+        under a lock to make sure they all share the same one.
+        """
+        if self.__session__ is None:
+            with self.__session_lock__:
+                if self.__session__ is None:
+                    pool_size = self.fetch_concurrency + 1
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                    session = requests.Session()
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self.__session__ = session
+        return self.__session__
+
+    def __map_concurrently__(self, function, items):
+        """
+        Returns [function(item) for item in items], running at most
+        `FETCH_CONCURRENCY` (from the backend settings) calls at a time.
+
+        If any of the calls fails, the ones not started yet are cancelled and
+        the error is raised right away, without waiting for the running ones.
+        """
+        items = list(items)
+        workers = min(self.fetch_concurrency, len(items))
+        if workers <= 1:
+            return [function(item) for item in items]
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = [executor.submit(function, item) for item in items]
+        try:
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in done:
+                future.result()  # raises the first error, if any
+            return [future.result() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
     def get_listener_url(self):
         url = urlsplit(self.data.url)
         hostname = url.netloc
@@ -433,7 +558,7 @@ class Backend(BaseBackend):
     def __get_job_details__(self, job_id):
         if self.use_xml_rpc:
             return self.proxy.scheduler.job_details(job_id)
-        response = requests.get(
+        response = self.session.get(
             urljoin(self.api_url_base, "jobs/%s" % (job_id)),
             headers=self.authentication,
             timeout=self.settings.get(timeout_variable_name, DEFAULT_TIMEOUT)
@@ -442,37 +567,53 @@ class Backend(BaseBackend):
             return response.json()
         raise FetchIssue(response.text)
 
-    def __download_full_log__(self, job_id):
-        response = None
+    def __download_full_log__(self, job_id, abandon=None):
+        """
+        Returns a file with the full log of the job, which is empty if the
+        log could not be downloaded. The log is streamed into a temporary
+        file that is only kept in memory while it's small.
+
+        The download stops early if `abandon` (a threading.Event) gets set.
+        """
+        raw_log = tempfile.SpooledTemporaryFile(max_size=LOG_SPOOL_SIZE)
         if self.use_xml_rpc:
             url = self.data.url.replace('/RPC2', '/scheduler/job/%s/log_file/plain' % job_id)
-            payload = {"user": self.data.username, "token": self.data.token}
-            try:
-                response = requests.get(
-                    url,
-                    params=payload,
-                    timeout=self.settings.get(timeout_variable_name, DEFAULT_TIMEOUT)
-                )
-
-            except requests.exceptions.RequestException:
-                self.log_error("Unable to download log for {backend_name}/{job_id}".format(backend_name=self.data.name, job_id=job_id))
+            request = {
+                'params': {"user": self.data.username, "token": self.data.token},
+            }
         else:
-            try:
-                response = requests.get(
-                    urljoin(self.api_url_base, "jobs/%s/logs/" % (job_id)),
-                    headers=self.authentication,
-                    timeout=self.settings.get(timeout_variable_name, DEFAULT_TIMEOUT)
-                )
-            except requests.exceptions.RequestException:
-                self.log_error("Unable to download log for {backend_name}/{job_id}".format(backend_name=self.data.name, job_id=job_id))
-        if response and response.status_code == 200:
-            return response.content
-        return b''
+            url = urljoin(self.api_url_base, "jobs/%s/logs/" % (job_id))
+            request = {
+                'headers': self.authentication,
+            }
+
+        try:
+            response = self.session.get(
+                url,
+                stream=True,
+                timeout=self.settings.get(timeout_variable_name, DEFAULT_TIMEOUT),
+                **request
+            )
+            with response:
+                if response.status_code == 200:
+                    for chunk in response.iter_content(chunk_size=LOG_CHUNK_SIZE):
+                        if abandon is not None and abandon.is_set():
+                            break
+                        raw_log.write(chunk)
+        except requests.exceptions.RequestException:
+            self.log_error("Unable to download log for {backend_name}/{job_id}".format(backend_name=self.data.name, job_id=job_id))
+            raw_log.truncate(0)
+
+        raw_log.seek(0)
+        return raw_log
 
     def __download_test_log__(self, raw_log, log_start, log_end):
         if not log_start:
             return ""
 
+        if not isinstance(raw_log, IndexedLog):
+            raw_log = IndexedLog(raw_log)
+
         return_lines = StringIO()
         log_start_line = int(log_start)
         log_end_line = None
@@ -480,132 +621,169 @@ class Backend(BaseBackend):
             log_end_line = int(log_end)
         else:
             log_end_line = log_start_line + 2  # LAVA sometimes misses the signals
-        raw_log.seek(0)
-        counter = 0
-        for line in raw_log:
-            counter += 1
-            if counter < log_start_line:
-                continue
+        for line in raw_log.lines(log_start_line, log_end_line):
             try:
                 return_lines.write(line.decode("utf-8"))
             except UnicodeDecodeError:
                 return_lines.write(line.decode("iso-8859-1"))
             return_lines.write("\n")
-            if counter >= log_end_line:
-                break
-        raw_log.seek(0)
         return return_lines.getvalue()
 
     def __parse_log__(self, log_data):
+        """
+        Extracts the target and feedback messages from a LAVA log.
+
+        LAVA writes one entry per line, as a YAML sequence item holding a
+        JSON-like flow mapping:
+
+            - {"dt": "...", "lvl": "target", "msg": "..."}
+
+        Lines are scanned one at a time: the level of well-formed entries is
+        matched without parsing them, entries from other levels are skipped,
+        and target/feedback entries are decoded as JSON. Only entries that
+        don't look like that (e.g. binary messages, or entries spanning more
+        than one line) go through the YAML parser. Entries that can't be
+        parsed at all are logged and skipped.
+        """
         returned_log = StringIO()
-        start_dict = False
-        tmp_dict = None
-        tmp_key = None
-        is_value = False
-        self.log_debug("Length of log buffer: %s" % log_data.getbuffer().nbytes)
-        if log_data.getbuffer().nbytes == 0:
+        log_size = log_data.seek(0, 2)
+        log_data.seek(0)
+        self.log_debug("Length of log buffer: %s" % log_size)
+        if log_size == 0:
             return ""
 
-        try:
-            for event in yaml.parse(log_data, Loader=yaml.CLoader):
-                if isinstance(event, yaml.MappingStartEvent):
-                    start_dict = True
-                    tmp_dict = {}
-                if isinstance(event, yaml.MappingEndEvent):
-                    start_dict = False
-                    if tmp_dict and tmp_dict.get('lvl') in ['target', 'feedback'] and 'msg' in tmp_dict.keys():
-                        if isinstance(tmp_dict['msg'], bytes):
-                            try:
-                                # seems like latin-1 is the encoding used by serial
-                                # this might not be true in all cases
-                                returned_log.write(tmp_dict["msg"].decode('latin-1', 'ignore') + "\n")
-                            except ValueError:
-                                # despite ignoring errors, they are still raised sometimes
-                                pass
-                        else:
-                            returned_log.write(tmp_dict['msg'] + "\n")
-                    del tmp_dict
-                    tmp_dict = None
-                    is_value = False
-                if start_dict is True and isinstance(event, yaml.ScalarEvent):
-                    if is_value is False:
-                        # the event.value is a dict key
-                        tmp_key = event.value
-                        is_value = True
-                    else:
-                        # the event.value is a dict value
-                        tmp_dict.update({tmp_key: event.value})
-                        is_value = False
-        except (yaml.scanner.ScannerError, yaml.parser.ParserError):
-            log_data.seek(0)
-            wrapper = TextIOWrapper(log_data, encoding='utf-8')
-            self.log_error("Problem parsing LAVA log\n" + wrapper.read() + "\n" + traceback.format_exc())
+        entry = b''
+        for line in log_data:
+            # entries start with "- "; anything else continues the current one
+            if line.startswith(b'- ') and entry:
+                self.__write_log_entry__(returned_log, entry)
+                entry = b''
+            entry += line
+        if entry:
+            self.__write_log_entry__(returned_log, entry)
 
         return returned_log.getvalue()
 
+    def __write_log_entry__(self, output, entry):
+        match = log_entry_level.match(entry)
+        if match and match.group(1) not in log_target_levels:
+            return
+
+        data = None
+        if match:
+            try:
+                data = json.loads(entry[2:])
+            except ValueError:
+                pass
+        if data is None:
+            try:
+                data = yaml.load(entry, Loader=yaml.CSafeLoader)
+            except yaml.YAMLError:
+                self.log_error("Problem parsing LAVA log entry\n" + entry.decode('utf-8', 'replace') + "\n" + traceback.format_exc())
+                return
+            if not isinstance(data, list) or len(data) != 1:
+                return
+            data = data[0]
+
+        if not isinstance(data, dict) or data.get('lvl') not in ['target', 'feedback'] or 'msg' not in data:
+            return
+
+        msg = data['msg']
+        if isinstance(msg, bytes):
+            try:
+                # seems like latin-1 is the encoding used by serial
+                # this might not be true in all cases
+                output.write(msg.decode('latin-1', 'ignore') + "\n")
+            except ValueError:
+                # despite ignoring errors, they are still raised sometimes
+                pass
+        else:
+            output.write(str(msg) + "\n")
+
     def __get_testjob_results_yaml__(self, job_id):
+        """
+        Retrieves the results of all test suites in the job. Suites are
+        retrieved concurrently (see `__map_concurrently__`), but the results
+        are returned in the same order LAVA lists the suites.
+        """
         self.log_debug("Retrieving result summary for job: %s" % job_id)
         lava_job_results = []
         if self.use_xml_rpc:
-            suites = self.proxy.results.get_testjob_suites_list_yaml(job_id)
-            y = yaml.safe_load(suites)
-            for suite in y:
-                limit = 500
-                offset = 0
-                while True:
-                    self.log_debug(
-                        "requesting results for %s with offset of %s"
-                        % (suite['name'], offset)
-                    )
-                    results = self.proxy.results.get_testsuite_results_yaml(
-                        job_id,
-                        suite['name'],
-                        limit,
-                        offset)
-                    yaml_results = yaml.load(results, Loader=yaml.CLoader)
-                    lava_job_results = lava_job_results + yaml_results
-                    if len(yaml_results) == limit:
-                        offset = offset + limit
-                    else:
-                        break
+            suites = yaml.safe_load(self.proxy.results.get_testjob_suites_list_yaml(job_id))
+            suites_names = [suite['name'] for suite in suites]
+            for results in self.__map_concurrently__(lambda name: self.__get_testsuite_results_xmlrpc__(job_id, name), suites_names):
+                lava_job_results.extend(results)
         else:
-            suites_resp = requests.get(
+            suites = []
+            suites_resp = self.session.get(
                 urljoin(self.api_url_base, "jobs/%s/suites/" % (job_id)),
                 headers=self.authentication,
                 timeout=self.settings.get(timeout_variable_name, DEFAULT_TIMEOUT)
             )
             while suites_resp.status_code == 200:
                 suites_content = suites_resp.json()
-                for suite in suites_content['results']:
-                    tests_resp = requests.get(
-                        urljoin(self.api_url_base, "jobs/%s/suites/%s/tests" % (job_id, suite['id'])),
-                        headers=self.authentication,
-                        timeout=self.settings.get(timeout_variable_name, DEFAULT_TIMEOUT)
-                    )
-                    while tests_resp.status_code == 200:
-                        tests_content = tests_resp.json()
-                        for test in tests_content['results']:
-                            test['suite'] = suite['name']
-                        lava_job_results = lava_job_results + tests_content['results']
-                        if tests_content['next']:
-                            tests_resp = requests.get(
-                                tests_content['next'],
-                                headers=self.authentication,
-                                timeout=self.settings.get(timeout_variable_name, DEFAULT_TIMEOUT)
-                            )
-                        else:
-                            break
+                suites += suites_content['results']
                 if suites_content['next']:
-                    suites_resp = requests.get(
+                    suites_resp = self.session.get(
                         suites_content['next'],
                         headers=self.authentication,
                         timeout=self.settings.get(timeout_variable_name, DEFAULT_TIMEOUT)
                     )
                 else:
                     break
+            for results in self.__map_concurrently__(lambda suite: self.__get_testsuite_results_rest__(job_id, suite), suites):
+                lava_job_results.extend(results)
 
         return lava_job_results
 
+    def __get_testsuite_results_xmlrpc__(self, job_id, suite_name):
+        # xmlrpc.client.ServerProxy objects are not thread safe, so each
+        # suite gets its own; they all share the connections of the pooled
+        # session, though, instead of opening a new one per request
+        proxy = self.__new_proxy__(session=self.session)
+        suite_results = []
+        limit = 500
+        offset = 0
+        while True:
+            self.log_debug(
+                "requesting results for %s with offset of %s"
+                % (suite_name, offset)
+            )
+            results = proxy.results.get_testsuite_results_yaml(
+                job_id,
+                suite_name,
+                limit,
+                offset)
+            yaml_results = yaml.load(results, Loader=yaml.CLoader)
+            suite_results.extend(yaml_results)
+            if len(yaml_results) == limit:
+                offset = offset + limit
+            else:
+                break
+        return suite_results
+
+    def __get_testsuite_results_rest__(self, job_id, suite):
+        suite_results = []
+        tests_resp = self.session.get(
+            urljoin(self.api_url_base, "jobs/%s/suites/%s/tests" % (job_id, suite['id'])),
+            headers=self.authentication,
+            timeout=self.settings.get(timeout_variable_name, DEFAULT_TIMEOUT)
+        )
+        while tests_resp.status_code == 200:
+            tests_content = tests_resp.json()
+            for test in tests_content['results']:
+                test['suite'] = suite['name']
+            suite_results.extend(tests_content['results'])
+            if tests_content['next']:
+                tests_resp = self.session.get(
+                    tests_content['next'],
+                    headers=self.authentication,
+                    timeout=self.settings.get(timeout_variable_name, DEFAULT_TIMEOUT)
+                )
+            else:
+                break
+        return suite_results
+
     def __get_publisher_event_socket__(self):
         if self.use_xml_rpc:
             return self.proxy.scheduler.get_publisher_event_socket()
@@ -644,6 +822,9 @@ class Backend(BaseBackend):
         if suite_versions:
             job_metadata['suite_versions'] = suite_versions
 
+        # built on the first test that has a log
+        indexed_log = None
+
         results = {}
         metrics = {}
         completed = True
@@ -666,7 +847,9 @@ class Backend(BaseBackend):
                         if 'log_end_line' in result.keys() and \
                                 result['log_start_line'] is not None and \
                                 result['log_end_line'] is not None:
-                            res_log += self.__download_test_log__(raw_logs, result['log_start_line'], result['log_end_line'])
+                            if indexed_log is None:
+                                indexed_log = IndexedLog(raw_logs)
+                            res_log += self.__download_test_log__(indexed_log, result['log_start_line'], result['log_end_line'])
                     # YAML from LAVA has all values serialized to strings
                     if result['measurement'] == 'None' or result['measurement'] is None:
                         res_value = result['result']
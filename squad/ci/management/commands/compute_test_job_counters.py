@@ -0,0 +1,71 @@
+import argparse
+import logging
+
+from datetime import timedelta, datetime
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from squad.core.models import Build
+from squad.ci.models import TestJobCounter
+
+
+logger = logging.getLogger()
+
+
+def valid_date(date):
+    try:
+        return datetime.strptime(date, "%Y-%m-%d")
+    except ValueError:
+        msg = "'{0}' is not a valid date.".format(
+            date)
+        raise argparse.ArgumentTypeError(msg)
+
+
+class Command(BaseCommand):
+
+    help = """Compute the test job counters of builds from their test jobs. Counters are
+    otherwise updated incrementally as test jobs change, so this can be used to repair them"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', help='Optionally, specify a project to compute, on the form $group/$project')
+        parser.add_argument('--show-progress', action='store_true', help='Prints out one dot per build in stdout')
+        parser.add_argument(
+            '--start-date',
+            dest="start_date",
+            default=(datetime.now() - timedelta(days=7)),
+            type=valid_date,
+            help="Only builds created from this date on (default: 7 days before current date, format: YYYY-MM-DD)."
+        )
+
+    def __progress__(self, show):
+        if show:
+            self.stdout.write(".", ending="")
+            self.stdout._out.flush()
+
+    def handle(self, *args, **options):
+        start_date = timezone.make_aware(options['start_date'])
+        project_name = options['project'] or False
+        show_progress = options['show_progress']
+
+        builds = Build.objects.filter(created_at__gte=start_date, test_jobs__isnull=False).distinct()
+
+        if project_name:
+            slugs = project_name.split('/')
+            if len(slugs) != 2:
+                logger.error('Project "%s" is malformed (should be group_slug/project_slug). Exiting...' % (project_name))
+                return
+
+            group_slug, project_slug = slugs
+            builds = builds.filter(project__group__slug=group_slug, project__slug=project_slug)
+
+        logger.info('Computing test job counters for %d builds' % (builds.count()))
+        if show_progress:
+            logger.info('Showing progress, one dot means one processed build')
+
+        for build in builds.order_by('id').iterator():
+            self.__progress__(show_progress)
+            TestJobCounter.refresh(build)
+
+        if show_progress:
+            self.stdout.write("")
+            self.stdout._out.flush()
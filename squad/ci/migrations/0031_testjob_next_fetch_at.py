@@ -0,0 +1,67 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:55
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def schedule_pending_test_jobs(apps, schema_editor):
+    Backend = apps.get_model('ci', 'Backend')
+    TestJob = apps.get_model('ci', 'TestJob')
+    for backend in Backend.objects.all():
+        pending = TestJob.objects.filter(
+            backend=backend,
+            submitted=True,
+            fetched=False,
+            fetch_attempts__lt=backend.max_fetch_attempts,
+        )
+        pending.filter(last_fetch_attempt__isnull=True).update(next_fetch_at=timezone.now())
+        pending.filter(last_fetch_attempt__isnull=False).update(
+            next_fetch_at=models.ExpressionWrapper(
+                models.F('last_fetch_attempt') + timedelta(minutes=backend.poll_interval),
+                output_field=models.DateTimeField(),
+            ),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ci', '0030_testjob_subtasks_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backend',
+            name='fetch_backoff',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='backend',
+            name='max_inflight_fetches',
+            field=models.IntegerField(default=100),
+        ),
+        migrations.AddField(
+            model_name='testjob',
+            name='fetch_queued_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='testjob',
+            name='next_fetch_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='testjob',
+            index=models.Index(fields=['backend', 'next_fetch_at'], name='ci_testjob_backend_86221d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='testjob',
+            index=models.Index(fields=['backend', 'fetch_queued_at'], name='ci_testjob_backend_2e2162_idx'),
+        ),
+        migrations.RunPython(
+            schedule_pending_test_jobs,
+            reverse_code=migrations.RunPython.noop,
+        ),
+    ]
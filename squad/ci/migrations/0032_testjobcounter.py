@@ -0,0 +1,55 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:40
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def count_test_jobs(apps, schema_editor):
+    TestJob = apps.get_model('ci', 'TestJob')
+    TestJobCounter = apps.get_model('ci', 'TestJobCounter')
+    counts = TestJob.objects.filter(target_build__isnull=False).annotate(
+        status=Coalesce('job_status', models.Value('')),
+    ).values('target_build_id', 'environment', 'status', 'fetched').annotate(total=models.Count('id')).order_by()
+    TestJobCounter.objects.bulk_create(
+        (
+            TestJobCounter(
+                build_id=c['target_build_id'],
+                environment=c['environment'],
+                job_status=c['status'],
+                fetched=c['fetched'],
+                count=c['total'],
+            )
+            for c in counts.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0061_project_enabled_plugins_list'),
+        ('ci', '0031_testjob_next_fetch_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestJobCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('environment', models.CharField(max_length=100)),
+                ('job_status', models.CharField(blank=True, default='', max_length=128)),
+                ('fetched', models.BooleanField(default=False)),
+                ('count', models.IntegerField(default=0)),
+                ('build', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='test_job_counters', to='core.build')),
+            ],
+            options={
+                'unique_together': {('build', 'environment', 'job_status', 'fetched')},
+            },
+        ),
+        migrations.RunPython(
+            count_test_jobs,
+            reverse_code=migrations.RunPython.noop,
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ci', '0032_testjobcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backend',
+            name='poll_scheduled_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+    ]
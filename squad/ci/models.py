@@ -1,10 +1,15 @@
-import json
 import logging
+import time
 import traceback
 import yaml
+from datetime import timedelta
 from io import StringIO
+from django.conf import settings
 from django.db import models, transaction, DatabaseError
-from django.db.models import Q
+from django.db.models import Count, F, Q, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.utils import timezone
 from dateutil.relativedelta import relativedelta
 
@@ -47,24 +52,90 @@ class Backend(models.Model):
     max_fetch_attempts = models.IntegerField(default=3)
     poll_enabled = models.BooleanField(default=True)
     listen_enabled = models.BooleanField(default=True)
+    max_inflight_fetches = models.IntegerField(default=100)
 
-    def poll(self):
-        if not self.poll_enabled:
-            return
-        test_jobs = self.test_jobs.filter(
+    # increased while fetches from this backend are slow or failing
+    # temporarily, and decreased when they are back to normal. Each level
+    # halves the number of fetches in flight, and doubles the interval
+    # between fetches of the same test job.
+    fetch_backoff = models.IntegerField(default=0)
+
+    # when the follow-up poll of this backend, if any, is due; see
+    # schedule_poll()
+    poll_scheduled_at = models.DateTimeField(null=True, editable=False)
+
+    MAX_FETCH_BACKOFF = 4
+
+    # maximum number of test jobs claimed at once by poll()
+    POLL_BATCH_SIZE = 500
+
+    # for how long a test job claimed by poll() is considered to be in
+    # flight; if it is not fetched by then, it is claimed again
+    FETCH_LEASE = timedelta(minutes=30)
+
+    def due_test_jobs(self, now=None):
+        return self.test_jobs.filter(
+            next_fetch_at__lte=(now or timezone.now()),
             submitted=True,
             fetched=False,
-            fetch_attempts__lt=self.max_fetch_attempts
+            fetch_attempts__lt=self.max_fetch_attempts,
         )
-        for test_job in test_jobs:
-            last = test_job.last_fetch_attempt
-            if last:
-                now = timezone.now()
-                next_poll = last + relativedelta(minutes=self.poll_interval)
-                if now > next_poll:
-                    yield test_job
-            else:
-                yield test_job
+
+    def inflight_fetches(self, now=None):
+        return self.test_jobs.filter(
+            fetch_queued_at__isnull=False,
+            next_fetch_at__gt=(now or timezone.now()),
+        ).count()
+
+    def fetch_slots(self, now=None):
+        limit = max(1, self.max_inflight_fetches >> self.fetch_backoff)
+        return limit - self.inflight_fetches(now)
+
+    def poll(self):
+        """
+        Claims up to POLL_BATCH_SIZE test jobs that are due to be fetched,
+        without exceeding the maximum number of fetches in flight, and
+        returns them.
+        """
+        if not self.poll_enabled:
+            return []
+
+        now = timezone.now()
+        limit = min(self.POLL_BATCH_SIZE, self.fetch_slots(now))
+        if limit <= 0:
+            return []
+
+        with transaction.atomic():
+            test_jobs = self.due_test_jobs(now).select_for_update(skip_locked=True).order_by('next_fetch_at')
+            ids = list(test_jobs.values_list('id', flat=True)[:limit])
+            TestJob.objects.filter(id__in=ids).update(
+                fetch_queued_at=now,
+                next_fetch_at=now + self.FETCH_LEASE,
+            )
+        return list(TestJob.objects.filter(id__in=ids).order_by('id'))
+
+    def schedule_poll(self, delay):
+        """
+        Reserves a follow-up poll of this backend in `delay` seconds, unless
+        one is already due later. Returns whether the caller should schedule
+        it, so that there is at most one follow-up poll for each backend no
+        matter how many polls run at the same time.
+        """
+        now = timezone.now()
+        return Backend.objects.filter(pk=self.pk).filter(
+            Q(poll_scheduled_at__isnull=True) | Q(poll_scheduled_at__lte=now),
+        ).update(poll_scheduled_at=now + timedelta(seconds=delay)) > 0
+
+    def next_fetch_at(self):
+        minutes = self.poll_interval * 2 ** self.fetch_backoff
+        return timezone.now() + relativedelta(minutes=minutes)
+
+    def __adjust_fetch_backoff__(self, slow):
+        backends = Backend.objects.filter(pk=self.pk)
+        if slow:
+            backends.filter(fetch_backoff__lt=self.MAX_FETCH_BACKOFF).update(fetch_backoff=F('fetch_backoff') + 1)
+        else:
+            backends.filter(fetch_backoff__gt=0).update(fetch_backoff=F('fetch_backoff') - 1)
 
     def fetch(self, job_id):
         # Job statuses can be one of:
@@ -88,19 +159,25 @@ class Backend(models.Model):
                 # another thread is working on this testjob
                 return
 
+            test_job.backend = self
+            started = time.monotonic()
             try:
                 test_job.last_fetch_attempt = timezone.now()
                 results = self.get_implementation().fetch(test_job)
+                self.__adjust_fetch_backoff__(time.monotonic() - started > settings.SQUAD_CI_SLOW_FETCH)
                 if results is None:
                     # empty results mean the job is still in progress
                     # or in the queue
+                    test_job.next_fetch_at = self.next_fetch_at()
                     test_job.save()
                     return
             except FetchIssue as issue:
                 logger.warning("error fetching job %s: %s" % (test_job.id, str(issue)))
+                self.__adjust_fetch_backoff__(issue.retry)
                 test_job.failure = str(issue)
                 test_job.fetched = not issue.retry
                 test_job.fetch_attempts += 1
+                test_job.next_fetch_at = self.next_fetch_at()
                 test_job.save()
                 return
 
@@ -128,12 +205,12 @@ class Backend(models.Model):
             metadata['job_url'] = test_job.url
         try:
             receive = ReceiveTestRun(test_job.target, update_project_status=False)
-            testrun, _ = receive(
+            testrun, _ = receive.receive_parsed(
                 version=test_job.target_build.version,
                 environment_slug=test_job.environment,
-                metadata_file=json.dumps(metadata),
-                tests_file=json.dumps(tests),
-                metrics_file=json.dumps(metrics),
+                metadata=metadata,
+                tests=tests,
+                metrics=metrics,
                 log_file=logs,
                 completed=completed,
             )
@@ -271,6 +348,13 @@ class TestJob(models.Model):
     fetched = models.BooleanField(default=False)
     fetch_attempts = models.IntegerField(default=0)
     last_fetch_attempt = models.DateTimeField(null=True, default=None, blank=True)
+
+    # when this test job is due to be fetched, if it is still waiting to be
+    # fetched; maintained by save()
+    next_fetch_at = models.DateTimeField(null=True, default=None, blank=True)
+
+    # when this test job was claimed by Backend.poll() to be fetched
+    fetch_queued_at = models.DateTimeField(null=True, default=None, blank=True)
     failure = models.TextField(null=True, blank=True)
 
     can_resubmit = models.BooleanField(default=False)
@@ -403,13 +487,63 @@ class TestJob(models.Model):
         if self.testrun:
             UpdateProjectStatus()(self.testrun)
 
+    # fields that identify the TestJobCounter this test job is counted in
+    COUNTER_FIELDS = ('target_build_id', 'environment', 'job_status', 'fetched')
+
+    # the COUNTER_FIELDS values this test job was loaded or last saved with,
+    # i.e. the counter to decrement when it is deleted
+    __counted__ = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(TestJob, cls).from_db(db, field_names, values)
+        if not instance.get_deferred_fields() & set(cls.COUNTER_FIELDS):
+            instance.__counted__ = instance.__counter_key__()
+        return instance
+
+    def __counter_key__(self):
+        return tuple(getattr(self, f) for f in self.COUNTER_FIELDS)
+
+    def save(self, *args, **kwargs):
+        self.next_fetch_at = self.__next_fetch_at__()
+
+        with transaction.atomic():
+            counted = None
+            if self.pk is not None:
+                # the row is locked so that concurrent saves of the same test
+                # job (e.g. by the listener and by fetch) adjust the counters
+                # from what is actually stored, and not from what each of
+                # them loaded
+                counted = TestJob.objects.select_for_update().filter(pk=self.pk).values_list(*self.COUNTER_FIELDS).first()
+
+            super(TestJob, self).save(*args, **kwargs)
+            key = self.__counter_key__()
+            if key != counted:
+                TestJobCounter.add(counted, -1)
+                TestJobCounter.add(key, 1)
+            self.__counted__ = key
+
+    def __next_fetch_at__(self):
+        if self.fetched or not self.submitted:
+            return None
+        if self.fetch_attempts >= self.backend.max_fetch_attempts:
+            return None
+        if self.next_fetch_at:
+            return self.next_fetch_at
+        if self.last_fetch_attempt:
+            return self.last_fetch_attempt + relativedelta(minutes=self.backend.poll_interval)
+        return timezone.now()
+
     def __str__(self):
         return "%s/%s" % (self.backend.name, self.job_id)
 
     class Meta:
-        # This index speeds up Backend.poll(), where it queries submitted and fetched together
         indexes = [
             models.Index(fields=['submitted', 'fetched']),
+            # these speed up Backend.poll(), which looks for test jobs that
+            # are due to be fetched, and counts the ones in flight
+            models.Index(fields=['backend', 'next_fetch_at']),
+            models.Index(fields=['backend', 'fetch_queued_at']),
         ]
 
     @staticmethod
@@ -441,6 +575,71 @@ class TestJob(models.Model):
                 return False
 
 
+@receiver(post_delete, sender=TestJob)
+def uncount_test_job(sender, instance, **kwargs):
+    TestJobCounter.add(instance.__counted__ or instance.__counter_key__(), -1)
+
+
+class TestJobCounter(models.Model):
+    """
+    Number of test jobs of a build with a given environment, job status, and
+    whether they have been fetched or not. These are maintained by TestJob
+    as test jobs change, so that the progress of a build can be obtained
+    without going through all of its test jobs; see
+    Build.test_jobs_summary and Build.finished.
+
+    Test jobs without a job status are counted with an empty `job_status`.
+    """
+    build = models.ForeignKey(Build, related_name='test_job_counters', on_delete=models.CASCADE)
+    environment = models.CharField(max_length=100)
+    job_status = models.CharField(max_length=128, default='', blank=True)
+    fetched = models.BooleanField(default=False)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('build', 'environment', 'job_status', 'fetched')
+
+    @classmethod
+    def add(cls, key, delta):
+        """
+        Adds `delta` to the counter for `key`, a tuple with the values of
+        TestJob.COUNTER_FIELDS.
+        """
+        if key is None or key[0] is None:
+            return
+        build_id, environment, job_status, fetched = key
+        fields = {
+            'build_id': build_id,
+            'environment': environment or '',
+            'job_status': job_status or '',
+            'fetched': fetched,
+        }
+        if delta > 0:
+            cls.objects.bulk_create([cls(**fields)], ignore_conflicts=True)
+        cls.objects.filter(**fields).update(count=F('count') + delta)
+
+    @classmethod
+    def refresh(cls, build):
+        """
+        Recalculates the counters of `build` from its test jobs.
+        """
+        counts = build.test_jobs.annotate(
+            status=Coalesce('job_status', Value('')),
+        ).values('environment', 'status', 'fetched').annotate(total=Count('id')).order_by()
+        with transaction.atomic():
+            cls.objects.filter(build=build).delete()
+            cls.objects.bulk_create([
+                cls(
+                    build=build,
+                    environment=c['environment'],
+                    job_status=c['status'],
+                    fetched=c['fetched'],
+                    count=c['total'],
+                )
+                for c in counts
+            ])
+
+
 class ResultsInput(models.Model):
     test_job = models.OneToOneField(TestJob, related_name='results_input', on_delete=models.CASCADE, null=True)
     text = models.TextField(null=True, blank=True)
@@ -13,6 +13,12 @@ from django.template.loader import render_to_string
 logger = get_task_logger(__name__)
 
 
+# number of seconds to wait before polling a backend again, when it has test
+# jobs due to be fetched but its maximum number of fetches in flight has been
+# reached
+POLL_RETRY_DELAY = 60
+
+
 @celery.task
 def poll(backend_id=None):
     if backend_id:
@@ -20,8 +26,18 @@ def poll(backend_id=None):
     else:
         backends = Backend.objects.all()
     for backend in backends:
-        for test_job in backend.poll():
-            fetch.apply_async(args=(test_job.id,), task_id=task_id(test_job))
+        # test jobs are claimed in batches, until there are no more due test
+        # jobs or no more free fetch slots
+        while True:
+            claimed = 0
+            for test_job in backend.poll():
+                fetch.apply_async(args=(test_job.id,), task_id=task_id(test_job))
+                claimed += 1
+            if claimed == 0:
+                break
+
+        if backend.poll_enabled and backend.due_test_jobs().exists() and backend.schedule_poll(POLL_RETRY_DELAY):
+            poll.apply_async(args=(backend.id,), countdown=POLL_RETRY_DELAY)
 
 
 @celery.task
@@ -33,6 +49,9 @@ def fetch(job_id):
             testjob.backend.fetch(testjob.id)
     except TestJob.DoesNotExist:
         return
+    finally:
+        # frees the fetch slot taken by Backend.poll()
+        TestJob.objects.filter(pk=job_id).update(fetch_queued_at=None)
 
 
 @celery.task
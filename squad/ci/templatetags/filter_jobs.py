@@ -5,8 +5,8 @@ from squad.jinja2 import register_filter
 @register_filter
 def filter_jobs(build):
     statuses = defaultdict(int)
-    for status in build.test_jobs.values_list('job_status'):
-        key = status[0] or 'Created'
-        statuses[key] += 1
+    for status, count in build.test_jobs_summary().items():
+        key = status or 'Created'
+        statuses[key] += count
     filtered_jobs = [(status, statuses[status]) for status in statuses]
     return filtered_jobs
@@ -1,16 +1,96 @@
 from collections import OrderedDict, defaultdict
-from django.db.models import F
+from django.core.paginator import Paginator
+from django.db.models import Case, CharField, Count, F, Q, Value, When
 from django.db.models import prefetch_related_objects
 from itertools import groupby
 from functools import reduce
+import operator
 import statistics
 
 
-from squad.core.queries import test_confidence
-from squad.core.utils import parse_name, join_name, split_dict
+from squad.core.utils import parse_name, join_name
 from squad.core import models
 
 
+# When duplicates of a test disagree, the most common status wins; ties are
+# broken by this order. See squad.core.queries.test_confidence
+STATUS_PRIORITY = ['fail', 'pass', 'xfail', 'skip']
+
+
+STATUS_CONDITIONS = {
+    'fail': Q(result=False) & ~Q(has_known_issues=True),
+    'pass': Q(result=True),
+    'xfail': Q(result=False, has_known_issues=True),
+    'skip': Q(result__isnull=True),
+}
+
+
+def status_counts(prefix='', condition=None):
+    """
+    Returns aggregate annotations counting tests by status, named
+    `<prefix><status>`, optionally restricted to the tests matching
+    `condition`.
+    """
+    annotations = {}
+    for status, status_condition in STATUS_CONDITIONS.items():
+        if condition is not None:
+            status_condition = status_condition & condition
+        annotations[prefix + status] = Count('id', filter=status_condition)
+    return annotations
+
+
+def resolved_status(prefix=''):
+    """
+    Returns an expression that resolves the counts annotated by
+    `status_counts` into a single status, the same way `test_confidence`
+    does, or 'n/a' if there are no tests at all.
+    """
+    cases = []
+    for index, status in enumerate(STATUS_PRIORITY):
+        condition = Q(**{prefix + status + '__gt': 0})
+        for other_index, other in enumerate(STATUS_PRIORITY):
+            if other == status:
+                continue
+            lookup = '__gt' if other_index < index else '__gte'
+            condition &= Q(**{prefix + status + lookup: F(prefix + other)})
+        cases.append(When(condition, then=Value(status)))
+    return Case(*cases, default=Value('n/a'), output_field=CharField())
+
+
+def resolved_test_results(builds, metadata_ids=None):
+    """
+    Returns one row per (build, environment slug, test metadata) in the given
+    builds, with the test status resolved in the database. `total` is the
+    number of duplicates of the test, and `<status>` their count per status.
+    """
+    tests = models.Test.objects.filter(build__in=builds)
+    if metadata_ids is not None:
+        tests = tests.filter(metadata_id__in=metadata_ids)
+
+    return tests.values(
+        'build_id',
+        'environment__slug',
+        'metadata_id',
+    ).order_by().annotate(
+        total=Count('id'),
+        **status_counts()
+    ).annotate(
+        status=resolved_status(),
+    )
+
+
+def resolved_result(row):
+    """
+    Returns the value of a comparison cell for a row from
+    `resolved_test_results`: just the status, or [status, confidence] when
+    there are duplicates.
+    """
+    status = row['status']
+    if row['total'] == 1:
+        return status
+    return [status, row[status] / row['total'] * 100]
+
+
 class BaseComparison(object):
     """
     Data structure:
@@ -211,6 +291,19 @@ class MetricComparison(BaseComparison):
         if self.builds[0] is None:
             # No baseline is present, then no comparison is needed
             return
+
+        baseline = self.builds[0]
+        target = self.builds[1]
+
+        cached = models.BuildComparison.get(baseline, target, models.BuildComparison.METRICS)
+        if cached is None:
+            cached = self.__compute_regressions_and_fixes__()
+            models.BuildComparison.store(baseline, target, models.BuildComparison.METRICS, cached)
+
+        self.__regressions__ = OrderedDict(cached['regressions'])
+        self.__fixes__ = OrderedDict(cached['fixes'])
+
+    def __compute_regressions_and_fixes__(self):
         target = self.builds[1]
 
         query = self.base_sql.copy()
@@ -254,13 +347,10 @@ class MetricComparison(BaseComparison):
                         continue
                     regs_and_fixes[threshold.is_higher_better][metric.result > 0][env.slug].append(metric.full_name)
 
-        self.__regressions__ = OrderedDict()
-        for env in regressions.keys():
-            self.__regressions__[env] = regressions[env]
-
-        self.__fixes__ = OrderedDict()
-        for env in fixes.keys():
-            self.__fixes__[env] = fixes[env]
+        return {
+            'regressions': OrderedDict(regressions),
+            'fixes': OrderedDict(fixes),
+        }
 
     @property
     def regressions(self):
@@ -344,7 +434,6 @@ class TestComparison(BaseComparison):
 
     def __init__(self, *builds, regressions_and_fixes_only=False):
         self.__intermittent__ = {}
-        self.tests_with_issues = {}
         self.__failures__ = None
         self.regressions_and_fixes_only = regressions_and_fixes_only
 
@@ -355,32 +444,34 @@ class TestComparison(BaseComparison):
         # New implementation below is only stable for getting regressions and fixes
         # that is used for receiving tests and generating ProjectStatus.regressions and fixes
         # It is still not good for applying transitions and getting a comparison
-        # results table, for that, use legacy code, which is slow and eats up lots
-        # of memory
+        # results table, for that, use the code below, which loads the full
+        # results table in memory. For paginated results tables, use
+        # PaginatedTestComparison instead.
         if self.regressions_and_fixes_only:
             self.__new_extract_results__()
             return
 
+        builds = {build.id: build for build in self.builds}
+
         test_runs = models.TestRun.objects.filter(
             build__in=self.builds,
-        ).prefetch_related(
-            'build',
-            'environment',
-        ).only('build', 'environment')
-
-        test_runs_ids = {}
-        for test_run in test_runs:
-            build = test_run.build
-            env = test_run.environment.slug
-
+        ).values_list('build_id', 'environment__slug').distinct().order_by()
+        for build_id, env in test_runs:
             self.all_environments.add(env)
-            self.environments[build].add(env)
+            self.environments[builds[build_id]].add(env)
 
-            if test_runs_ids.get(test_run.id, None) is None:
-                test_runs_ids[test_run.id] = (build, env)
+        rows = list(resolved_test_results(self.builds))
+        metadata = models.SuiteMetadata.objects.filter(
+            id__in=set(row['metadata_id'] for row in rows),
+        ).only('suite', 'name').in_bulk()
 
-        for ids in split_dict(test_runs_ids, chunk_size=100):
-            self.__extract_test_results__(ids)
+        for row in rows:
+            test_metadata = metadata[row['metadata_id']]
+            full_name = join_name(test_metadata.suite, test_metadata.name)
+            if full_name not in self.results:
+                self.results[full_name] = OrderedDict()
+            key = (builds[row['build_id']], row['environment__slug'])
+            self.results[full_name][key] = resolved_result(row)
 
         self.__resolve_intermittent_tests__()
 
@@ -388,49 +479,20 @@ class TestComparison(BaseComparison):
         for build in self.builds:
             self.environments[build] = sorted(self.environments[build])
 
-    def __extract_test_results__(self, test_runs_ids):
-        self.__failures__ = OrderedDict()
-
-        tests = models.Test.objects.filter(test_run_id__in=test_runs_ids.keys()).annotate(
-            suite_slug=F('suite__slug'),
-        ).prefetch_related('metadata').defer('log').order_by()
-
-        for test in tests:
-            build, env = test_runs_ids.get(test.test_run_id)
-
-            full_name = join_name(test.suite_slug, test.name)
-            if full_name not in self.results:
-                self.results[full_name] = OrderedDict()
-
-            key = (build, env)
-            if key in self.results[full_name]:  # Duplicate found.
-                if not isinstance(self.results[full_name][key], tuple):
-                    # Test confidence is NOT already caclulated.
-                    self.results[full_name][key] = test_confidence(test)
-            else:
-                self.results[full_name][key] = test.status
-
-            if test.has_known_issues:
-                self.tests_with_issues[test.id] = (full_name, env)
-
-            if test.status == 'fail' and build.id == self.builds[-1].id:
-                if env not in self.__failures__:
-                    self.__failures__[env] = []
-                self.__failures__[env].append(test)
-
     def __resolve_intermittent_tests__(self):
-        if len(self.tests_with_issues) == 0:
-            return
-
-        for chunk in split_dict(self.tests_with_issues, chunk_size=100):
-            tests = models.Test.objects.filter(id__in=chunk.keys()).prefetch_related(
-                'known_issues'
-            ).only('known_issues')
-            for test in tests.all():
-                for issue in test.known_issues.all():
-                    if issue.intermittent:
-                        self.__intermittent__[chunk[test.id]] = True
-                        break
+        intermittent = models.Test.known_issues.through.objects.filter(
+            test__build__in=self.builds,
+            test__result=False,
+            test__has_known_issues=True,
+            knownissue__intermittent=True,
+        ).values_list(
+            'test__metadata__suite',
+            'test__metadata__name',
+            'test__environment__slug',
+        ).distinct().order_by()
+
+        for suite, name, env in intermittent:
+            self.__intermittent__[(join_name(suite, name), env)] = True
 
     __regressions__ = None
     __fixes__ = None
@@ -542,6 +604,14 @@ class TestComparison(BaseComparison):
         baseline = self.builds[0]
         target = self.builds[1]
 
+        cached = models.BuildComparison.get(baseline, target, models.BuildComparison.TESTS)
+        if cached is None:
+            cached = self.__compute_regressions_and_fixes__()
+            models.BuildComparison.store(baseline, target, models.BuildComparison.TESTS, cached)
+
+        self.__load_regressions_and_fixes__(**cached)
+
+    def __compute_regressions_and_fixes__(self):
         query = self.base_sql.copy()
         query['select'].append('target.result')
         query['select'].append('target.has_known_issues')
@@ -556,59 +626,61 @@ class TestComparison(BaseComparison):
         envs = {e.id: e for e in models.Environment.objects.filter(id__in=env_ids).all()}
         envs_slugs = sorted({e.slug for e in envs.values()})
 
-        for build in self.builds:
-            self.environments[build] = envs_slugs
-
         fixed_tests = defaultdict(set)
         regressions = defaultdict(set)
         fixes = defaultdict(set)
 
         for test in tests:
             env_id = test.environment_id
-
-            full_name = test.full_name
-            if full_name not in self.results:
-                self.results[full_name] = OrderedDict()
-
-            baseline_key = (baseline, envs[env_id].slug)
-            target_key = (target, envs[env_id].slug)
-
             if test.status == 'fail':
-                regressions[env_id].add(full_name)
-                self.results[full_name][target_key] = 'fail'
-                self.results[full_name][baseline_key] = 'pass'
+                regressions[env_id].add(test.full_name)
             elif test.status == 'pass':
-                fixes[env_id].add(full_name)
+                fixes[env_id].add(test.full_name)
                 fixed_tests[env_id].add(test.metadata_id)
-                self.results[full_name][target_key] = 'pass'
-                self.results[full_name][baseline_key] = 'fail'
-
-        self.results = OrderedDict(sorted(self.results.items()))
 
+        regressions_by_slug = OrderedDict()
         for env_id in regressions.keys():
-            self.__regressions__[envs[env_id].slug] = list(regressions[env_id])
+            regressions_by_slug[envs[env_id].slug] = list(regressions[env_id])
 
         # It's not a fix if baseline test is intermittent for a given environment:
         # - test.has_known_issues == True and
         # - test.known_issues[env].intermittent == True
         fixed_tests_environment_slugs = [envs[env_id] for env_id in fixed_tests.keys()]
         intermittent_fixed_tests = self.__intermittent_fixed_tests__(fixed_tests, fixed_tests_environment_slugs)
+        fixes_by_slug = OrderedDict()
         for env_id in fixes.keys():
             env_slug = envs[env_id].slug
             test_list = [test for test in fixes[env_id] if (test, env_slug) not in intermittent_fixed_tests]
             if len(test_list):
-                self.__fixes__[env_slug] = test_list
+                fixes_by_slug[env_slug] = test_list
 
-        for env in envs.values():
-            if env.slug in self.__regressions__:
-                for test in self.__regressions__[env.slug]:
-                    self.__diff__[test][target][env.slug] = False
-                    self.__diff__[test][baseline][env.slug] = True
+        return {
+            'environments': envs_slugs,
+            'regressions': regressions_by_slug,
+            'fixes': fixes_by_slug,
+        }
+
+    def __load_regressions_and_fixes__(self, environments, regressions, fixes):
+        baseline = self.builds[0]
+        target = self.builds[1]
+
+        for build in self.builds:
+            self.environments[build] = environments
 
-            if env.slug in self.__fixes__:
-                for test in self.__fixes__[env.slug]:
-                    self.__diff__[test][target][env.slug] = True
-                    self.__diff__[test][baseline][env.slug] = False
+        self.__regressions__ = OrderedDict(regressions)
+        self.__fixes__ = OrderedDict(fixes)
+
+        for changes, target_status, baseline_status in ((regressions, 'fail', 'pass'), (fixes, 'pass', 'fail')):
+            for env, tests in changes.items():
+                for test in tests:
+                    if test not in self.results:
+                        self.results[test] = OrderedDict()
+                    self.results[test][(target, env)] = target_status
+                    self.results[test][(baseline, env)] = baseline_status
+                    self.__diff__[test][target][env] = (target_status == 'pass')
+                    self.__diff__[test][baseline][env] = (baseline_status == 'pass')
+
+        self.results = OrderedDict(sorted(self.results.items()))
 
     def __intermittent_fixed_tests__(self, fixed_tests, environment_slugs):
         intermittent_fixed_tests = {}
@@ -640,3 +712,104 @@ class TestComparison(BaseComparison):
                     intermittent_fixed_tests[key] = True
 
         return intermittent_fixed_tests
+
+
+class PaginatedTestComparison(object):
+    """
+    Test results table for N builds, like TestComparison, but computed one
+    page at a time: statuses are resolved, transitions are filtered and rows
+    are paginated in the database, so the cost of a page depends on the
+    number of rows displayed instead of on the size of the builds.
+
+    `transitions` is a list of (status before, status after) tuples, where
+    the statuses are taken from the last two builds, and 'n/a' means the
+    test is missing from that build. When transitions are given, only the
+    tests (and the environments) with at least one of them are displayed.
+
+    `results` is a django Page, whose items are (full test name, results)
+    tuples with the same `results` mapping that TestComparison uses.
+    """
+
+    __test__ = False
+
+    def __init__(self, *builds, transitions=None, page=1, per_page=50):
+        self.builds = [b for b in builds if b]
+        self.transitions = transitions or []
+        self.environments = OrderedDict()
+        self.all_environments = set()
+
+        metadata = self.__rows__().order_by('suite', 'name')
+        self.paginator = Paginator(metadata, per_page)
+        self.results = self.paginator.page(page)
+        self.results.object_list = self.__results__(self.results.object_list)
+
+    @classmethod
+    def compare_builds(cls, *builds, **kwargs):
+        return cls(*builds, **kwargs)
+
+    @classmethod
+    def compare_projects(cls, *projects, **kwargs):
+        builds = [p.builds.last() for p in projects]
+        return cls.compare_builds(*builds, **kwargs)
+
+    def __changes__(self):
+        """
+        Returns one row per (environment slug, test metadata) whose status
+        transition between the last two builds is one of `transitions`.
+        """
+        before = self.builds[-2]
+        after = self.builds[-1]
+        changes = models.Test.objects.filter(
+            build__in=[before, after],
+        ).values(
+            'environment__slug',
+            'metadata_id',
+        ).order_by().annotate(
+            **status_counts('before_', Q(build=before)),
+            **status_counts('after_', Q(build=after))
+        ).annotate(
+            status_before=resolved_status('before_'),
+            status_after=resolved_status('after_'),
+        )
+
+        condition = reduce(operator.or_, [
+            Q(status_before=_from, status_after=_to)
+            for _from, _to in self.transitions
+        ])
+        return changes.filter(condition)
+
+    def __rows__(self):
+        environments = models.TestRun.objects.filter(
+            build__in=self.builds,
+        ).values_list('build_id', 'environment__slug').distinct().order_by()
+
+        if len(self.transitions) == 0 or len(self.builds) < 2:
+            envs = defaultdict(set)
+            for build_id, env in environments:
+                envs[build_id].add(env)
+                self.all_environments.add(env)
+            for build in self.builds:
+                self.environments[build] = sorted(envs[build.id])
+
+            metadata_ids = models.Test.objects.filter(build__in=self.builds).values('metadata_id')
+            return models.SuiteMetadata.objects.filter(id__in=metadata_ids)
+
+        changes = self.__changes__()
+        self.all_environments = set(changes.values_list('environment__slug', flat=True).distinct())
+        for build in self.builds:
+            self.environments[build] = sorted(self.all_environments)
+
+        return models.SuiteMetadata.objects.filter(id__in=changes.values('metadata_id'))
+
+    def __results__(self, metadata):
+        builds = {build.id: build for build in self.builds}
+        results = OrderedDict()
+        for test_metadata in metadata:
+            full_name = join_name(test_metadata.suite, test_metadata.name)
+            results[test_metadata.id] = (full_name, OrderedDict())
+
+        for row in resolved_test_results(self.builds, results.keys()):
+            key = (builds[row['build_id']], row['environment__slug'])
+            results[row['metadata_id']][1][key] = resolved_result(row)
+
+        return list(results.values())
@@ -1,5 +1,7 @@
+import codecs
 import json
 import math
+import re
 from statistics import mean
 
 
@@ -17,32 +19,202 @@ def parse_test_result(value):
     return test_result_mapping.get(v, None)
 
 
+class NotAJSONObject(ValueError):
+    """
+    Raised when iterating over JSON data whose top-level value is not an
+    object. The offending value is available in the `obj` attribute.
+    """
+
+    def __init__(self, obj):
+        super().__init__("%r is not an object" % obj)
+        self.obj = obj
+
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class JSONObjectStream(object):
+    """
+    Incremental reader for a JSON object. `source` can be either a string or
+    a file-like object (text or binary, in which case UTF-8 is assumed).
+    Only the portion of the input that has not been consumed yet is kept in
+    memory, so the memory usage is bounded by the size of the largest
+    key/value pair and not by the size of the whole input.
+    """
+
+    decoder = json.JSONDecoder()
+
+    def __init__(self, source, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        if isinstance(source, bytes):
+            source = source.decode()
+        if not isinstance(source, str):
+            seekable = getattr(source, 'seekable', None)
+            if seekable is not None and seekable():
+                self.start = source.tell()
+            else:
+                # the input is read twice, see __iter__
+                source = source.read()
+                if isinstance(source, bytes):
+                    source = source.decode()
+        self.source = source
+        self.__rewind__()
+
+    def __rewind__(self):
+        self.pos = 0
+        if isinstance(self.source, str):
+            self.buffer = self.source
+            self.stream = None
+        else:
+            self.source.seek(self.start)
+            self.buffer = ''
+            self.stream = self.source
+            self.utf8 = codecs.getincrementaldecoder('utf-8')()
+
+    def __read_more__(self):
+        if self.stream is None:
+            return False
+        # read at least as much as what is left in the buffer, so that
+        # values larger than chunk_size don't take quadratic time
+        data = self.stream.read(max(self.chunk_size, len(self.buffer) - self.pos))
+        if isinstance(data, bytes):
+            data = self.utf8.decode(data, final=(not data))
+        if not data:
+            self.stream = None
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def __error__(self, message):
+        return json.JSONDecodeError(message, self.buffer, self.pos)
+
+    def __peek__(self):
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.__read_more__():
+                return ''
+
+    def __expect__(self, char):
+        if self.__peek__() != char:
+            raise self.__error__("Expecting %r" % char)
+        self.pos += 1
+
+    def __value__(self):
+        self.__peek__()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a number at the end of the buffer might continue in the
+                # next chunk
+                if end < len(self.buffer) or not self.__read_more__():
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if not self.__read_more__():
+                    raise
+
+    def __iter__(self):
+        """
+        Yields the (key, value) pairs of the object. Like with `json.loads`,
+        the last value of a repeated key wins: the input is read once to
+        find the position of the last occurrence of each key, and only then
+        read again to yield the pairs. Invalid input is therefore reported
+        before any pair is yielded.
+        """
+        last = {}
+        count = 0
+        for key, _ in self.__pairs__():
+            last[key] = count
+            count += 1
+
+        self.__rewind__()
+        if len(last) == count:
+            yield from self.__pairs__()
+            return
+        for index, (key, value) in enumerate(self.__pairs__()):
+            if last[key] == index:
+                yield key, value
+
+    def __pairs__(self):
+        first = self.__peek__()
+        if first == '':
+            return
+        if first != '{':
+            obj = self.__value__()
+            self.__end__()
+            raise NotAJSONObject(obj)
+        self.pos += 1
+
+        if self.__peek__() == '}':
+            self.pos += 1
+        else:
+            while True:
+                if self.__peek__() != '"':
+                    raise self.__error__("Expecting property name enclosed in double quotes")
+                key = self.__value__()
+                self.__expect__(':')
+                value = self.__value__()
+                yield key, value
+
+                separator = self.__peek__()
+                self.pos += 1
+                if separator == '}':
+                    break
+                if separator != ',':
+                    self.pos -= 1
+                    raise self.__error__("Expecting ',' delimiter")
+        self.__end__()
+
+    def __end__(self):
+        if self.__peek__() != '':
+            raise self.__error__("Extra data")
+
+
+def iterate_json_object(source, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Iterates over the (key, value) pairs of the JSON object in `source`
+    without loading it all in memory. See `JSONObjectStream`.
+    """
+    if source is None:
+        return iter(())
+    return iter(JSONObjectStream(source, chunk_size))
+
+
 class JSONTestDataParser(object):
     """
-    Parser for test data as JSON string
+    Parser for test data as JSON string or file
     """
 
     @staticmethod
     def __call__(test_data):
-        if test_data is None or test_data == '':
-            return []
+        return list(JSONTestDataParser.iterate(test_data))
+
+    @staticmethod
+    def iterate(test_data):
+        return JSONTestDataParser.iterate_items(iterate_json_object(test_data))
 
-        input_data = json.loads(test_data)
-        data = []
-        for key, value in input_data.items():
+    @staticmethod
+    def iterate_items(items):
+        """
+        Same as `iterate`, for (key, value) pairs of already decoded data
+        """
+        for key, value in items:
             group_name, test_name = parse_name(key)
             result = value
             log = None
             if isinstance(value, dict):
                 result = value.get('result', None)
                 log = value.get('log', None)
-            data.append({
+            yield {
                 "group_name": group_name,
                 "test_name": test_name,
                 "pass": parse_test_result(result),
                 "log": log
-            })
-        return data
+            }
 
 
 def parse_metric(value):
@@ -55,17 +227,23 @@ def parse_metric(value):
 
 class JSONMetricDataParser(object):
     """
-    Parser for JSON metric data
+    Parser for JSON metric data, as string or file
     """
 
     @staticmethod
     def __call__(json_text):
-        if json_text is None or json_text == '':
-            return []
+        return list(JSONMetricDataParser.iterate(json_text))
+
+    @staticmethod
+    def iterate(json_text):
+        return JSONMetricDataParser.iterate_items(iterate_json_object(json_text))
 
-        input_data = json.loads(json_text)
-        data = []
-        for metric, value_dict in input_data.items():
+    @staticmethod
+    def iterate_items(items):
+        """
+        Same as `iterate`, for (key, value) pairs of already decoded data
+        """
+        for metric, value_dict in items:
             unit = None
             if type(value_dict) is dict:
                 unit = value_dict.get('unit', None)
@@ -75,11 +253,10 @@ class JSONMetricDataParser(object):
             group_name, name = parse_name(metric)
             result, measurements = parse_metric(value)
             if result is not None and not (math.isnan(result) or math.isinf(result)):
-                data.append({
+                yield {
                     "name": name,
                     "group_name": group_name,
                     "result": result,
                     "measurements": measurements,
                     "unit": unit,
-                })
-        return data
+                }
@@ -1,6 +1,42 @@
+from collections import defaultdict
 from django.db.models import prefetch_related_objects
 
-from squad.core.models import Test
+from squad.core.models import TestResultHistory
+
+
+def confidence_counts(project, failures, builds_ids):
+    """
+    Returns a dict mapping (metadata_id, environment_id) to the number of
+    passes and the total number of tests in the given builds, for all the
+    given failures. The histories of all failures are fetched in a single
+    query.
+    """
+    builds_ids = set(builds_ids)
+    keys = set((f.metadata_id, f.environment_id) for f in failures)
+
+    counts = defaultdict(lambda: (0, 0))
+    if not keys or not builds_ids:
+        return counts
+
+    histories = TestResultHistory.objects.filter(
+        project=project,
+        metadata_id__in=set(m for m, _ in keys),
+        environment_id__in=set(e for _, e in keys),
+    ).only('metadata_id', 'environment_id', 'entries')
+
+    for history in histories:
+        key = (history.metadata_id, history.environment_id)
+        if key not in keys:
+            continue
+        passes = 0
+        count = 0
+        for build_id, results in history.results.items():
+            if build_id in builds_ids:
+                passes += sum(1 for r in results if r)
+                count += len(results)
+        counts[key] = (passes, count)
+
+    return counts
 
 
 def failures_with_confidence(project, build, failures, releases_only=False):
@@ -12,17 +48,12 @@ def failures_with_confidence(project, build, failures, releases_only=False):
     queryset = project.builds.filter(id__lt=build.id)
     if releases_only:
         queryset = queryset.filter(is_release=True)
-    builds = queryset.order_by('-id').all()[:limit]
-    builds_ids = [b.id for b in builds]
+    builds_ids = list(queryset.order_by('-id').values_list('id', flat=True)[:limit])
 
     # Find previous `limit` tests that contain this test x environment
+    counts = confidence_counts(project, failures, builds_ids)
     for failure in failures:
-        history = Test.objects.filter(
-            build_id__in=builds_ids,
-            metadata_id=failure.metadata_id,
-            environment_id=failure.environment_id,
-        ).only("result").order_by()
-
-        failure.set_confidence(threshold, history)
+        passes, count = counts[(failure.metadata_id, failure.environment_id)]
+        failure.set_confidence_counts(threshold, passes, count)
 
     return failures
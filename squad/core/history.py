@@ -3,7 +3,7 @@ from django.core.paginator import Paginator
 
 from squad.core.queries import test_confidence
 from squad.core.utils import parse_name
-from squad.core.models import SuiteMetadata, KnownIssue, Environment, Build
+from squad.core.models import SuiteMetadata, KnownIssue, Environment, Build, Test
 
 
 class TestResult(object):
@@ -54,13 +54,6 @@ class TestHistory(object):
 
         self.top = builds[0]
 
-        issues_by_env = {}
-        for issue in KnownIssue.active_by_project_and_test(project, full_test_name).all():
-            for env in issue.environments.all():
-                if env.id not in issues_by_env:
-                    issues_by_env[env.id] = []
-                issues_by_env[env.id].append(issue)
-
         suite = project.suites.prefetch_related('metadata').get(slug=suite_slug)
         metadata = SuiteMetadata.objects.get(kind='test', suite=suite_slug, name=test_name)
 
@@ -68,11 +61,18 @@ class TestHistory(object):
         environments_ids = set()
         for build in builds:
             results[build] = defaultdict(list)
-            for test in build.tests.filter(metadata=metadata).order_by():
-                test.metadata = metadata
-                test.suite = suite
-                results[build][test.environment_id].append(test)
-                environments_ids.add(test.environment_id)
+
+        builds_by_id = {build.id: build for build in builds}
+        tests = Test.objects.filter(build_id__in=builds_by_id.keys(), metadata=metadata).order_by()
+        for test in tests:
+            test.metadata = metadata
+            test.suite = suite
+            results[builds_by_id[test.build_id]][test.environment_id].append(test)
+            environments_ids.add(test.environment_id)
+
+        issues_by_env = {}
+        for env_id, matcher in KnownIssue.matchers_for_environments(environments_ids).items():
+            issues_by_env[env_id] = matcher.match(full_test_name) or None
 
         results_without_duplicates = defaultdict()
         for build in results:
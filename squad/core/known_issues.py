@@ -0,0 +1,59 @@
+import re
+
+
+def test_name_pattern(test_name):
+    """
+    Known issues' test_name are interpreted as patterns where the `*`
+    character matches anything. Just like with `re.match`, the pattern only
+    needs to match the beginning of the test full name.
+    """
+    return re.escape(test_name).replace('\\*', '.*?')
+
+
+class KnownIssueMatcher(object):
+    """
+    Finds which of a set of known issues apply to a given test full name.
+
+    Matching every known issue regex against every test name is too slow
+    for projects with lots of known issues, so issues are kept in dicts
+    keyed by the part of their test_name before the first wildcard (all of
+    it, for issues without wildcards). Those keys are looked up with the
+    prefixes of the test name that have the same length as one of them,
+    i.e. a handful of hash lookups, and only the wildcard patterns that
+    share their literal prefix with the test name are then matched against
+    it.
+    """
+
+    def __init__(self, issues):
+        self.literals = {}
+        wildcards = {}
+        for issue in issues:
+            if '*' in issue.test_name:
+                wildcards.setdefault(issue.test_name, []).append(issue)
+            else:
+                self.literals.setdefault(issue.test_name, []).append(issue)
+
+        self.patterns = {}
+        for name, issues in wildcards.items():
+            prefix = name.split('*', 1)[0]
+            self.patterns.setdefault(prefix, []).append((re.compile(test_name_pattern(name)), issues))
+
+        self.literal_lengths = sorted(set([len(name) for name in self.literals.keys()]))
+        self.prefix_lengths = sorted(set([len(prefix) for prefix in self.patterns.keys()]))
+
+    def __lookup__(self, table, lengths, full_name):
+        for length in lengths:
+            if length > len(full_name):
+                break
+            yield from table.get(full_name[:length], [])
+
+    def match(self, full_name):
+        """
+        Returns the list of known issues that apply to the given test full
+        name.
+        """
+        matched = list(self.__lookup__(self.literals, self.literal_lengths, full_name))
+        for regex, issues in self.__lookup__(self.patterns, self.prefix_lengths, full_name):
+            if regex.match(full_name):
+                matched += issues
+        return matched
@@ -30,7 +30,8 @@ def __get_environments__(build):
 
 class Command(BaseCommand):
 
-    help = """Compute metric summaries per build per environment"""
+    help = """Compute metric summaries per build per environment from scratch. Summaries are
+    otherwise updated incrementally as test runs arrive, so this can be used to repair them"""
 
     def add_arguments(self, parser):
         parser.add_argument('--project', help='Optionally, specify a project to compute, on the form $group/$project')
@@ -23,7 +23,8 @@ def valid_date(date):
 
 class Command(BaseCommand):
 
-    help = """Compute project statuses and set the baseline field"""
+    help = """Compute project statuses from scratch and set the baseline field. Statuses are
+    otherwise updated incrementally as test runs arrive, so this can be used to repair them"""
 
     def add_arguments(self, parser):
         parser.add_argument('--project', help='Optionally, specify a project to compute, on the form $group/$project')
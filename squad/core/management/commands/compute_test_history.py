@@ -0,0 +1,54 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from squad.core.models import Project, TestResultHistory
+
+
+logger = logging.getLogger()
+
+
+class Command(BaseCommand):
+
+    help = """Compute the test result history of projects from scratch. The history is
+    otherwise updated incrementally as test runs arrive, so this can be used to populate it
+    for existing data, or to repair it"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', help='Optionally, specify a project to compute, on the form $group/$project')
+        parser.add_argument('--show-progress', action='store_true', help='Prints out one dot per environment in stdout')
+
+    def __progress__(self, show):
+        if show:
+            self.stdout.write(".", ending="")
+            self.stdout._out.flush()
+
+    def handle(self, *args, **options):
+        project_name = options['project'] or False
+        show_progress = options['show_progress']
+
+        projects = Project.objects.all()
+        if project_name:
+            slugs = project_name.split('/')
+            if len(slugs) != 2:
+                logger.error('Project "%s" is malformed (should be group_slug/project_slug). Exiting...' % (project_name))
+                return
+
+            group_slug, project_slug = slugs
+            projects = projects.filter(group__slug=group_slug, slug=project_slug)
+            if not projects.exists():
+                logger.error('Project "%s" does not exist. Exiting...' % (project_name))
+                return
+
+        if show_progress:
+            logger.info('Showing progress, one dot means one processed environment')
+
+        for project in projects:
+            logger.info('Computing test history for "%s"' % project)
+            for environment in project.environments.all():
+                self.__progress__(show_progress)
+                TestResultHistory.rebuild(project, environment.id)
+
+        if show_progress:
+            self.stdout.write("")
+            self.stdout._out.flush()
@@ -3,7 +3,7 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
-from squad.core.models import Project, Build, Environment, Status, Test, Metric
+from squad.core.models import Project, Build, BuildComparison, BuildMetadata, BuildSummary, BuildTestMatrix, Environment, ProjectStatus, Status, Test, TestResultHistory, Metric
 from squad.core.tasks import UpdateProjectStatus
 
 
@@ -77,6 +77,18 @@ class Command(BaseCommand):
                     datetime=build.datetime,
                     project=new_project,
                     created_at=build.created_at)
+                # the test run results must be removed from the old build
+                # summaries and added to the new ones
+                ProjectStatus.invalidate(build.id)
+                ProjectStatus.invalidate(new_build.id)
+                BuildSummary.invalidate(build.id, env.id)
+                BuildSummary.invalidate(new_build.id, env.id)
+                BuildComparison.invalidate(build.id)
+                BuildComparison.invalidate(new_build.id)
+                BuildTestMatrix.invalidate(build.id)
+                BuildTestMatrix.invalidate(new_build.id)
+                BuildMetadata.invalidate(build.id)
+                BuildMetadata.invalidate(new_build.id)
                 for testrun in build.test_runs.filter(environment=env):
                     testrun.build = new_build
                     testrun.save()
@@ -86,6 +98,7 @@ class Command(BaseCommand):
                         testjob.target = new_project
                         testjob.save()
                     UpdateProjectStatus()(testrun)
+                ProjectStatus.refresh(build)
                 new_build.status.created_at = build.status.created_at
                 new_build.status.last_updated = build.status.last_updated
                 new_build.status.save()
@@ -95,6 +108,9 @@ class Command(BaseCommand):
         env.project = new_project
         env.save()
 
+        # test runs now belong to different builds
+        TestResultHistory.rebuild(new_project, env.id)
+
         for suite in old_project.suites.all():
             new_suite, _ = new_project.suites.get_or_create(
                 slug=suite.slug,
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0169_userpreferences"),
+    ]
+
+    operations = [
+        # existing test runs are already accounted for in the existing
+        # ProjectStatus and BuildSummary objects
+        migrations.AddField(
+            model_name="testrun",
+            name="status_summarized",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AlterField(
+            model_name="testrun",
+            name="status_summarized",
+            field=models.BooleanField(default=False),
+        ),
+        # existing ProjectStatus and BuildSummary objects get a NULL
+        # metrics_count, so they are recomputed from scratch the next time
+        # they are updated
+        migrations.AddField(
+            model_name="projectstatus",
+            name="metrics_log_sum",
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name="projectstatus",
+            name="metrics_count",
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name="projectstatus",
+            name="metrics_count",
+            field=models.IntegerField(default=0, null=True),
+        ),
+        migrations.AddField(
+            model_name="buildsummary",
+            name="metrics_log_sum",
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name="buildsummary",
+            name="metrics_count",
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name="buildsummary",
+            name="metrics_count",
+            field=models.IntegerField(default=0, null=True),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0170_incremental_summaries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestResultHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entries', models.TextField(blank=True, default='')),
+                ('environment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.environment')),
+                ('metadata', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.suitemetadata')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.project')),
+            ],
+            options={
+                'unique_together': {('project', 'metadata', 'environment')},
+            },
+        ),
+    ]
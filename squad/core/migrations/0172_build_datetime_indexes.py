@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0171_testresulthistory'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='build',
+            index=models.Index(fields=['datetime', 'id'], name='core_build_datetim_99374a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='build',
+            index=models.Index(fields=['project', 'datetime', 'id'], name='core_build_project_b4604c_idx'),
+        ),
+    ]
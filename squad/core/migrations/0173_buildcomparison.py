@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0172_build_datetime_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BuildComparison',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('tests', 'tests'), ('metrics', 'metrics')], max_length=16)),
+                ('data', models.TextField()),
+                ('baseline', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.build')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.build')),
+            ],
+            options={
+                'unique_together': {('baseline', 'target', 'kind')},
+            },
+        ),
+    ]
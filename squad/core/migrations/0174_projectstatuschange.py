@@ -0,0 +1,171 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:20
+
+from collections import OrderedDict
+
+import yaml
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from squad.core.utils import parse_name, join_name
+
+
+FIELDS = OrderedDict([
+    ('regressions', 'regression'),
+    ('fixes', 'fix'),
+    ('metric_regressions', 'metric_regression'),
+    ('metric_fixes', 'metric_fix'),
+])
+
+
+def yaml_changes_to_rows(apps, schema_editor):
+    ProjectStatus = apps.get_model('core', 'ProjectStatus')
+    ProjectStatusChange = apps.get_model('core', 'ProjectStatusChange')
+    Environment = apps.get_model('core', 'Environment')
+    Suite = apps.get_model('core', 'Suite')
+    SuiteMetadata = apps.get_model('core', 'SuiteMetadata')
+
+    has_changes = models.Q()
+    for field in FIELDS.keys():
+        has_changes |= models.Q(**{field + '__isnull': False})
+    statuses = ProjectStatus.objects.filter(has_changes).select_related('build').order_by('build__project_id', 'id')
+
+    # slug -> id, per project
+    environments = {}
+    suites = {}
+
+    # (kind, suite, name) -> id
+    metadata = {}
+
+    def resolve_metadata(keys):
+        keys = set(keys) - set(metadata.keys())
+        if not keys:
+            return
+        lookup = SuiteMetadata.objects.filter(
+            kind__in={key[0] for key in keys},
+            suite__in={key[1] for key in keys},
+            name__in={key[2] for key in keys},
+        )
+        for metadata_kind, suite, name, metadata_id in lookup.values_list('kind', 'suite', 'name', 'id'):
+            if (metadata_kind, suite, name) in keys:
+                metadata[(metadata_kind, suite, name)] = metadata_id
+
+        missing = keys - set(metadata.keys())
+        if missing:
+            SuiteMetadata.objects.bulk_create(
+                [SuiteMetadata(kind=k, suite=suite, name=name) for k, suite, name in missing],
+                ignore_conflicts=True,
+            )
+            for metadata_kind, suite, name, metadata_id in lookup.values_list('kind', 'suite', 'name', 'id'):
+                if (metadata_kind, suite, name) in missing:
+                    metadata[(metadata_kind, suite, name)] = metadata_id
+
+    for status in statuses.iterator():
+        project_id = status.build.project_id
+        if project_id not in environments:
+            environments.clear()
+            suites.clear()
+            environments[project_id] = dict(Environment.objects.filter(project_id=project_id).values_list('slug', 'id'))
+            suites[project_id] = dict(Suite.objects.filter(project_id=project_id).values_list('slug', 'id'))
+
+        entries = []
+        for field, kind in FIELDS.items():
+            try:
+                changes = yaml.load(getattr(status, field) or '', Loader=yaml.Loader) or {}
+            except yaml.YAMLError:
+                continue
+            metadata_kind = 'metric' if kind.startswith('metric_') else 'test'
+            for env_slug, full_names in changes.items():
+                environment_id = environments[project_id].get(env_slug)
+                if environment_id is None:
+                    continue
+                for full_name in full_names:
+                    suite_slug, name = parse_name(full_name)
+                    entries.append((kind, environment_id, (metadata_kind, suite_slug, name)))
+
+        resolve_metadata(key for _, _, key in entries)
+        ProjectStatusChange.objects.bulk_create(
+            [
+                ProjectStatusChange(
+                    status=status,
+                    build_id=status.build_id,
+                    kind=kind,
+                    environment_id=environment_id,
+                    suite_id=suites[project_id].get(key[1]),
+                    metadata_id=metadata[key],
+                )
+                for kind, environment_id, key in entries
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def rows_to_yaml_changes(apps, schema_editor):
+    ProjectStatus = apps.get_model('core', 'ProjectStatus')
+    ProjectStatusChange = apps.get_model('core', 'ProjectStatusChange')
+
+    changes = ProjectStatusChange.objects.select_related('environment', 'metadata').order_by('status_id', 'id')
+    status_id = None
+    data = None
+
+    def save(status_id, data):
+        values = {field: (yaml.dump(data[kind]) if data[kind] else None) for field, kind in FIELDS.items()}
+        ProjectStatus.objects.filter(id=status_id).update(**values)
+
+    for change in changes.iterator():
+        if change.status_id != status_id:
+            if status_id is not None:
+                save(status_id, data)
+            status_id = change.status_id
+            data = {kind: OrderedDict() for kind in FIELDS.values()}
+        full_name = join_name(change.metadata.suite, change.metadata.name)
+        data[change.kind].setdefault(change.environment.slug, []).append(full_name)
+
+    if status_id is not None:
+        save(status_id, data)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0173_buildcomparison'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectStatusChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('regression', 'Regression'), ('fix', 'Fix'), ('metric_regression', 'Metric regression'), ('metric_fix', 'Metric fix')], max_length=32)),
+                ('build', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_changes', to='core.build')),
+                ('environment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.environment')),
+                ('metadata', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.suitemetadata')),
+                ('status', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='core.projectstatus')),
+                ('suite', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.suite')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['metadata', 'kind'], name='core_projec_metadat_1de61d_idx')],
+                'unique_together': {('status', 'environment', 'suite', 'metadata')},
+            },
+        ),
+        migrations.RunPython(
+            yaml_changes_to_rows,
+            reverse_code=rows_to_yaml_changes,
+        ),
+        migrations.RemoveField(
+            model_name='projectstatus',
+            name='fixes',
+        ),
+        migrations.RemoveField(
+            model_name='projectstatus',
+            name='metric_fixes',
+        ),
+        migrations.RemoveField(
+            model_name='projectstatus',
+            name='metric_regressions',
+        ),
+        migrations.RemoveField(
+            model_name='projectstatus',
+            name='regressions',
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0174_projectstatuschange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BuildTestMatrix',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(max_length=8)),
+                ('confidence', models.FloatField(null=True)),
+                ('build', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='test_matrix', to='core.build')),
+                ('environment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.environment')),
+                ('metadata', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.suitemetadata')),
+                ('suite', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.suite')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['build', 'environment'], name='core_buildt_build_i_19dcae_idx'), models.Index(fields=['build', 'suite'], name='core_buildt_build_i_df7fee_idx')],
+                'unique_together': {('build', 'metadata', 'environment')},
+            },
+        ),
+    ]
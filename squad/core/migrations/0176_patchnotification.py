@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0175_buildtestmatrix'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatchNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(choices=[('created', 'created'), ('finished', 'finished')], max_length=16)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('build', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='patch_notifications', to='core.build')),
+            ],
+        ),
+    ]
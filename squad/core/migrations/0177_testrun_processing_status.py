@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0176_patchnotification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testrun',
+            name='processing_error',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='testrun',
+            name='processing_status',
+            field=models.CharField(choices=[('queued', 'queued'), ('processing', 'processing'), ('processed', 'processed'), ('failed', 'failed')], default='processed', max_length=16),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0177_testrun_processing_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BuildMetadata',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.TextField()),
+                ('build', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='metadata_union', to='core.build')),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0178_buildmetadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testrun',
+            name='processing_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='testrun',
+            index=models.Index(fields=['processing_status', 'processing_updated_at'], name='core_testru_process_022be5_idx'),
+        ),
+    ]
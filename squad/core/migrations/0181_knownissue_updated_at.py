@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 21:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0180_testrun_processing_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knownissue',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+    ]
@@ -1,25 +1,29 @@
+import io
 import json
 import yaml
 import logging
+import threading
 from collections import OrderedDict, Counter
+from datetime import timedelta
 from hashlib import sha1
-from itertools import groupby
 import re
 
 
 from django.db import models
 from django.db import transaction
 from django.db.utils import IntegrityError
-from django.db.models import Q, Count, Sum, F, Value
-from django.db.models.functions import Concat
+from django.db.models import Q, Count, Sum, F, Value, Case, When, Max
+from django.db.models.functions import Coalesce, Concat, Exp, Length
 from django.db.models.query import prefetch_related_objects
 from django.contrib.auth.models import User, AnonymousUser, Group as auth_group
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
-from django.db.models.signals import post_save, pre_delete, pre_save
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
 
 from django.conf import settings
+from django.template import engines
+from squad import profiling
 from squad.mail import Message
 from django.forms.fields import URLField as FormURLField
 from django.core.exceptions import ValidationError
@@ -29,10 +33,11 @@ from django.utils import timezone
 from django.utils.translation import gettext_lazy as N_
 from simple_history.models import HistoricalRecords
 
-from squad.core.utils import parse_name, join_name, yaml_validator, jinja2_validator, storage_save
+from squad.core.utils import parse_name, join_name, yaml_validator, jinja2_validator, storage_save, split_list, split_iterable
 from squad.core.utils import encrypt, decrypt
-from squad.core.comparison import TestComparison, MetricComparison
-from squad.core.statistics import geomean
+from squad.core.comparison import TestComparison, MetricComparison, status_counts, resolved_status
+from squad.core.known_issues import KnownIssueMatcher
+from squad.core.statistics import geomean, geomean_terms
 from squad.core.plugins import Plugin
 from squad.core.plugins import PluginListField
 from squad.core.plugins import PluginField
@@ -280,6 +285,77 @@ class EmailTemplate(models.Model):
     def __str__(self):
         return self.name
 
+    # Process-wide LRU cache of compiled templates, keyed by (template id,
+    # field, hash of the template source). See `compile`.
+    COMPILED_CACHE_SIZE = 128
+    __compiled__ = OrderedDict()
+    __compiled_lock__ = threading.Lock()
+    __compiled_stats__ = Counter()
+
+    def compiled(self, field):
+        """
+        Returns the Jinja2 template in `field` (subject, plain_text or html),
+        compiled.
+        """
+        return EmailTemplate.compile(self.id, field, getattr(self, field))
+
+    @classmethod
+    def compile(cls, template_id, field, source):
+        """
+        Compiles `source` with the jinja2 template engine, unless the same
+        source was already compiled for the same template and field. Since
+        the source is part of the cache key, editing a template never returns
+        a stale compiled template, even in processes where the entry was not
+        invalidated on save.
+        """
+        key = (template_id, field, sha1(source.encode()).hexdigest())
+        with cls.__compiled_lock__:
+            template = cls.__compiled__.get(key)
+            if template is not None:
+                cls.__compiled__.move_to_end(key)
+                cls.__compiled_stats__['hits'] += 1
+                return template
+
+        template = engines['jinja2'].from_string(source)
+
+        with cls.__compiled_lock__:
+            cls.__compiled_stats__['misses'] += 1
+            cls.__compiled__[key] = template
+            while len(cls.__compiled__) > cls.COMPILED_CACHE_SIZE:
+                cls.__compiled__.popitem(last=False)
+        return template
+
+    @classmethod
+    def compiled_cache_info(cls):
+        return {
+            'hits': cls.__compiled_stats__['hits'],
+            'misses': cls.__compiled_stats__['misses'],
+            'size': len(cls.__compiled__),
+            'maxsize': cls.COMPILED_CACHE_SIZE,
+        }
+
+    @classmethod
+    def invalidate_compiled(cls, template_id):
+        with cls.__compiled_lock__:
+            for key in [k for k in cls.__compiled__ if k[0] == template_id]:
+                del cls.__compiled__[key]
+
+
+@receiver(post_save, sender=EmailTemplate)
+@receiver(post_delete, sender=EmailTemplate)
+def invalidate_compiled_email_template(sender, instance, **kwargs):
+    EmailTemplate.invalidate_compiled(instance.id)
+
+
+@profiling.metrics.collector
+def compiled_email_template_metrics():
+    info = EmailTemplate.compiled_cache_info()
+    return [
+        ('squad_email_template_cache_hits_total', 'counter', 'Number of email templates found already compiled', info['hits']),
+        ('squad_email_template_cache_misses_total', 'counter', 'Number of email templates compiled', info['misses']),
+        ('squad_email_template_cache_size', 'gauge', 'Number of compiled email templates kept in memory', info['size']),
+    ]
+
 
 class Project(models.Model, DisplayName):
     objects = ProjectManager()
@@ -491,6 +567,11 @@ class Build(models.Model):
     class Meta:
         unique_together = ('project', 'version',)
         ordering = ['datetime']
+        # These indexes back keyset pagination of builds in the API
+        indexes = [
+            models.Index(fields=['datetime', 'id']),
+            models.Index(fields=['project', 'datetime', 'id']),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.datetime:
@@ -539,18 +620,7 @@ class Build(models.Model):
         of the different values.
         """
         if self.__metadata__ is None:
-            metadata = {}
-            for test_run in self.test_runs.only('metadata_file', 'build_id'):
-                for key, value in test_run.metadata.items():
-                    metadata.setdefault(key, [])
-                    if value not in metadata[key]:
-                        metadata[key].append(value)
-            for key in metadata.keys():
-                if len(metadata[key]) == 1:
-                    metadata[key] = metadata[key][0]
-                else:
-                    metadata[key] = sorted(metadata[key], key=str)
-            self.__metadata__ = metadata
+            self.__metadata__ = BuildMetadata.for_build(self.id)
         return self.__metadata__
 
     __metadata_by_testrun__ = None
@@ -621,18 +691,22 @@ class Build(models.Model):
         """
         reasons = []
 
-        # XXX note that by using test_jobs here, we are adding an implicit
-        # dependency on squad.ci, what in theory violates our architecture.
-        testjobs = self.test_jobs
-        if testjobs.count() > 0:
-            if testjobs.pending().count() > 0:
+        # XXX note that by using test_job_counters here, we are adding an
+        # implicit dependency on squad.ci, what in theory violates our
+        # architecture.
+        testjobs = self.test_job_counters.aggregate(
+            total=Coalesce(Sum('count'), 0),
+            pending=Coalesce(Sum('count', filter=Q(fetched=False) | Q(job_status='Fetching')), 0),
+        )
+        if testjobs['total'] > 0:
+            if testjobs['pending'] > 0:
                 # a build that has pending CI jobs is NOT finished
                 reasons.append("There are unfinished CI jobs")
             else:
                 # carry on, and check whether the number of expected test runs
                 # per environment is satisfied.
                 pass
-        elif self.test_runs.count() == 0:
+        elif not self.test_runs.exists():
             reasons.append("There are no testjobs or testruns for the build")
 
         # builds with no CI jobs are finished when each environment has
@@ -646,8 +720,10 @@ class Build(models.Model):
             for e in self.project.environments.all()
         }
 
-        for t in self.test_runs.filter(completed=True).only('build_id', 'environment_id').all():
-            testruns[t.environment_id]['received'] += 1
+        # test runs that are still waiting to be processed don't count yet
+        received = self.test_runs.filter(completed=True).exclude(processing_status__in=TestRun.PENDING)
+        for r in received.values('environment_id').annotate(count=Count('id')).order_by():
+            testruns[r['environment_id']]['received'] += r['count']
 
         for env, count in testruns.items():
             expected = count['expected']
@@ -700,15 +776,17 @@ class Build(models.Model):
         return result
 
     def test_jobs_summary(self, per_environment=False):
-        testjobs = self.test_jobs.only('environment', 'job_status', 'target_build').order_by('environment')
+        # see squad.ci.models.TestJobCounter
+        counters = self.test_job_counters.filter(count__gt=0)
         summary = {}
         if per_environment:
-            for env, jobs in groupby(testjobs, lambda tj: tj.environment):
-                if env is None:
-                    continue
-                summary[env] = Counter([tj.job_status for tj in jobs])
+            counters = counters.values_list('environment', 'job_status').annotate(total=Sum('count')).order_by('environment', 'job_status')
+            for env, status, count in counters:
+                summary.setdefault(env, Counter())[status or None] = count
         else:
-            summary = Counter([tj.job_status for tj in testjobs])
+            summary = Counter()
+            for status, count in counters.values_list('job_status').annotate(total=Sum('count')).order_by('job_status'):
+                summary[status or None] = count
 
         return summary
 
@@ -722,6 +800,61 @@ class BuildPlaceholder(models.Model):
         unique_together = ('project', 'version',)
 
 
+class PatchNotification(models.Model):
+    """
+    A pending notification to the patch source of a build (see
+    squad.core.patch_delivery). Notifications are deleted once delivered,
+    or after SQUAD_PATCH_NOTIFICATION_RETRIES failed attempts.
+    """
+
+    CREATED = 'created'
+    FINISHED = 'finished'
+
+    # time a batch of claimed notifications is hidden from other workers
+    LEASE = 600
+
+    build = models.ForeignKey(Build, related_name='patch_notifications', on_delete=models.CASCADE)
+    event = models.CharField(max_length=16, choices=((CREATED, CREATED), (FINISHED, FINISHED)))
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    @classmethod
+    def claim(cls, limit):
+        """
+        Returns up to `limit` notifications that are due, in the order they
+        were created, and postpones them by LEASE seconds so that concurrent
+        workers don't deliver them as well.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            due = cls.objects.select_for_update(skip_locked=True).filter(next_attempt_at__lte=now).order_by('id')
+            ids = list(due.values_list('id', flat=True)[:limit])
+            cls.objects.filter(id__in=ids).update(
+                next_attempt_at=now + timedelta(seconds=cls.LEASE),
+            )
+        return list(cls.objects.filter(id__in=ids).select_related(
+            'build__patch_source',
+            'build__patch_baseline',
+            'build__project',
+            'build__status',
+        ).order_by('id'))
+
+    def postpone(self):
+        """
+        Records a failed attempt. Returns the number of seconds until the
+        next attempt, or None if the notification was given up on.
+        """
+        self.attempts += 1
+        if self.attempts >= settings.SQUAD_PATCH_NOTIFICATION_RETRIES:
+            self.delete()
+            return None
+        delay = settings.SQUAD_PATCH_NOTIFICATION_DELAY * 2 ** self.attempts
+        self.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+        self.save()
+        return delay
+
+
 class DelayedReport(models.Model):
     build = models.ForeignKey(Build, related_name="delayed_reports", on_delete=models.CASCADE)
     baseline = models.ForeignKey('ProjectStatus', related_name="delayed_report_baselines", null=True, blank=True, on_delete=models.CASCADE)
@@ -797,27 +930,72 @@ class TestRun(models.Model):
     data_processed = models.BooleanField(default=False)
     status_recorded = models.BooleanField(default=False)
 
+    # whether the results of this test run have been added to the
+    # incrementally maintained ProjectStatus and BuildSummary
+    status_summarized = models.BooleanField(default=False)
+
+    # test runs submitted asynchronously are stored as QUEUED, and processed
+    # later by the `process_test_run` task
+    QUEUED = 'queued'
+    PROCESSING = 'processing'
+    PROCESSED = 'processed'
+    FAILED = 'failed'
+    PROCESSING_STATUS_CHOICES = (
+        (QUEUED, QUEUED),
+        (PROCESSING, PROCESSING),
+        (PROCESSED, PROCESSED),
+        (FAILED, FAILED),
+    )
+    PENDING = (QUEUED, PROCESSING)
+    processing_status = models.CharField(max_length=16, choices=PROCESSING_STATUS_CHOICES, default=PROCESSED)
+    processing_error = models.TextField(null=True, blank=True)
+
+    # when the test run was last queued or claimed for processing; test runs
+    # that stay pending for too long are queued again (see
+    # squad.core.tasks.requeue_stale_test_runs)
+    processing_updated_at = models.DateTimeField(null=True, blank=True)
+
     class Meta:
         unique_together = ('build', 'job_id')
+        indexes = [
+            models.Index(fields=['processing_status', 'processing_updated_at']),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.datetime:
             self.datetime = timezone.now()
+
+        adding = self._state.adding
+        metadata_changed = False
         if self.__metadata__:
-            self.metadata_file = json.dumps(self.__metadata__)
+            metadata_file = json.dumps(self.__metadata__)
+            if not adding and metadata_file != self.metadata_file:
+                metadata_changed = json.loads(self.metadata_file or '{}') != self.__metadata__
+            self.metadata_file = metadata_file
+
         super(TestRun, self).save(*args, **kwargs)
 
+        if adding:
+            # parsed here without caching it in __metadata__, so that the
+            # submitted metadata file is stored as is
+            metadata = self.__metadata__ or json.loads(self.metadata_file or '{}')
+            if metadata:
+                BuildMetadata.record(self.build_id, metadata)
+        elif metadata_changed:
+            BuildMetadata.invalidate(self.build_id)
+
     def save_tests_file(self, tests_file):
         storage_save(self, self.tests_file_storage, 'tests_file', tests_file)
-        self.__tests_file__ = tests_file
+        self.__tests_file__ = None
 
     def save_metrics_file(self, metrics_file):
         storage_save(self, self.metrics_file_storage, 'metrics_file', metrics_file)
-        self.__metrics_file__ = metrics_file
+        self.__metrics_file__ = None
 
     def save_log_file(self, log_file):
         storage_save(self, self.log_file_storage, 'log_file', log_file)
-        self.__log_file__ = log_file
+        # logs saved from a file are read back from the storage when needed
+        self.__log_file__ = log_file if isinstance(log_file, str) else None
 
     __tests_file__ = None
 
@@ -843,6 +1021,29 @@ class TestRun(models.Model):
                 self.__metrics_file__ = ''
         return self.__metrics_file__
 
+    def open_tests_file(self):
+        """
+        Opens the tests file for incremental reading, e.g. with
+        squad.core.data.iterate_json_object, instead of loading all of its
+        contents in memory like the `tests_file` property does.
+        """
+        return self.__open_file__(self.__tests_file__, self.tests_file_storage)
+
+    def open_metrics_file(self):
+        """
+        Same as open_tests_file, for the metrics file.
+        """
+        return self.__open_file__(self.__metrics_file__, self.metrics_file_storage)
+
+    def __open_file__(self, contents, storage):
+        if contents is not None:
+            return io.StringIO(contents)
+        if storage:
+            # open a new file object, so that the position of the one used
+            # by the properties above is not affected
+            return storage.storage.open(storage.name, 'rb')
+        return io.StringIO('')
+
     __log_file__ = None
 
     @property
@@ -874,6 +1075,17 @@ class TestRun(models.Model):
         return self.job_id and ('#%s' % self.job_id) or ('(%s)' % self.id)
 
 
+@receiver(pre_delete, sender=TestRun)
+def invalidate_testrun_summaries(sender, instance, **kwargs):
+    if instance.status_summarized:
+        ProjectStatus.invalidate(instance.build_id)
+        BuildSummary.invalidate(instance.build_id, instance.environment_id)
+        TestResultHistory.remove_testrun(instance)
+    BuildComparison.invalidate(instance.build_id)
+    BuildTestMatrix.invalidate(instance.build_id)
+    BuildMetadata.invalidate(instance.build_id)
+
+
 @receiver(pre_delete, sender=TestRun)
 def delete_testrun_files(sender, instance, **kwargs):
     testrun = instance
@@ -1021,17 +1233,10 @@ class Test(models.Model):
         return join_name(suite, self.name)
 
     class Confidence(object):
-        def __init__(self, threshold, tests):
+        def __init__(self, threshold, passes, count):
             self.threshold = threshold
-            self.tests = tests
-
-        @property
-        def count(self):
-            return len(self.tests)
-
-        @property
-        def passes(self):
-            return sum(1 for t in self.tests if t.result)
+            self.passes = passes
+            self.count = count
 
         @property
         def score(self):
@@ -1043,9 +1248,18 @@ class Test(models.Model):
     __confidence__ = None
 
     def set_confidence(self, threshold, tests):
+        results = [t.result for t in tests]
+        self.set_confidence_counts(threshold, sum(1 for r in results if r), len(results))
+
+    def set_confidence_counts(self, threshold, passes, count):
+        """
+        Same as `set_confidence`, but from the number of passes and the total
+        number of tests in the history, instead of the tests themselves.
+        """
         self.__confidence__ = Test.Confidence(
             threshold=threshold,
-            tests=tests,
+            passes=passes,
+            count=count,
         )
 
     @property
@@ -1065,23 +1279,40 @@ class Test(models.Model):
         if self.__history__:
             return self.__history__
 
-        date = self.test_run.build.datetime
-        previous_tests = Test.objects.filter(
-            suite=self.suite,
-            metadata__name=self.name,
-            test_run__build__datetime__lt=date,
-            test_run__environment=self.test_run.environment,
-        ).exclude(id=self.id).order_by("-test_run__build__datetime")
+        build = self.test_run.build
+        environment_id = self.test_run.environment_id
+        previous_builds = build.project.builds.filter(
+            datetime__lt=build.datetime,
+        ).order_by('-datetime').values_list('id', flat=True)
+
+        results = TestResultHistory.results_for(self.metadata_id, environment_id)
+
         since = None
         count = 0
         last_different = None
-        for test in list(previous_tests):
-            if test.result == self.result:
-                since = test
-                count += 1
-            else:
-                last_different = test
+        for build_id in previous_builds:
+            if build_id not in results:
+                continue
+            different = [r for r in results[build_id] if r != self.result]
+            if different:
+                last_different = (build_id, different[0])
                 break
+            since = build_id
+            count += len(results[build_id])
+
+        def get_test(build_id, result):
+            return Test.objects.filter(
+                build_id=build_id,
+                environment_id=environment_id,
+                metadata_id=self.metadata_id,
+                result=result,
+            ).exclude(id=self.id).first()
+
+        if since is not None:
+            since = get_test(since, self.result)
+        if last_different is not None:
+            last_different = get_test(*last_different)
+
         self.__history__ = Test.History(since, count, last_different)
         return self.__history__
 
@@ -1089,6 +1320,267 @@ class Test(models.Model):
         ordering = ['metadata__name']
 
 
+class TestResultHistory(models.Model):
+    """
+    Compact history of the results of a test (i.e. test metadata) in a given
+    environment, so that history and confidence computations read a single
+    row instead of scanning all the matching Test objects.
+
+    `entries` is a sequence of `<build id><result code>` entries, one for
+    each Test, in the order in which they were received, e.g. "12p13f13x".
+    Only the entries of the latest `MAX_BUILDS` builds (or the project's
+    `build_confidence_count`, if larger) are kept.
+    """
+
+    __test__ = False
+
+    PASS = 'p'
+    FAIL = 'f'
+    XFAIL = 'x'
+    SKIP = 's'
+
+    RESULTS = {
+        PASS: True,
+        FAIL: False,
+        XFAIL: False,
+        SKIP: None,
+    }
+
+    ENTRY = re.compile(r'(\d+)([pfxs])')
+
+    # number of rows updated per UPDATE statement
+    BATCH_SIZE = 250
+
+    # number of builds kept in the history of each test
+    MAX_BUILDS = 100
+
+    # rows are trimmed down to the latest builds once they get longer than
+    # this, i.e. about twice what MAX_BUILDS builds with a single result each
+    # take, so that not every append has to trim
+    TRIM_LENGTH = 16 * MAX_BUILDS
+
+    project = models.ForeignKey(Project, related_name='+', on_delete=models.CASCADE)
+    environment = models.ForeignKey(Environment, related_name='+', on_delete=models.CASCADE)
+    metadata = models.ForeignKey(SuiteMetadata, related_name='+', on_delete=models.CASCADE)
+    entries = models.TextField(default='', blank=True)
+
+    class Meta:
+        unique_together = ('project', 'metadata', 'environment')
+
+    @classmethod
+    def code(cls, result, has_known_issues):
+        if result:
+            return cls.PASS
+        elif result is None:
+            return cls.SKIP
+        elif has_known_issues:
+            return cls.XFAIL
+        else:
+            return cls.FAIL
+
+    __codes__ = None
+
+    @classmethod
+    def parse(cls, entries):
+        codes = {}
+        for build_id, code in cls.ENTRY.findall(entries):
+            codes.setdefault(int(build_id), []).append(code)
+        return codes
+
+    @classmethod
+    def pack(cls, codes):
+        return ''.join('%d%s' % (build_id, c) for build_id, cs in codes.items() for c in cs)
+
+    @classmethod
+    def trim(cls, codes, max_builds):
+        """
+        Returns `codes` with only the entries of the latest `max_builds`
+        builds.
+        """
+        if len(codes) <= max_builds:
+            return codes
+        keep = set(sorted(codes.keys())[-max_builds:])
+        return {build_id: cs for build_id, cs in codes.items() if build_id in keep}
+
+    @property
+    def codes(self):
+        """
+        Returns a dict mapping build ids to the list of result codes of the
+        test in that build.
+        """
+        if self.__codes__ is None:
+            self.__codes__ = self.parse(self.entries)
+        return self.__codes__
+
+    @property
+    def results(self):
+        """
+        Same as `codes`, but with the results (True, False or None) instead
+        of result codes.
+        """
+        return {build_id: [self.RESULTS[c] for c in codes] for build_id, codes in self.codes.items()}
+
+    @classmethod
+    def results_for(cls, metadata_id, environment_id):
+        history = cls.objects.filter(
+            metadata_id=metadata_id,
+            environment_id=environment_id,
+        ).first()
+        if history is None:
+            return {}
+        return history.results
+
+    @classmethod
+    def append(cls, project_id, tests):
+        """
+        Appends the results of the given tests to the history. `tests` is
+        an iterable of (metadata_id, environment_id, build_id, result code)
+        tuples.
+        """
+        new_entries = OrderedDict()
+        for metadata_id, environment_id, build_id, code in tests:
+            key = (metadata_id, environment_id)
+            new_entries[key] = new_entries.get(key, '') + '%d%s' % (build_id, code)
+
+        for chunk in split_list(list(new_entries.keys()), cls.BATCH_SIZE):
+            cls.objects.bulk_create(
+                [cls(project_id=project_id, metadata_id=m, environment_id=e) for m, e in chunk],
+                ignore_conflicts=True,
+            )
+
+            environment_ids = set(e for _, e in chunk)
+            metadata_ids = set(m for m, _ in chunk)
+            histories = cls.objects.filter(
+                project_id=project_id,
+                environment_id__in=environment_ids,
+                metadata_id__in=metadata_ids,
+            ).values_list('id', 'metadata_id', 'environment_id')
+
+            appended = {
+                history_id: new_entries[(m, e)]
+                for history_id, m, e in histories
+                if (m, e) in new_entries
+            }
+            cases = [When(id=history_id, then=Value(value)) for history_id, value in appended.items()]
+
+            # a single UPDATE statement appends to all rows, so concurrent
+            # appends to the same row don't lose entries
+            cls.objects.filter(id__in=appended.keys()).update(
+                entries=Concat(F('entries'), Case(*cases, output_field=models.TextField())),
+            )
+            cls.__trim__(project_id, appended.keys())
+
+    @classmethod
+    def __trim__(cls, project_id, history_ids):
+        too_long = cls.objects.annotate(
+            entries_length=Length('entries'),
+        ).filter(
+            id__in=history_ids,
+            entries_length__gt=cls.TRIM_LENGTH,
+        ).values_list('id', flat=True)
+
+        too_long = list(too_long)
+        if not too_long:
+            return
+
+        build_confidence_count = Project.objects.filter(id=project_id).values_list('build_confidence_count', flat=True).first() or 0
+        max_builds = max(cls.MAX_BUILDS, build_confidence_count)
+        with transaction.atomic():
+            histories = list(cls.objects.select_for_update().filter(id__in=too_long).only('id', 'entries'))
+            for history in histories:
+                history.entries = cls.pack(cls.trim(cls.parse(history.entries), max_builds))
+            cls.objects.bulk_update(histories, ['entries'])
+
+    @classmethod
+    def add_testrun(cls, testrun):
+        """
+        Appends the results of all tests in the given test run.
+        """
+        tests = testrun.tests.values_list('metadata_id', 'result', 'has_known_issues').order_by()
+        cls.append(
+            testrun.build.project_id,
+            (
+                (metadata_id, testrun.environment_id, testrun.build_id, cls.code(result, has_known_issues))
+                for metadata_id, result, has_known_issues in tests.iterator()
+                if metadata_id is not None
+            ),
+        )
+
+    @classmethod
+    def remove_testrun(cls, testrun):
+        """
+        Removes the results of the tests in the given test run from the
+        history. Entries only record builds, so the entries of the build are
+        dropped and the results of the tests of any other test run in the
+        same build and environment are added back.
+        """
+        metadata_ids = set(
+            testrun.tests.filter(metadata__isnull=False).values_list('metadata_id', flat=True).order_by()
+        )
+        if not metadata_ids:
+            return
+
+        others = Test.objects.filter(
+            build_id=testrun.build_id,
+            environment_id=testrun.environment_id,
+            metadata_id__in=metadata_ids,
+        ).exclude(
+            test_run_id=testrun.id,
+        ).values_list('metadata_id', 'result', 'has_known_issues').order_by('id')
+        remaining = {}
+        for metadata_id, result, has_known_issues in others.iterator():
+            remaining.setdefault(metadata_id, []).append(cls.code(result, has_known_issues))
+
+        for chunk in split_list(list(metadata_ids), cls.BATCH_SIZE):
+            with transaction.atomic():
+                histories = list(cls.objects.select_for_update().filter(
+                    environment_id=testrun.environment_id,
+                    metadata_id__in=chunk,
+                ).only('id', 'metadata_id', 'entries'))
+                for history in histories:
+                    codes = cls.parse(history.entries)
+                    codes.pop(testrun.build_id, None)
+                    if history.metadata_id in remaining:
+                        codes[testrun.build_id] = remaining[history.metadata_id]
+                    history.entries = cls.pack(codes)
+                cls.objects.bulk_update(histories, ['entries'])
+
+    @classmethod
+    def rebuild(cls, project, environment_id, metadata_ids=None):
+        """
+        Recomputes the history of the given tests (all tests, if
+        `metadata_ids` is None) in the given environment from the Test
+        objects. Only the tests of the builds that `trim` would keep are
+        read, one build at a time, and results are added in the order of
+        the builds.
+        """
+        histories = cls.objects.filter(environment_id=environment_id)
+        tests = Test.objects.filter(environment_id=environment_id, metadata__isnull=False)
+        if metadata_ids is not None:
+            histories = histories.filter(metadata_id__in=metadata_ids)
+            tests = tests.filter(metadata_id__in=metadata_ids)
+        histories.delete()
+
+        max_builds = max(cls.MAX_BUILDS, project.build_confidence_count)
+        latest_build_ids = TestRun.objects.filter(
+            environment_id=environment_id,
+        ).order_by('-build_id').values_list('build_id', flat=True).distinct()[:max_builds]
+        build_ids = Build.objects.filter(
+            id__in=list(latest_build_ids),
+        ).order_by('datetime', 'id').values_list('id', flat=True)
+
+        for build_id in build_ids:
+            build_tests = tests.filter(build_id=build_id).values_list(
+                'metadata_id', 'result', 'has_known_issues',
+            ).order_by('id')
+            entries = (
+                (metadata_id, environment_id, build_id, cls.code(result, has_known_issues))
+                for metadata_id, result, has_known_issues in build_tests.iterator()
+            )
+            for chunk in split_iterable(entries, cls.BATCH_SIZE * 100):
+                cls.append(project.id, chunk)
+
+
 class MetricManager(models.Manager):
 
     def by_full_name(self, name):
@@ -1264,6 +1756,12 @@ class MetricThreshold(models.Model):
         return self.__regex__.match(metric_fullname)
 
 
+@receiver(post_save, sender=MetricThreshold)
+@receiver(post_delete, sender=MetricThreshold)
+def invalidate_metric_comparisons(sender, instance, **kwargs):
+    BuildComparison.objects.filter(target__project_id=instance.project_id, kind=BuildComparison.METRICS).delete()
+
+
 class ProjectStatus(models.Model, TestSummaryBase):
     """
     Represents a "checkpoint" of a project status in time. It is used by the
@@ -1282,6 +1780,12 @@ class ProjectStatus(models.Model, TestSummaryBase):
     metrics_summary = models.FloatField(null=True)
     has_metrics = models.BooleanField(default=False)
 
+    # terms of the geometric mean in metrics_summary, for incremental
+    # updates. metrics_count is NULL when the summary needs to be
+    # recomputed from scratch
+    metrics_log_sum = models.FloatField(default=0.0)
+    metrics_count = models.IntegerField(null=True, default=0)
+
     tests_pass = models.IntegerField(default=0)
     tests_fail = models.IntegerField(default=0)
     tests_xfail = models.IntegerField(default=0)
@@ -1291,28 +1795,6 @@ class ProjectStatus(models.Model, TestSummaryBase):
     test_runs_completed = models.IntegerField(default=0)
     test_runs_incomplete = models.IntegerField(default=0)
 
-    regressions = models.TextField(
-        null=True,
-        blank=True,
-        validators=[yaml_validator]
-    )
-    fixes = models.TextField(
-        null=True,
-        blank=True,
-        validators=[yaml_validator]
-    )
-
-    metric_regressions = models.TextField(
-        null=True,
-        blank=True,
-        validators=[yaml_validator]
-    )
-    metric_fixes = models.TextField(
-        null=True,
-        blank=True,
-        validators=[yaml_validator]
-    )
-
     class Meta:
         verbose_name_plural = "Project statuses"
 
@@ -1320,44 +1802,16 @@ class ProjectStatus(models.Model, TestSummaryBase):
     def create_or_update(cls, build):
         """
         Creates (or updates) a new ProjectStatus for the given build and
-        returns it.
+        returns it. All of the data is recomputed from scratch, which can be
+        used to repair the counters that are otherwise maintained
+        incrementally by `add_testrun`.
         """
 
         test_summary = build.test_summary
         metrics_summary = MetricsSummary(build)
-        now = timezone.now()
         test_runs_completed = build.test_runs.filter(completed=True).count()
         test_runs_incomplete = build.test_runs.filter(completed=False).count()
         test_runs_total = test_runs_completed + test_runs_incomplete
-        regressions = None
-        fixes = None
-        metric_regressions = None
-        metric_fixes = None
-
-        previous_build = None
-        if build.status is not None and build.status.baseline is not None:
-            previous_build = build.status.baseline
-        else:
-            previous_build = Build.objects.filter(
-                status__finished=True,
-                datetime__lt=build.datetime,
-                project=build.project,
-            ).order_by('datetime').last()
-
-        # Compute regressions and fixes only after build is finished
-        finished, _ = build.finished
-        if previous_build is not None and finished:
-            comparison = TestComparison(previous_build, build, regressions_and_fixes_only=True)
-            if comparison.regressions:
-                regressions = yaml.dump(comparison.regressions)
-            if comparison.fixes:
-                fixes = yaml.dump(comparison.fixes)
-
-            metric_comparison = MetricComparison(previous_build, build, regressions_and_fixes_only=True)
-            if metric_comparison.regressions:
-                metric_regressions = yaml.dump(metric_comparison.regressions)
-            if metric_comparison.fixes:
-                metric_fixes = yaml.dump(metric_comparison.fixes)
 
         data = {
             'tests_pass': test_summary.tests_pass,
@@ -1366,50 +1820,116 @@ class ProjectStatus(models.Model, TestSummaryBase):
             'tests_skip': test_summary.tests_skip,
             'metrics_summary': metrics_summary.value,
             'has_metrics': metrics_summary.has_metrics,
-            'last_updated': now,
-            'finished': finished,
+            'metrics_log_sum': metrics_summary.log_sum,
+            'metrics_count': metrics_summary.count,
             'test_runs_total': test_runs_total,
             'test_runs_completed': test_runs_completed,
             'test_runs_incomplete': test_runs_incomplete,
-            'regressions': regressions,
-            'fixes': fixes,
-            'metric_regressions': metric_regressions,
-            'metric_fixes': metric_fixes,
-            'baseline': previous_build,
         }
+        build_data, changes = cls.__build_data__(build)
+        data.update(build_data)
 
         status, created = cls.objects.get_or_create(
             build=build,
             defaults=data)
-        if not created and test_summary.tests_total >= status.tests_total:
+        if created:
+            status.__store_changes__(changes)
+        elif status.metrics_count is None or test_summary.tests_total >= status.tests_total:
             # XXX the test above for the new total number of tests prevents
             # results that arrived earlier, but are only being processed now,
             # from overwriting a ProjectStatus created by results that arrived
             # later but were already processed.
-            status.tests_pass = test_summary.tests_pass
-            status.tests_fail = test_summary.tests_fail
-            status.tests_xfail = test_summary.tests_xfail
-            status.tests_skip = test_summary.tests_skip
-            status.metrics_summary = metrics_summary.value
-            status.has_metrics = metrics_summary.has_metrics
-            status.last_updated = now
-            status.finished = finished
+            for field, value in data.items():
+                setattr(status, field, value)
             status.build = build
-            status.baseline = previous_build
-            status.test_runs_total = test_runs_total
-            status.test_runs_completed = test_runs_completed
-            status.test_runs_incomplete = test_runs_incomplete
-            status.regressions = regressions
-            status.fixes = fixes
-            status.metric_regressions = metric_regressions
-            status.metric_fixes = metric_fixes
             status.save()
+            status.__store_changes__(changes)
 
-        status.build.project.datetime = now
+        status.build.project.datetime = data['last_updated']
         status.build.project.save()
 
         return status
 
+    @classmethod
+    def refresh(cls, build):
+        """
+        Updates the parts of the ProjectStatus of the given build that depend
+        on the build as a whole (whether it's finished, its baseline,
+        regressions and fixes), and returns it. Test and metric counters are
+        assumed to be up to date, unless they were invalidated, in which case
+        everything is recomputed.
+        """
+        status = cls.objects.filter(build=build).first()
+        if status is None or status.metrics_count is None:
+            status = cls.create_or_update(build)
+        else:
+            data, changes = cls.__build_data__(build)
+            cls.objects.filter(pk=status.pk).update(**data)
+            status.refresh_from_db()
+            status.__store_changes__(changes)
+            status.build.project.datetime = data['last_updated']
+            status.build.project.save()
+
+        for summary in BuildSummary.objects.filter(build=build, metrics_count=None):
+            BuildSummary.create_or_update(build, summary.environment)
+
+        return status
+
+    @classmethod
+    def add_testrun(cls, testrun, status, metrics):
+        """
+        Adds the results of a test run to the ProjectStatus of its build,
+        given its overall Status and the results of its metrics.
+        """
+        cls.objects.filter(build_id=testrun.build_id).update(
+            **summary_increments(testrun, status, metrics)
+        )
+
+    @classmethod
+    def invalidate(cls, build_id):
+        """
+        Marks the ProjectStatus of the given build to be recomputed from
+        scratch on the next call to `refresh`.
+        """
+        cls.objects.filter(build_id=build_id).update(metrics_count=None)
+
+    @classmethod
+    def __build_data__(cls, build):
+        changes = OrderedDict()
+
+        previous_build = None
+        if build.status is not None and build.status.baseline is not None:
+            previous_build = build.status.baseline
+        else:
+            previous_build = Build.objects.filter(
+                status__finished=True,
+                datetime__lt=build.datetime,
+                project=build.project,
+            ).order_by('datetime').last()
+
+        # Compute regressions and fixes only after build is finished
+        finished, _ = build.finished
+        if previous_build is not None and finished:
+            comparison = TestComparison(previous_build, build, regressions_and_fixes_only=True)
+            changes[ProjectStatusChange.REGRESSION] = comparison.regressions
+            changes[ProjectStatusChange.FIX] = comparison.fixes
+
+            metric_comparison = MetricComparison(previous_build, build, regressions_and_fixes_only=True)
+            changes[ProjectStatusChange.METRIC_REGRESSION] = metric_comparison.regressions
+            changes[ProjectStatusChange.METRIC_FIX] = metric_comparison.fixes
+
+        data = {
+            'last_updated': timezone.now(),
+            'finished': finished,
+            'baseline': previous_build,
+        }
+        return data, changes
+
+    def __store_changes__(self, changes):
+        ProjectStatusChange.objects.filter(status=self).delete()
+        ProjectStatusChange.record(self, changes)
+        getattr(self, '_prefetched_objects_cache', {}).pop('changes', None)
+
     def __str__(self):
         return "%s, build %s" % (self.build.project, self.build.version)
 
@@ -1427,26 +1947,52 @@ class ProjectStatus(models.Model, TestSummaryBase):
             return self.baseline.status
         return None
 
-    def __get_yaml_field__(self, field_value):
-        if field_value is None:
-            return {}
+    def __get_changes__(self, kind):
+        changes = OrderedDict()
+        if self.pk is None:
+            return changes
 
-        try:
-            return yaml.load(field_value, Loader=yaml.Loader)
-        except yaml.YAMLError:
-            return {}
+        prefetch_related_objects([self], ProjectStatusChange.prefetch())
+        for change in self.changes.all():
+            if change.kind == kind:
+                changes.setdefault(change.environment.slug, []).append(change.full_name)
+        return changes
 
     def get_regressions(self):
-        return self.__get_yaml_field__(self.regressions)
+        return self.__get_changes__(ProjectStatusChange.REGRESSION)
 
     def get_fixes(self):
-        return self.__get_yaml_field__(self.fixes)
+        return self.__get_changes__(ProjectStatusChange.FIX)
 
     def get_metric_regressions(self):
-        return self.__get_yaml_field__(self.metric_regressions)
+        return self.__get_changes__(ProjectStatusChange.METRIC_REGRESSION)
 
     def get_metric_fixes(self):
-        return self.__get_yaml_field__(self.metric_fixes)
+        return self.__get_changes__(ProjectStatusChange.METRIC_FIX)
+
+    # YAML representation of the regressions and fixes, as they used to be
+    # stored before ProjectStatusChange existed; None when there are none
+
+    def __get_yaml_view__(self, changes):
+        if not changes:
+            return None
+        return yaml.dump(changes)
+
+    @property
+    def regressions(self):
+        return self.__get_yaml_view__(self.get_regressions())
+
+    @property
+    def fixes(self):
+        return self.__get_yaml_view__(self.get_fixes())
+
+    @property
+    def metric_regressions(self):
+        return self.__get_yaml_view__(self.get_metric_regressions())
+
+    @property
+    def metric_fixes(self):
+        return self.__get_yaml_view__(self.get_metric_fixes())
 
     def get_exceeded_thresholds(self):
         # Return a list of all (threshold, metric) objects for those
@@ -1471,12 +2017,118 @@ class ProjectStatus(models.Model, TestSummaryBase):
         return thresholds_exceeded
 
 
-@receiver(pre_save, sender=ProjectStatus)
-def validate_project_status(sender, instance, *args, **kwargs):
-    yaml_validator(instance.regressions)
-    yaml_validator(instance.fixes)
-    yaml_validator(instance.metric_regressions)
-    yaml_validator(instance.metric_fixes)
+class ProjectStatusChange(models.Model):
+    """
+    A single regression or fix of a test (or metric) in a ProjectStatus,
+    i.e. of its build with regard to its baseline.
+
+    Since every change is a row, regressions and fixes can be queried across
+    builds, e.g. all the builds where a test regressed:
+
+        Build.objects.filter(
+            status_changes__kind=ProjectStatusChange.REGRESSION,
+            status_changes__metadata=metadata,
+        )
+    """
+
+    REGRESSION = 'regression'
+    FIX = 'fix'
+    METRIC_REGRESSION = 'metric_regression'
+    METRIC_FIX = 'metric_fix'
+
+    KINDS = (
+        (REGRESSION, N_('Regression')),
+        (FIX, N_('Fix')),
+        (METRIC_REGRESSION, N_('Metric regression')),
+        (METRIC_FIX, N_('Metric fix')),
+    )
+
+    status = models.ForeignKey(ProjectStatus, related_name='changes', on_delete=models.CASCADE)
+    build = models.ForeignKey(Build, related_name='status_changes', on_delete=models.CASCADE)
+    kind = models.CharField(max_length=32, choices=KINDS)
+    environment = models.ForeignKey(Environment, related_name='+', on_delete=models.CASCADE)
+    suite = models.ForeignKey(Suite, related_name='+', null=True, on_delete=models.CASCADE)
+    metadata = models.ForeignKey(SuiteMetadata, related_name='+', on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('status', 'environment', 'suite', 'metadata')
+        indexes = [
+            models.Index(fields=['metadata', 'kind']),
+        ]
+
+    @property
+    def full_name(self):
+        return join_name(self.metadata.suite, self.metadata.name)
+
+    @classmethod
+    def prefetch(cls, lookup='changes'):
+        """
+        Returns a Prefetch object that loads the changes of ProjectStatus
+        objects (possibly through `lookup`) in the order they were recorded.
+        """
+        queryset = cls.objects.select_related('environment', 'metadata').order_by('id')
+        return models.Prefetch(lookup, queryset=queryset)
+
+    @classmethod
+    def record(cls, status, changes):
+        """
+        Stores the regressions and fixes of the given status. `changes` maps
+        each kind to a mapping of environment slugs to test (or metric)
+        full names, as given by TestComparison/MetricComparison.
+        """
+        entries = []
+        for kind, changes_by_env in changes.items():
+            metadata_kind = 'metric' if kind in (cls.METRIC_REGRESSION, cls.METRIC_FIX) else 'test'
+            for env, full_names in changes_by_env.items():
+                for full_name in full_names:
+                    suite, name = parse_name(full_name)
+                    entries.append((kind, env, (metadata_kind, suite, name)))
+
+        if not entries:
+            return
+
+        project_id = status.build.project_id
+        environments = dict(Environment.objects.filter(
+            project_id=project_id,
+            slug__in={env for _, env, _ in entries},
+        ).values_list('slug', 'id'))
+        suites = dict(Suite.objects.filter(
+            project_id=project_id,
+            slug__in={key[1] for _, _, key in entries},
+        ).values_list('slug', 'id'))
+
+        metadata = {}
+        keys = {key for _, _, key in entries}
+        candidates = SuiteMetadata.objects.filter(
+            kind__in={key[0] for key in keys},
+            suite__in={key[1] for key in keys},
+            name__in={key[2] for key in keys},
+        ).values_list('kind', 'suite', 'name', 'id')
+        for metadata_kind, suite, name, metadata_id in candidates:
+            metadata[(metadata_kind, suite, name)] = metadata_id
+
+        missing = keys - set(metadata.keys())
+        if missing:
+            SuiteMetadata.objects.bulk_create(
+                [SuiteMetadata(kind=metadata_kind, suite=suite, name=name) for metadata_kind, suite, name in missing],
+                ignore_conflicts=True,
+            )
+            for metadata_kind, suite, name, metadata_id in candidates.all():
+                metadata[(metadata_kind, suite, name)] = metadata_id
+
+        objects = [
+            cls(
+                status=status,
+                build_id=status.build_id,
+                kind=kind,
+                environment_id=environments[env],
+                suite_id=suites.get(key[1]),
+                metadata_id=metadata[key],
+            )
+            for kind, env, key in entries
+            if env in environments
+        ]
+        cls.objects.bulk_create(objects, ignore_conflicts=True)
 
 
 class NotificationDelivery(models.Model):
@@ -1531,10 +2183,44 @@ class MetricsSummary(object):
         queryset = Metric.objects.filter(build=build)
         if environment:
             queryset = queryset.filter(environment=environment)
-        metrics = queryset.all()
-        values = [m.result for m in metrics]
+        values = list(queryset.values_list('result', flat=True))
         self.value = geomean(values)
         self.has_metrics = len(values) > 0
+        self.log_sum, self.count = geomean_terms(values)
+
+
+def summary_increments(testrun, status, metrics):
+    """
+    Returns the arguments for a QuerySet.update() call that adds the results
+    of the given test run to a ProjectStatus or BuildSummary, given its
+    overall Status (i.e. the one with suite=None) and its metrics results.
+    F() expressions are used so that concurrent updates don't step on each
+    other.
+    """
+    completed = 1 if testrun.completed else 0
+    increments = {
+        'tests_pass': F('tests_pass') + status.tests_pass,
+        'tests_fail': F('tests_fail') + status.tests_fail,
+        'tests_xfail': F('tests_xfail') + status.tests_xfail,
+        'tests_skip': F('tests_skip') + status.tests_skip,
+        'test_runs_total': F('test_runs_total') + 1,
+        'test_runs_completed': F('test_runs_completed') + completed,
+        'test_runs_incomplete': F('test_runs_incomplete') + (1 - completed),
+    }
+
+    if len(metrics):
+        log_sum, count = geomean_terms(metrics)
+        increments['has_metrics'] = True
+        increments['metrics_log_sum'] = F('metrics_log_sum') + log_sum
+        increments['metrics_count'] = F('metrics_count') + count
+        if count:
+            increments['metrics_summary'] = Exp(
+                (F('metrics_log_sum') + log_sum) / (F('metrics_count') + count)
+            )
+        else:
+            increments['metrics_summary'] = Coalesce(F('metrics_summary'), 0.0)
+
+    return increments
 
 
 class BuildSummary(models.Model, TestSummaryBase):
@@ -1543,6 +2229,10 @@ class BuildSummary(models.Model, TestSummaryBase):
     metrics_summary = models.FloatField(null=True)
     has_metrics = models.BooleanField(default=False)
 
+    # see ProjectStatus
+    metrics_log_sum = models.FloatField(default=0.0)
+    metrics_count = models.IntegerField(null=True, default=0)
+
     tests_pass = models.IntegerField(default=0)
     tests_fail = models.IntegerField(default=0)
     tests_xfail = models.IntegerField(default=0)
@@ -1558,7 +2248,8 @@ class BuildSummary(models.Model, TestSummaryBase):
     def create_or_update(cls, build, environment):
         """
         Creates (or updates) a BuildSummary given build/environment and
-        returns it.
+        returns it. Like ProjectStatus.create_or_update, everything is
+        recomputed from scratch.
         """
 
         metrics_summary = MetricsSummary(build, environment)
@@ -1570,6 +2261,8 @@ class BuildSummary(models.Model, TestSummaryBase):
         data = {
             'metrics_summary': metrics_summary.value,
             'has_metrics': metrics_summary.has_metrics,
+            'metrics_log_sum': metrics_summary.log_sum,
+            'metrics_count': metrics_summary.count,
             'tests_pass': test_summary.tests_pass,
             'tests_fail': test_summary.tests_fail,
             'tests_xfail': test_summary.tests_xfail,
@@ -1591,18 +2284,300 @@ class BuildSummary(models.Model, TestSummaryBase):
             return
 
         if not created:
-            summary.metrics_summary = metrics_summary.value
-            summary.has_metrics = metrics_summary.has_metrics
-            summary.tests_pass = test_summary.tests_pass
-            summary.tests_fail = test_summary.tests_fail
-            summary.tests_xfail = test_summary.tests_xfail
-            summary.tests_skip = test_summary.tests_skip
-            summary.test_runs_total = test_runs_total
-            summary.test_runs_completed = test_runs_completed
-            summary.test_runs_incomplete = test_runs_incomplete
+            for field, value in data.items():
+                setattr(summary, field, value)
             summary.save()
         return summary
 
+    @classmethod
+    def refresh(cls, build, environment):
+        """
+        Returns the BuildSummary for the given build/environment, computing
+        it from scratch only if it does not exist yet or was invalidated.
+        """
+        summary = cls.objects.filter(build=build, environment=environment).first()
+        if summary is None or summary.metrics_count is None:
+            summary = cls.create_or_update(build, environment)
+        return summary
+
+    @classmethod
+    def add_testrun(cls, testrun, status, metrics):
+        """
+        Adds the results of a test run to the BuildSummary of its
+        build/environment. See ProjectStatus.add_testrun.
+        """
+        updated = cls.objects.filter(
+            build_id=testrun.build_id,
+            environment_id=testrun.environment_id,
+        ).update(**summary_increments(testrun, status, metrics))
+        if not updated:
+            cls.create_or_update(testrun.build, testrun.environment)
+
+    @classmethod
+    def invalidate(cls, build_id, environment_id):
+        cls.objects.filter(build_id=build_id, environment_id=environment_id).update(metrics_count=None)
+
+
+class BuildComparison(models.Model):
+    """
+    Regressions and fixes between two builds, as computed by
+    TestComparison/MetricComparison with regressions_and_fixes_only=True.
+
+    `data` is compact JSON, and the whole row is discarded whenever either
+    build gets new (or reprocessed, or deleted) test runs, so a cached
+    comparison can be reused by notifications, reports and the UI until
+    then.
+    """
+
+    TESTS = 'tests'
+    METRICS = 'metrics'
+
+    baseline = models.ForeignKey(Build, related_name='+', on_delete=models.CASCADE)
+    target = models.ForeignKey(Build, related_name='+', on_delete=models.CASCADE)
+    kind = models.CharField(max_length=16, choices=((TESTS, TESTS), (METRICS, METRICS)))
+    data = models.TextField()
+
+    class Meta:
+        unique_together = ('baseline', 'target', 'kind',)
+
+    @classmethod
+    def get(cls, baseline, target, kind):
+        data = cls.objects.filter(baseline=baseline, target=target, kind=kind).values_list('data', flat=True).first()
+        if data is None:
+            return None
+        return json.loads(data, object_pairs_hook=OrderedDict)
+
+    @classmethod
+    def store(cls, baseline, target, kind, data):
+        # a concurrent comparison of the same builds might have stored it
+        # already, which is fine since the results are the same
+        comparison = cls(baseline=baseline, target=target, kind=kind, data=json.dumps(data, separators=(',', ':')))
+        cls.objects.bulk_create([comparison], ignore_conflicts=True)
+
+    @classmethod
+    def __discard__(cls, condition):
+        def discard():
+            cls.objects.filter(condition).delete()
+
+        discard()
+        # a comparison computed concurrently, before the changes being made
+        # are committed, could still be stored after the delete above
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(discard)
+
+    @classmethod
+    def invalidate(cls, build_id, kind=None):
+        condition = Q(baseline_id=build_id) | Q(target_id=build_id)
+        if kind:
+            condition &= Q(kind=kind)
+        cls.__discard__(condition)
+
+    @classmethod
+    def invalidate_projects(cls, project_ids, kind=None):
+        project_ids = list(project_ids)
+        if not project_ids:
+            return
+        condition = Q(baseline__project_id__in=project_ids) | Q(target__project_id__in=project_ids)
+        if kind:
+            condition &= Q(kind=kind)
+        cls.__discard__(condition)
+
+
+class BuildTestMatrix(models.Model):
+    """
+    The status of each test of a build in each environment, i.e. one row
+    per cell of the build tests page (see squad.frontend.tests). Duplicates
+    of a test in the same environment are resolved the same way as
+    squad.core.queries.test_confidence does, and `confidence` is only set
+    when there are duplicates.
+
+    Cells are added/updated as test runs arrive (see RecordTestRunStatus).
+    When test runs of a build are deleted or reprocessed, all of its cells
+    are discarded, and computed again on demand.
+    """
+
+    # number of rows inserted per INSERT statement
+    BATCH_SIZE = 500
+
+    build = models.ForeignKey(Build, related_name='test_matrix', on_delete=models.CASCADE)
+    environment = models.ForeignKey(Environment, related_name='+', on_delete=models.CASCADE)
+    suite = models.ForeignKey(Suite, related_name='+', on_delete=models.CASCADE)
+    metadata = models.ForeignKey(SuiteMetadata, related_name='+', on_delete=models.CASCADE)
+    status = models.CharField(max_length=8)
+    confidence = models.FloatField(null=True)
+
+    class Meta:
+        unique_together = ('build', 'metadata', 'environment')
+        indexes = [
+            models.Index(fields=['build', 'environment']),
+            models.Index(fields=['build', 'suite']),
+        ]
+
+    @classmethod
+    def refresh(cls, build_id, environment_id=None, metadata_ids=None):
+        """
+        Computes the cells of the given build from its tests, optionally
+        only for the given environment and tests.
+        """
+        tests = Test.objects.filter(build_id=build_id, metadata__isnull=False)
+        if environment_id is not None:
+            tests = tests.filter(environment_id=environment_id)
+        if metadata_ids is not None:
+            tests = tests.filter(metadata_id__in=metadata_ids)
+
+        rows = tests.values(
+            'metadata_id',
+            'environment_id',
+            'suite_id',
+        ).order_by().annotate(
+            total=Count('id'),
+            **status_counts()
+        ).annotate(
+            status=resolved_status(),
+        )
+
+        cells = (
+            cls(
+                build_id=build_id,
+                environment_id=row['environment_id'],
+                suite_id=row['suite_id'],
+                metadata_id=row['metadata_id'],
+                status=row['status'],
+                confidence=row[row['status']] / row['total'] * 100 if row['total'] > 1 else None,
+            )
+            for row in rows.iterator()
+        )
+        for chunk in split_iterable(cells, cls.BATCH_SIZE):
+            # insert the new cells, then update the ones that already
+            # existed (or were inserted concurrently)
+            cls.objects.bulk_create(chunk, ignore_conflicts=True)
+
+            existing = cls.objects.filter(
+                build_id=build_id,
+                metadata_id__in=set(c.metadata_id for c in chunk),
+                environment_id__in=set(c.environment_id for c in chunk),
+            ).values_list('id', 'metadata_id', 'environment_id', 'suite_id', 'status', 'confidence')
+            cells_by_key = {(c.metadata_id, c.environment_id): c for c in chunk}
+
+            changed = []
+            for cell_id, metadata_id, environment_id, suite_id, status, confidence in existing:
+                cell = cells_by_key.get((metadata_id, environment_id))
+                if cell is None or (cell.suite_id, cell.status, cell.confidence) == (suite_id, status, confidence):
+                    continue
+                cell.id = cell_id
+                changed.append(cell)
+            if changed:
+                cls.objects.bulk_update(changed, ['suite', 'status', 'confidence'])
+
+    @classmethod
+    def record(cls, testrun):
+        """
+        Adds (or updates) the cells for the tests of the given test run.
+        """
+        if cls.objects.filter(build_id=testrun.build_id).exists():
+            cls.refresh(testrun.build_id, testrun.environment_id, testrun.tests.values('metadata_id'))
+        else:
+            # first test run, or the cells were discarded
+            cls.refresh(testrun.build_id)
+
+    @classmethod
+    def invalidate(cls, build_id):
+        cls.objects.filter(build_id=build_id).delete()
+
+
+class BuildMetadata(models.Model):
+    """
+    The union of the metadata of the test runs of a build (see
+    Build.metadata). `data` is compact JSON that maps each metadata key to
+    its distinct values, indexed by a hash of their JSON representation.
+
+    Test runs are merged into it as they are created (see TestRun.save).
+    When the metadata of a test run changes, or test runs of the build are
+    deleted, the row is discarded and computed again on demand. Rows are
+    always created before being computed, with empty `data`, and computed
+    or merged into while locked.
+    """
+
+    build = models.OneToOneField(Build, related_name='metadata_union', on_delete=models.CASCADE)
+    data = models.TextField()
+
+    @staticmethod
+    def merge(data, metadata):
+        for key, value in metadata.items():
+            digest = sha1(json.dumps(value, sort_keys=True).encode()).hexdigest()
+            data.setdefault(key, {}).setdefault(digest, value)
+        return data
+
+    @staticmethod
+    def dumps(data):
+        return json.dumps(data, separators=(',', ':'))
+
+    @classmethod
+    def __locked__(cls, build_id):
+        """
+        Returns the row of the given build, locked, creating it first if
+        needed. A row that was just created has empty `data`, i.e. it was
+        not computed yet.
+        """
+        cls.objects.bulk_create([cls(build_id=build_id, data='')], ignore_conflicts=True)
+        return cls.objects.select_for_update().filter(build_id=build_id).first()
+
+    @classmethod
+    def __compute__(cls, build_id):
+        data = {}
+        testruns = TestRun.objects.filter(build_id=build_id).exclude(metadata_file=None).order_by('id')
+        for metadata_file in testruns.values_list('metadata_file', flat=True).iterator():
+            cls.merge(data, json.loads(metadata_file))
+        return data
+
+    @classmethod
+    def refresh(cls, build_id):
+        with transaction.atomic():
+            row = cls.__locked__(build_id)
+            data = cls.__compute__(build_id)
+            if row is not None:
+                row.data = cls.dumps(data)
+                row.save(update_fields=['data'])
+        return data
+
+    @classmethod
+    def record(cls, build_id, metadata):
+        """
+        Merges the metadata of a new test run of the given build.
+        """
+        with transaction.atomic():
+            row = cls.__locked__(build_id)
+            if row is None:
+                # invalidated concurrently; computed again on demand
+                return
+            if row.data:
+                data = cls.merge(json.loads(row.data), metadata)
+            else:
+                data = cls.__compute__(build_id)
+            row.data = cls.dumps(data)
+            row.save(update_fields=['data'])
+
+    @classmethod
+    def for_build(cls, build_id):
+        data = cls.objects.filter(build_id=build_id).values_list('data', flat=True).first()
+        if not data:
+            data = cls.refresh(build_id)
+        else:
+            data = json.loads(data)
+
+        metadata = {}
+        for key, values in data.items():
+            values = list(values.values())
+            if len(values) == 1:
+                metadata[key] = values[0]
+            else:
+                metadata[key] = sorted(values, key=str)
+        return metadata
+
+    @classmethod
+    def invalidate(cls, build_id):
+        cls.objects.filter(build_id=build_id).delete()
+
 
 class Subscription(models.Model):
     project = models.ForeignKey(Project, related_name='subscriptions', on_delete=models.CASCADE)
@@ -1680,6 +2655,8 @@ class KnownIssue(models.Model):
     intermittent = models.BooleanField(default=False)
     environments = models.ManyToManyField(Environment)
 
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+
     @classmethod
     def active_by_environment(cls, environment):
         return cls.objects.filter(active=True, environments=environment)
@@ -1691,6 +2668,87 @@ class KnownIssue(models.Model):
             qs = qs.filter(test_name=test_name)
         return qs.distinct()
 
+    __matchers__ = {}
+
+    @classmethod
+    def matcher_for_environment(cls, environment):
+        """
+        Returns a KnownIssueMatcher for the active known issues of the given
+        environment. Matchers are cached per environment, and only rebuilt
+        when the known issues of that environment change, which is detected
+        by their count and latest ``updated_at`` in a single aggregate query.
+        """
+        return cls.matchers_for_environments([environment.id])[environment.id]
+
+    @classmethod
+    def matchers_for_environments(cls, environment_ids):
+        """
+        Same as `matcher_for_environment`, for several environments at once.
+        Returns a dict mapping each of the given environment ids to its
+        matcher, reading the versions of all of them with one query, and the
+        known issues of the ones whose matcher is out of date with another.
+        """
+        environment_ids = set(environment_ids)
+        links = cls.environments.through.objects.filter(knownissue__active=True)
+
+        versions = {environment_id: (0, None) for environment_id in environment_ids}
+        counts = links.filter(
+            environment_id__in=environment_ids,
+        ).values('environment_id').annotate(
+            count=Count('knownissue_id'),
+            updated_at=Max('knownissue__updated_at'),
+        ).values_list('environment_id', 'count', 'updated_at').order_by()
+        for environment_id, count, updated_at in counts:
+            versions[environment_id] = (count, updated_at)
+
+        stale = [
+            environment_id
+            for environment_id, version in versions.items()
+            if cls.__matchers__.get(environment_id, (None,))[0] != version
+        ]
+        if stale:
+            issues = {environment_id: [] for environment_id in stale}
+            for link in links.filter(environment_id__in=stale).select_related('knownissue').order_by('knownissue_id'):
+                issues[link.environment_id].append(link.knownissue)
+            for environment_id in stale:
+                cls.__matchers__[environment_id] = (versions[environment_id], KnownIssueMatcher(issues[environment_id]))
+
+        return {environment_id: cls.__matchers__[environment_id][1] for environment_id in environment_ids}
+
+
+def invalidate_known_issue_comparisons(environment_ids):
+    # intermittent known issues are not reported as fixes
+    project_ids = Environment.objects.filter(id__in=environment_ids).values_list('project_id', flat=True).distinct()
+    BuildComparison.invalidate_projects(project_ids, BuildComparison.TESTS)
+
+
+@receiver(post_save, sender=KnownIssue)
+@receiver(pre_delete, sender=KnownIssue)
+def invalidate_known_issue_matchers(sender, instance, **kwargs):
+    KnownIssue.__matchers__.clear()
+    invalidate_known_issue_comparisons(instance.environments.values_list('id', flat=True))
+
+
+@receiver(m2m_changed, sender=KnownIssue.environments.through)
+def invalidate_known_issue_environments(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    KnownIssue.__matchers__.clear()
+    # bump the version seen by the matcher caches of other processes
+    if reverse:
+        if pk_set:
+            KnownIssue.objects.filter(id__in=pk_set).update(updated_at=timezone.now())
+    else:
+        KnownIssue.objects.filter(id=instance.id).update(updated_at=timezone.now())
+
+    if reverse:
+        environment_ids = [instance.id]
+    elif action == 'pre_clear':
+        environment_ids = instance.environments.values_list('id', flat=True)
+    else:
+        environment_ids = pk_set
+    invalidate_known_issue_comparisons(environment_ids)
+
 
 class Annotation(models.Model):
     description = models.CharField(max_length=1024, null=True, blank=True)
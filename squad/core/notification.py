@@ -1,21 +1,22 @@
 from collections import OrderedDict
 from squad.mail import Message
 from django.conf import settings
-import django.template
 import logging
 import yaml
 from django.template.loader import render_to_string
 from re import sub
 
 
-from squad.core.models import KnownIssue, NotificationDelivery, Subscription, Metric
+from squad.core.models import KnownIssue, NotificationDelivery, Subscription, Metric, EmailTemplate
 from squad.core.comparison import TestComparison
 
 
-jinja2 = django.template.engines['jinja2']
 logger = logging.getLogger()
 
 
+DEFAULT_SUBJECT = '{{project}}: {{tests_total}} tests, {{tests_fail}} failed, {{tests_pass}} passed, {{tests_skip}} skipped (build {{build}})'
+
+
 class Notification(object):
     """
     Represents a notification about a project status change, that may or may
@@ -125,11 +126,11 @@ class Notification(object):
         if custom_email_template is None and self.project.custom_email_template is not None:
             custom_email_template = self.project.custom_email_template
         if custom_email_template and custom_email_template.subject:
-            template = custom_email_template.subject
+            template = custom_email_template.compiled('subject')
         else:
-            template = '{{project}}: {{tests_total}} tests, {{tests_fail}} failed, {{tests_pass}} passed, {{tests_skip}} skipped (build {{build}})'
+            template = EmailTemplate.compile(None, 'subject', DEFAULT_SUBJECT)
 
-        return jinja2.from_string(template).render(subject_data)
+        return template.render(subject_data)
 
     def message(self, do_html=True, custom_email_template=None):
         """
@@ -154,11 +155,11 @@ class Notification(object):
 
         html_message = ''
         if custom_email_template:
-            text_template = jinja2.from_string(custom_email_template.plain_text)
+            text_template = custom_email_template.compiled('plain_text')
             text_message = text_template.render(context)
 
             if do_html:
-                html_template = jinja2.from_string(custom_email_template.html)
+                html_template = custom_email_template.compiled('html')
                 html_message = html_template.render(context)
         else:
             text_message = render_to_string(
@@ -0,0 +1,200 @@
+"""
+Delivery of notifications to patch sources (Gerrit, GitHub, etc).
+
+Notifications are queued as PatchNotification objects, and delivered in
+batches by the `deliver_patch_notifications` task:
+
+* pending notifications for the same change (i.e. same patch source and
+  patch id) are handed together to the patch source plugin (see
+  Plugin.notify_patch_builds), so that they can be sent in a single request;
+* different changes are notified concurrently, with at most
+  SQUAD_PATCH_SOURCE_CONCURRENCY requests in flight to the same host in
+  each worker process;
+* failed notifications are retried with exponential backoff; when a plugin
+  reports results per update, only the updates that failed are retried.
+
+Plugins should use `get_session` for HTTP requests, and `ssh_options` for
+ssh commands, so that connections to the same patch source are reused
+instead of paying for a new TLS/ssh handshake on every notification.
+"""
+
+import logging
+import os
+import tempfile
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+from django.db import connection
+
+from squad.core.models import PatchNotification
+
+
+logger = logging.getLogger()
+
+
+# number of notifications delivered per task
+BATCH_SIZE = 100
+
+# maximum number of changes notified at the same time by one task
+MAX_WORKERS = 16
+
+# number of seconds an idle ssh master connection is kept open
+SSH_CONTROL_PERSIST = 60
+
+
+__lock__ = threading.Lock()
+__sessions__ = {}
+__semaphores__ = {}
+
+
+def get_session(patch_source):
+    """
+    Returns a requests session for the given patch source. Sessions are
+    shared by all threads in the process, and keep up to
+    SQUAD_PATCH_SOURCE_CONCURRENCY connections open.
+    """
+    key = (patch_source.id, patch_source.url)
+    with __lock__:
+        session = __sessions__.get(key)
+        if session is None:
+            adapter = HTTPAdapter(pool_maxsize=settings.SQUAD_PATCH_SOURCE_CONCURRENCY)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            __sessions__[key] = session
+    return session
+
+
+def ssh_options():
+    """
+    Returns ssh options to share a master connection among all ssh commands
+    to the same user/host/port (see ControlMaster in ssh_config(5)).
+    """
+    control_path = os.path.join(tempfile.gettempdir(), 'squad-ssh-%C')
+    return [
+        '-o', 'ControlMaster=auto',
+        '-o', 'ControlPath=%s' % control_path,
+        '-o', 'ControlPersist=%d' % SSH_CONTROL_PERSIST,
+    ]
+
+
+@contextmanager
+def destination_slot(destination):
+    """
+    Waits until there are less than SQUAD_PATCH_SOURCE_CONCURRENCY
+    notifications being delivered to `destination` by this process.
+    """
+    with __lock__:
+        semaphore = __semaphores__.get(destination)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(settings.SQUAD_PATCH_SOURCE_CONCURRENCY)
+            __semaphores__[destination] = semaphore
+    with semaphore:
+        yield
+
+
+class Change(object):
+    """
+    The pending notifications for one change. `updates` are the (build,
+    event) pairs to be handed to the plugin.
+    """
+
+    def __init__(self, patch_source):
+        self.patch_source = patch_source
+        self.destination = urlparse(patch_source.url).netloc
+        self.notifications = []
+        self.updates = []
+        # notification id -> (build id, event) of the update that delivers it
+        self.covered_by = {}
+
+    def failed(self, results):
+        """
+        Returns the notifications that were not delivered, given the
+        results of Plugin.notify_patch_builds for `updates`.
+        """
+        if not isinstance(results, (list, tuple)):
+            results = [results is not False] * len(self.updates)
+        failed = set((build.id, event) for (build, event), result in zip(self.updates, results) if not result)
+        return [n for n in self.notifications if self.covered_by[n.id] in failed]
+
+
+def group_by_change(notifications):
+    """
+    Groups notifications by change. A notification that a build was created
+    is dropped when there is also one that the same build has finished, and
+    so are duplicates.
+    """
+    finished = set(n.build_id for n in notifications if n.event == PatchNotification.FINISHED)
+
+    changes = OrderedDict()
+    for notification in notifications:
+        build = notification.build
+        key = (build.patch_source_id, build.patch_id)
+        if key not in changes:
+            changes[key] = Change(build.patch_source)
+        change = changes[key]
+        change.notifications.append(notification)
+
+        event = notification.event
+        if event == PatchNotification.CREATED and build.id in finished:
+            event = PatchNotification.FINISHED
+        change.covered_by[notification.id] = (build.id, event)
+
+        if event != notification.event:
+            continue
+        if any(b.id == build.id and e == event for b, e in change.updates):
+            continue
+        change.updates.append((build, event))
+
+    return list(changes.values())
+
+
+def deliver_change(change):
+    """
+    Hands the updates of `change` to its patch source plugin. Returns the
+    notifications that were not delivered.
+    """
+    plugin = change.patch_source.get_implementation()
+    try:
+        with destination_slot(change.destination):
+            return change.failed(plugin.notify_patch_builds(change.updates))
+    except Exception as e:
+        logger.error('Failed to notify %s: %s' % (change.patch_source, str(e)))
+        return change.notifications
+
+
+def deliver_change_in_thread(change):
+    try:
+        return deliver_change(change)
+    finally:
+        # each thread has its own database connection
+        connection.close()
+
+
+def deliver(notifications):
+    """
+    Delivers the given notifications. Delivered notifications are deleted;
+    the ones that failed are returned.
+    """
+    changes = group_by_change(notifications)
+
+    if len(changes) < 2:
+        results = [deliver_change(change) for change in changes]
+    else:
+        with ThreadPoolExecutor(max_workers=min(len(changes), MAX_WORKERS)) as executor:
+            results = list(executor.map(deliver_change_in_thread, changes))
+
+    failed = [notification for change_failed in results for notification in change_failed]
+    failed_ids = set(n.id for n in failed)
+    PatchNotification.objects.filter(
+        id__in=[n.id for n in notifications if n.id not in failed_ids],
+    ).delete()
+    return failed
@@ -152,6 +152,33 @@ class Plugin(object):
         """
         pass
 
+    def notify_patch_builds(self, updates):
+        """
+        This method is called with the pending notifications for one change
+        (i.e. builds with the same patch source and patch id). ``updates`` is
+        a list of ``(build, event)`` tuples, in the order they were
+        requested, where ``event`` is either ``"created"`` or
+        ``"finished"``.
+
+        The default implementation calls ``notify_patch_build_created`` or
+        ``notify_patch_build_finished`` for each of them; plugins can
+        override it to send all of them in a single request.
+
+        If this method returns ``False``, all the notifications will be
+        retried later. It can also return a list with one result for each
+        update, in which case only the updates whose result is ``False``
+        will be retried; the default implementation does that, so that
+        updates already delivered are not sent again.
+        """
+        results = []
+        for build, event in updates:
+            if event == 'finished':
+                result = self.notify_patch_build_finished(build)
+            else:
+                result = self.notify_patch_build_created(build)
+            results.append(result is not False)
+        return results
+
     def get_url(self, object_id):
         """
         This method might return service specific URL with given object_id
@@ -18,13 +18,25 @@ def geomean(values):
     Negative numbers are also excluded on the basis that they most probably
     represent anomalies in the data.
     """
-    values = [v for v in values if v > 0]
+    log_sum, n = geomean_terms(values)
 
-    if len(values) == 0:
+    if n == 0:
         return 0
 
-    n = len(values)
+    return exp(log_sum / n)
+
+
+def geomean_terms(values):
+    """
+    Returns the sum of the logarithms of the values that are taken into
+    account by `geomean`, and how many they are. Those can be accumulated
+    across several sets of values, so that the geometric mean of all of them
+    is exp(total_log_sum / total_count).
+    """
     log_sum = 0.0
+    n = 0
     for v in values:
-        log_sum = log_sum + log(v)
-    return exp(log_sum / n)
+        if v > 0:
+            log_sum = log_sum + log(v)
+            n += 1
+    return (log_sum, n)
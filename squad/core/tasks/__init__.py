@@ -1,17 +1,18 @@
 from django.core.exceptions import MultipleObjectsReturned
+from django.conf import settings
+from django.core.files.base import File
 from django.utils import timezone
 from collections import defaultdict
-import itertools
+import codecs
 import json
 import logging
-import re
 import traceback
 import uuid
 import yaml
 
 
-from django.db import transaction
-from django.db.models import Count
+from django.db import connection, transaction
+from django.db.models import Count, Q
 
 
 from squad.celery import app as celery
@@ -21,6 +22,7 @@ from squad.core.models import (
     SuiteVersion,
     SuiteMetadata,
     Test,
+    TestResultHistory,
     Metric,
     Status,
     ProjectStatus,
@@ -28,15 +30,18 @@ from squad.core.models import (
     Build,
     BuildPlaceholder,
     BuildSummary,
+    BuildComparison,
+    BuildTestMatrix,
     Project,
     DelayedReport
 )
 from squad.core.callback import dispatch_callbacks_on_build_finished
 from squad.core.data import JSONTestDataParser, JSONMetricDataParser
+from squad.core.data import iterate_json_object, NotAJSONObject
 from squad.core.statistics import geomean
 from squad.core.notification import Notification
 from squad.core.plugins import apply_plugins
-from squad.core.utils import join_name
+from squad.core.utils import join_name, split_list, split_iterable, NulStrippingFile
 from rest_framework import status
 from jinja2 import TemplateSyntaxError
 from . import exceptions
@@ -56,7 +61,7 @@ logger = logging.getLogger()
 
 class ValidateTestRun(object):
 
-    def __call__(self, metadata_file=None, metrics_file=None, tests_file=None):
+    def __call__(self, metadata_file=None, metrics_file=None, tests_file=None, log_file=None):
         if metadata_file:
             self.__validate_metadata__(metadata_file)
 
@@ -66,12 +71,64 @@ class ValidateTestRun(object):
         if tests_file:
             self.__validate_tests__(tests_file)
 
+        if isinstance(log_file, File):
+            self.__validate_log__(log_file)
+
+    def parsed(self, metadata=None, metrics=None, tests=None):
+        """
+        Same as calling the object, but for data that is already parsed:
+        `metadata`, `metrics` and `tests` are the objects that would be
+        loaded from the respective JSON files.
+        """
+        if metadata is not None:
+            self.__validate_metadata_object__(metadata)
+
+        if metrics is not None:
+            if type(metrics) is not dict:
+                raise exceptions.InvalidMetricsData.type(metrics)
+            for value_dict in metrics.values():
+                self.__validate_metric_value__(value_dict)
+
+        if tests is not None:
+            if type(tests) is not dict:
+                raise exceptions.InvalidTestsData.type(tests)
+
+    def stored(self, testrun):
+        """
+        Same as calling the object, but for the files already stored with
+        `testrun`, e.g. by an asynchronous submission.
+        """
+        if testrun.tests_file_storage:
+            with testrun.open_tests_file() as tests_file:
+                self.__validate_tests__(tests_file)
+
+        if testrun.metrics_file_storage:
+            with testrun.open_metrics_file() as metrics_file:
+                self.__validate_metrics(metrics_file)
+
+        if testrun.log_file_storage:
+            with testrun.log_file_storage.open('rb') as log_file:
+                self.__validate_log__(log_file)
+
+    def __validate_log__(self, log_file):
+        # uploaded logs are checked in chunks, without decoding all of it at
+        # once; logs given as strings are valid by definition
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        try:
+            for chunk in log_file.chunks():
+                decoder.decode(chunk)
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError as e:
+            raise exceptions.InvalidLog("log is not valid UTF-8: " + str(e))
+
     def __validate_metadata__(self, metadata_json):
         try:
             metadata = json.loads(metadata_json)
         except json.decoder.JSONDecodeError as e:
             raise exceptions.InvalidMetadataJSON("metadata is not valid JSON: " + str(e) + "\n" + metadata_json)
+        self.__validate_metadata_object__(metadata)
 
+    def __validate_metadata_object__(self, metadata):
         if type(metadata) is not dict:
             raise exceptions.InvalidMetadata("metadata is not a object ({})")
 
@@ -83,38 +140,49 @@ class ValidateTestRun(object):
 
     def __validate_metrics(self, metrics_file):
         try:
-            metrics = json.loads(metrics_file)
+            for metric, value_dict in iterate_json_object(metrics_file):
+                self.__validate_metric_value__(value_dict)
         except json.decoder.JSONDecodeError as e:
-            raise exceptions.InvalidMetricsDataJSON("metrics is not valid JSON: " + str(e) + "\n" + metrics_file)
-
-        if type(metrics) is not dict:
-            raise exceptions.InvalidMetricsData.type(metrics)
-
-        for metric, value_dict in metrics.items():
-            if type(value_dict) is dict:
-                value = value_dict.get('value', None)
-            else:
-                value = value_dict
-            if type(value) is str:
-                try:
-                    value = float(value)
-                except ValueError:
-                    raise exceptions.InvalidMetricsData.value(value)
-            if type(value) not in [int, float, list]:
+            raise exceptions.InvalidMetricsDataJSON("metrics is not valid JSON: " + str(e) + self.__contents__(metrics_file))
+        except NotAJSONObject as e:
+            raise exceptions.InvalidMetricsData.type(e.obj)
+        except UnicodeDecodeError as e:
+            raise exceptions.InvalidMetricsData("metrics is not valid UTF-8: " + str(e))
+
+    def __validate_metric_value__(self, value_dict):
+        if type(value_dict) is dict:
+            value = value_dict.get('value', None)
+        else:
+            value = value_dict
+        if type(value) is str:
+            try:
+                value = float(value)
+            except ValueError:
                 raise exceptions.InvalidMetricsData.value(value)
-            if type(value) is list:
-                for item in value:
-                    if type(item) not in [int, float]:
-                        raise exceptions.InvalidMetricsData.value(value)
+        if type(value) not in [int, float, list]:
+            raise exceptions.InvalidMetricsData.value(value)
+        if type(value) is list:
+            for item in value:
+                if type(item) not in [int, float]:
+                    raise exceptions.InvalidMetricsData.value(value)
 
     def __validate_tests__(self, tests_file):
         try:
-            tests = json.loads(tests_file)
+            for _ in iterate_json_object(tests_file):
+                pass
         except json.decoder.JSONDecodeError as e:
-            raise exceptions.InvalidTestsDataJSON("tests is not valid JSON: " + str(e) + "\n" + tests_file)
+            raise exceptions.InvalidTestsDataJSON("tests is not valid JSON: " + str(e) + self.__contents__(tests_file))
+        except NotAJSONObject as e:
+            raise exceptions.InvalidTestsData.type(e.obj)
+        except UnicodeDecodeError as e:
+            raise exceptions.InvalidTestsData("tests is not valid UTF-8: " + str(e))
 
-        if type(tests) is not dict:
-            raise exceptions.InvalidTestsData.type(tests)
+    def __contents__(self, data):
+        # file-like objects are not included in error messages since they
+        # can be arbitrarily large
+        if isinstance(data, str):
+            return "\n" + data
+        return ""
 
 
 class ReceiveTestRun(object):
@@ -132,17 +200,67 @@ class ReceiveTestRun(object):
         "resubmit_url",
     )
 
-    def __call__(self, version, environment_slug, metadata_file=None, metrics_file=None, tests_file=None, log_file=None, attachments={}, completed=True):
+    def __call__(self, version, environment_slug, metadata_file=None, metrics_file=None, tests_file=None, log_file=None, attachments={}, completed=True, asynchronous=False):
+        """
+        Receives a test run. With `asynchronous`, only the metadata is
+        validated here: the test run is stored as queued, and the rest of the
+        validation and the processing are done by the `process_test_run`
+        task.
+        """
         build, build_created = self.project.builds.get_or_create(version=version)
         environment, _ = self.project.environments.get_or_create(slug=environment_slug)
         validate = ValidateTestRun()
-        validate(metadata_file, metrics_file, tests_file)
+        if asynchronous:
+            validate(metadata_file)
+        else:
+            validate(metadata_file, metrics_file, tests_file, log_file)
 
+        metadata = None
         if metadata_file:
-            data = json.loads(metadata_file)
+            metadata = json.loads(metadata_file)
+
+        return self.__receive__(build, build_created, environment, metadata, metadata_file, metrics_file, tests_file, log_file, attachments, completed, asynchronous=asynchronous)
+
+    def receive_parsed(self, version, environment_slug, metadata=None, metrics=None, tests=None, log_file=None, attachments={}, completed=True):
+        """
+        Receives a test run from data that is already parsed, e.g. by a CI
+        backend: `metadata`, `metrics` and `tests` are dictionaries in the
+        same format as the respective JSON files.
 
+        The data is serialized only once, to be stored with the test run; the
+        test run is then processed straight from the given data instead of
+        decoding the stored files again.
+        """
+        build, build_created = self.project.builds.get_or_create(version=version)
+        environment, _ = self.project.environments.get_or_create(slug=environment_slug)
+        validate = ValidateTestRun()
+        validate.parsed(metadata, metrics, tests)
+
+        metadata_file = None
+        if metadata is not None:
+            metadata_file = json.dumps(metadata)
+        metrics_file = None
+        parsed_metrics = None
+        if metrics is not None:
+            metrics_file = json.dumps(metrics)
+            parsed_metrics = metric_parser.iterate_items(metrics.items())
+        tests_file = None
+        parsed_tests = None
+        if tests is not None:
+            tests_file = json.dumps(tests)
+            parsed_tests = test_parser.iterate_items(tests.items())
+
+        return self.__receive__(
+            build, build_created, environment, metadata, metadata_file, metrics_file, tests_file, log_file, attachments, completed,
+            parsed=True,
+            parsed_tests=parsed_tests,
+            parsed_metrics=parsed_metrics,
+        )
+
+    def __receive__(self, build, build_created, environment, metadata, metadata_file, metrics_file, tests_file, log_file, attachments, completed, parsed=False, parsed_tests=None, parsed_metrics=None, asynchronous=False):
+        if metadata is not None:
             fields = self.SPECIAL_METADATA_FIELDS
-            metadata_fields = {k: data[k] for k in fields if data.get(k)}
+            metadata_fields = {k: metadata[k] for k in fields if metadata.get(k)}
 
             job_id = metadata_fields.get('job_id')
             if job_id is None:
@@ -153,13 +271,18 @@ class ReceiveTestRun(object):
         else:
             metadata_fields = {'job_id': uuid.uuid4()}
 
-        if log_file:
+        if isinstance(log_file, File):
+            # copied to the storage in chunks, see storage_save
+            log_file = NulStrippingFile(log_file)
+        elif log_file:
             log_file = log_file.replace("\x00", "")
 
         testrun = build.test_runs.create(
             environment=environment,
             metadata_file=metadata_file,
             completed=completed,
+            processing_status=(TestRun.QUEUED if asynchronous else TestRun.PROCESSED),
+            processing_updated_at=(timezone.now() if asynchronous else None),
             **metadata_fields
         )
 
@@ -177,13 +300,23 @@ class ReceiveTestRun(object):
             attachment.save_file(filename, data)
 
         testrun.refresh_from_db()
+        if parsed and metadata is not None:
+            # metadata_file was serialized from this very object, so there is
+            # no need to decode it again
+            testrun.__metadata__ = metadata
 
         if not build.datetime or testrun.datetime < build.datetime:
             build.datetime = testrun.datetime
             build.save()
 
+        if asynchronous:
+            test_run_id = testrun.id
+            update_project_status = self.update_project_status
+            transaction.on_commit(lambda: process_test_run.delay(test_run_id, update_project_status))
+            return (testrun, build if build_created else None)
+
         processor = ProcessTestRun()
-        processor(testrun)
+        processor(testrun, tests=parsed_tests, metrics=parsed_metrics)
 
         if self.update_project_status:
             UpdateProjectStatus()(testrun)
@@ -209,76 +342,181 @@ def get_suite(test_run, suite_name):
     return suite
 
 
+# Maximum number of rows sent to the database in a single bulk insert or
+# lookup during test run ingestion
+BULK_CREATE_BATCH_SIZE = 1000
+
+
+def get_suite_metadata(kind, keys):
+    """
+    Returns a dict mapping (suite, name) tuples to SuiteMetadata objects of
+    the given kind, creating the ones that don't exist yet in bulk.
+    """
+    keys = set(keys)
+    if not keys:
+        return {}
+
+    suites = set([suite for suite, _ in keys])
+    names = list(set([name for _, name in keys]))
+
+    def lookup(wanted):
+        found = {}
+        for chunk in split_list(names, BULK_CREATE_BATCH_SIZE):
+            queryset = SuiteMetadata.objects.filter(kind=kind, suite__in=suites, name__in=chunk)
+            for metadata in queryset:
+                key = (metadata.suite, metadata.name)
+                if key in wanted:
+                    found[key] = metadata
+        return found
+
+    metadata = lookup(keys)
+    missing = keys - metadata.keys()
+    if missing:
+        SuiteMetadata.objects.bulk_create(
+            [SuiteMetadata(kind=kind, suite=suite, name=name) for suite, name in missing],
+            batch_size=BULK_CREATE_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        metadata.update(lookup(missing))
+    return metadata
+
+
+def get_suites(project, suite_slugs):
+    """
+    Returns a dict mapping suite slugs to Suite objects from the given
+    project, creating the missing suites in bulk. This is the set-based
+    equivalent of calling `get_suite` for each slug.
+    """
+    slugs = set(suite_slugs)
+    if not slugs:
+        return {}
+
+    metadata = get_suite_metadata('suite', [(slug, '-') for slug in slugs])
+    suites = {s.slug: s for s in project.suites.filter(slug__in=slugs)}
+    missing = slugs - suites.keys()
+    if missing:
+        Suite.objects.bulk_create(
+            [Suite(project=project, slug=slug, metadata=metadata[(slug, '-')]) for slug in missing],
+            batch_size=BULK_CREATE_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        suites.update({s.slug: s for s in project.suites.filter(slug__in=missing)})
+    return suites
+
+
 class ParseTestRunData(object):
 
     @staticmethod
-    def __call__(test_run):
+    def __call__(test_run, tests=None, metrics=None):
+        """
+        Creates the tests and metrics of `test_run` from its tests and
+        metrics files. `tests` and `metrics` can be given instead, as
+        iterables of records in the format produced by `test_parser` and
+        `metric_parser`, in which case the files are not read.
+        """
         if test_run.data_processed:
             return
 
-        issues = {}
-        for issue in KnownIssue.active_by_environment(test_run.environment):
-            issues.setdefault(issue.test_name, [])
-            issues[issue.test_name].append(issue)
-
-        # Issues' test_name should be interpreted as regexes
-        # so compile them prior to matching against test names
-        # The * character should be replaced by .*?, which is regex for "everything"
-        issues_regex = {}
-        for test_name_regex in issues.keys():
-            pattern = re.escape(test_name_regex).replace('\\*', '.*?')
-            regex = re.compile(pattern)
-            issues_regex[regex] = issues[test_name_regex]
-
-        for test in test_parser()(test_run.tests_file):
-            # TODO: remove check below when test_name size changes in the schema
-            if len(test['test_name']) > 256:
-                continue
-            suite = get_suite(
-                test_run,
-                test['group_name']
-            )
-            metadata, _ = SuiteMetadata.objects.get_or_create(suite=suite.slug, name=test['test_name'], kind='test')
-            full_name = join_name(suite.slug, test['test_name'])
-
-            test_issues = list(itertools.chain(*[issue for regex, issue in issues_regex.items() if regex.match(full_name)]))
-
-            test_obj = Test.objects.create(
-                test_run=test_run,
-                suite=suite,
-                metadata=metadata,
-                result=test['pass'],
-                log=test['log'],
-                has_known_issues=bool(test_issues),
-                build=test_run.build,
-                environment=test_run.environment,
-            )
-            for issue in test_issues:
-                test_obj.known_issues.add(issue)
-
-        for metric in metric_parser()(test_run.metrics_file):
-            # TODO: remove check below when test_name size changes in the schema
-            if len(metric['name']) > 256:
-                continue
-            suite = get_suite(
-                test_run,
-                metric['group_name']
-            )
-            metadata, _ = SuiteMetadata.objects.get_or_create(suite=suite.slug, name=metric['name'], kind='metric')
-            Metric.objects.create(
-                test_run=test_run,
-                suite=suite,
-                metadata=metadata,
-                result=metric['result'],
-                measurements=','.join([str(m) for m in metric['measurements']]),
-                unit=metric['unit'],
-                build=test_run.build,
-                environment=test_run.environment,
-            )
+        if tests is None:
+            with test_run.open_tests_file() as tests_file:
+                ParseTestRunData.__create_tests__(test_run, test_parser().iterate(tests_file))
+        else:
+            ParseTestRunData.__create_tests__(test_run, tests)
+
+        if metrics is None:
+            with test_run.open_metrics_file() as metrics_file:
+                ParseTestRunData.__create_metrics__(test_run, metric_parser().iterate(metrics_file))
+        else:
+            ParseTestRunData.__create_metrics__(test_run, metrics)
 
         test_run.data_processed = True
         test_run.save()
 
+    @staticmethod
+    def __create_tests__(test_run, tests):
+        known_issues = KnownIssue.matcher_for_environment(test_run.environment)
+
+        project = test_run.build.project
+
+        # TODO: remove length checks below when test_name size changes in the schema
+        tests = (t for t in tests if len(t['test_name']) <= 256)
+        for chunk in split_iterable(tests, BULK_CREATE_BATCH_SIZE):
+            suites = get_suites(project, [t['group_name'] for t in chunk])
+            tests_metadata = get_suite_metadata('test', [(t['group_name'], t['test_name']) for t in chunk])
+
+            test_objs = []
+            test_issues = []
+            for test in chunk:
+                suite = suites[test['group_name']]
+                full_name = join_name(suite.slug, test['test_name'])
+                matched = known_issues.match(full_name)
+
+                test_objs.append(Test(
+                    test_run=test_run,
+                    suite=suite,
+                    metadata=tests_metadata[(suite.slug, test['test_name'])],
+                    result=test['pass'],
+                    log=test['log'],
+                    has_known_issues=bool(matched),
+                    build=test_run.build,
+                    environment=test_run.environment,
+                ))
+                test_issues.append(matched)
+
+            create_tests(test_objs, test_issues)
+
+    @staticmethod
+    def __create_metrics__(test_run, metrics):
+        project = test_run.build.project
+
+        metrics = (m for m in metrics if len(m['name']) <= 256)
+        for chunk in split_iterable(metrics, BULK_CREATE_BATCH_SIZE):
+            suites = get_suites(project, [m['group_name'] for m in chunk])
+            metrics_metadata = get_suite_metadata('metric', [(m['group_name'], m['name']) for m in chunk])
+            Metric.objects.bulk_create([
+                Metric(
+                    test_run=test_run,
+                    suite=suites[metric['group_name']],
+                    metadata=metrics_metadata[(metric['group_name'], metric['name'])],
+                    result=metric['result'],
+                    measurements=','.join([str(m) for m in metric['measurements']]),
+                    unit=metric['unit'],
+                    build=test_run.build,
+                    environment=test_run.environment,
+                )
+                for metric in chunk
+            ])
+
+
+def create_tests(tests, issues):
+    """
+    Inserts `tests` in bulk, linking each one of them to the known issues in
+    the matching position of `issues`.
+    """
+    if connection.features.can_return_rows_from_bulk_insert:
+        Test.objects.bulk_create(tests, batch_size=BULK_CREATE_BATCH_SIZE)
+    else:
+        # without primary keys coming back from the database, tests with
+        # known issues need to be created one by one to be linked to them
+        Test.objects.bulk_create(
+            [t for t, i in zip(tests, issues) if not i],
+            batch_size=BULK_CREATE_BATCH_SIZE,
+        )
+        for test, test_issues in zip(tests, issues):
+            if test_issues:
+                test.save()
+
+    TestKnownIssue = Test.known_issues.through
+    TestKnownIssue.objects.bulk_create(
+        [
+            TestKnownIssue(test_id=test.id, knownissue_id=issue.id)
+            for test, test_issues in zip(tests, issues)
+            for issue in test_issues
+        ],
+        batch_size=BULK_CREATE_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
 
 class PostProcessTestRun(object):
 
@@ -420,7 +658,9 @@ class RecordTestRunStatus(object):
             status[s['suite_id']].tests_skip += s['skip_count']
 
         metrics = defaultdict(lambda: [])
+        results = []
         for metric in testrun.metrics.all():
+            results.append(metric.result)
             sid = metric.suite_id
             for v in metric.measurement_list:
                 metrics[None].append(v)
@@ -441,6 +681,27 @@ class RecordTestRunStatus(object):
             s.suite_version = get_suite_version(testrun, s.suite)
             s.save()
 
+        if testrun.status_summarized:
+            # results are being recorded again (e.g. after reprocessing the
+            # test run), so the counters can't just be incremented
+            ProjectStatus.invalidate(testrun.build_id)
+            BuildSummary.invalidate(testrun.build_id, testrun.environment_id)
+            BuildTestMatrix.invalidate(testrun.build_id)
+            TestResultHistory.rebuild(
+                testrun.build.project,
+                testrun.environment_id,
+                testrun.tests.values('metadata_id'),
+            )
+        else:
+            overall = status[None] if None in status else Status()
+            ProjectStatus.add_testrun(testrun, overall, results)
+            BuildSummary.add_testrun(testrun, overall, results)
+            TestResultHistory.add_testrun(testrun)
+            testrun.status_summarized = True
+
+        BuildComparison.invalidate(testrun.build_id)
+        BuildTestMatrix.record(testrun)
+
         testrun.status_recorded = True
         testrun.save()
 
@@ -449,7 +710,7 @@ class UpdateProjectStatus(object):
 
     @staticmethod
     def __call__(testrun):
-        projectstatus = ProjectStatus.create_or_update(testrun.build)
+        projectstatus = ProjectStatus.refresh(testrun.build)
 
         if projectstatus.finished:
             dispatch_callbacks_on_build_finished(testrun.build)
@@ -461,19 +722,98 @@ class UpdateBuildSummary(object):
 
     @staticmethod
     def __call__(testrun):
-        BuildSummary.create_or_update(testrun.build, testrun.environment)
+        BuildSummary.refresh(testrun.build, testrun.environment)
 
 
 class ProcessTestRun(object):
 
     @staticmethod
-    def __call__(testrun):
+    def __call__(testrun, tests=None, metrics=None):
         with transaction.atomic():
-            ParseTestRunData()(testrun)
+            ParseTestRunData()(testrun, tests=tests, metrics=metrics)
             PostProcessTestRun()(testrun)
             RecordTestRunStatus()(testrun)
 
 
+@celery.task(acks_late=True)
+def process_test_run(test_run_id, update_project_status=True):
+    """
+    Processes a test run received asynchronously (see ReceiveTestRun). The
+    outcome is recorded in its `processing_status`, and in case of failure,
+    the reason in `processing_error`.
+    """
+    # claim the test run, so that it is processed only once even if this
+    # task is delivered more than once
+    claimed_at = timezone.now()
+    claimed = TestRun.objects.filter(
+        pk=test_run_id,
+        processing_status=TestRun.QUEUED,
+    ).update(processing_status=TestRun.PROCESSING, processing_updated_at=claimed_at)
+    if not claimed:
+        logger.warning("TestRun with ID: %s not found or already processed" % test_run_id)
+        return
+
+    # requeue_stale_test_runs can hand the test run to another worker once
+    # this claim gets old, so only act on it while the claim is ours
+    testruns = TestRun.objects.filter(
+        pk=test_run_id,
+        processing_status=TestRun.PROCESSING,
+        processing_updated_at=claimed_at,
+    )
+    try:
+        with transaction.atomic():
+            # the lock is held until processing is done, which tells
+            # requeue_stale_test_runs that this worker is still alive
+            testrun = testruns.select_for_update().first()
+            if testrun is None:
+                logger.warning("TestRun with ID: %s was claimed by another worker" % test_run_id)
+                return
+            ValidateTestRun().stored(testrun)
+            ProcessTestRun()(testrun)
+
+            # before updating the project status, since a build is not
+            # finished while it has test runs being processed
+            testruns.update(processing_status=TestRun.PROCESSED)
+            testrun.processing_status = TestRun.PROCESSED
+    except Exception as e:
+        if not isinstance(e, exceptions.invalid_input):
+            logger.error("TestRun processing error: " + str(e) + "\n" + traceback.format_exc())
+        if not testruns.update(processing_status=TestRun.FAILED, processing_error=str(e)):
+            return
+        # a failed test run still counts as received (see Build.finished),
+        # so the build status has to be updated all the same
+        testrun = TestRun.objects.get(pk=test_run_id)
+
+    if update_project_status:
+        UpdateProjectStatus()(testrun)
+        UpdateBuildSummary()(testrun)
+
+
+@celery.task
+def requeue_stale_test_runs():
+    """
+    Queues again the test runs that have been queued or processing for
+    longer than SQUAD_TEST_RUN_PROCESSING_TIMEOUT, e.g. because the task
+    was lost or the worker processing it died. Test runs still locked by a
+    worker processing them are left alone, however long that takes.
+    Processing is done in a single transaction, so nothing from an
+    interrupted attempt is left.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        stale = TestRun.objects.select_for_update(skip_locked=True).filter(
+            processing_status__in=TestRun.PENDING,
+        ).filter(
+            Q(processing_updated_at__lt=now - timezone.timedelta(seconds=settings.SQUAD_TEST_RUN_PROCESSING_TIMEOUT)) | Q(processing_updated_at__isnull=True),
+        )
+        test_run_ids = list(stale.values_list('id', flat=True))
+        TestRun.objects.filter(id__in=test_run_ids).update(processing_status=TestRun.QUEUED, processing_updated_at=now)
+
+    for test_run_id in test_run_ids:
+        logger.warning("TestRun with ID: %s was pending for too long, queueing it again" % test_run_id)
+        process_test_run.delay(test_run_id)
+
+
 class ProcessAllTestRuns(object):
 
     @staticmethod
@@ -27,6 +27,10 @@ class InvalidMetricsData(Exception):
         return cls("metric value %r is not valid. only numbers or lists of numbers are accepted" % value)
 
 
+class InvalidLog(Exception):
+    pass
+
+
 class InvalidTestsDataJSON(Exception):
     pass
 
@@ -1,13 +1,20 @@
+import logging
+
+from django.conf import settings
 from django.utils import timezone
 from django.db import transaction
 
 from squad.celery import app as celery
-from squad.core.models import ProjectStatus, Build, DelayedReport
+from squad.core import patch_delivery
+from squad.core.models import ProjectStatus, Build, DelayedReport, PatchNotification
 from squad.core.notification import send_status_notification
 
 import requests
 
 
+logger = logging.getLogger()
+
+
 @celery.task
 def maybe_notify_project_status(status_id):
     """
@@ -82,22 +89,51 @@ def notification_timeout(status_id):
         projectstatus.save()
 
 
+def queue_patch_notification(build_id, event):
+    build = Build.objects.get(pk=build_id)
+    if build.patch_source:
+        PatchNotification.objects.create(build=build, event=event)
+        # wait a little, so that other notifications for the same change can
+        # be delivered together
+        deliver_patch_notifications.apply_async(countdown=settings.SQUAD_PATCH_NOTIFICATION_DELAY)
+
+
 @celery.task
 def notify_patch_build_created(build_id):
-    build = Build.objects.get(pk=build_id)
-    patch_source = build.patch_source
-    if patch_source:
-        plugin = patch_source.get_implementation()
-        plugin.notify_patch_build_created(build)
+    queue_patch_notification(build_id, PatchNotification.CREATED)
 
 
 @celery.task
 def notify_patch_build_finished(build_id):
-    build = Build.objects.get(pk=build_id)
-    patch_source = build.patch_source
-    if patch_source:
-        plugin = patch_source.get_implementation()
-        plugin.notify_patch_build_finished(build)
+    queue_patch_notification(build_id, PatchNotification.FINISHED)
+
+
+@celery.task
+def deliver_patch_notifications():
+    """
+    Delivers a batch of pending patch source notifications. See
+    squad.core.patch_delivery.
+    """
+    notifications = PatchNotification.claim(patch_delivery.BATCH_SIZE)
+    failed = patch_delivery.deliver(notifications)
+
+    retries = set()
+    for notification in failed:
+        delay = notification.postpone()
+        if delay is None:
+            logger.error('Giving up on notifying %s that build %s was %s' % (
+                notification.build.patch_source,
+                notification.build_id,
+                notification.event,
+            ))
+        else:
+            retries.add(delay)
+
+    for delay in retries:
+        deliver_patch_notifications.apply_async(countdown=delay)
+
+    if len(notifications) == patch_delivery.BATCH_SIZE:
+        deliver_patch_notifications.delay()
 
 
 @celery.task
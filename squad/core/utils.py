@@ -11,7 +11,7 @@ from cryptography.fernet import Fernet
 
 from django.template.defaultfilters import safe, escape
 from django.core.exceptions import ValidationError
-from django.core.files.base import ContentFile
+from django.core.files.base import ContentFile, File
 from django.conf import settings
 from django.utils.encoding import force_str as force_text
 
@@ -134,6 +134,21 @@ def split_list(_list, chunk_size=1):
     return chunks
 
 
+def split_iterable(iterable, chunk_size=1):
+    """
+    Like split_list, but consumes `iterable` lazily, yielding one chunk at a
+    time.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
 def _log_entry(request, object, message, flag):
     from django.contrib.auth.models import AnonymousUser
     from django.contrib.contenttypes.models import ContentType
@@ -169,8 +184,34 @@ def log_deletion(request, object, message):
 
 
 def storage_save(obj, storage_field, filename, content):
+    """
+    Saves `content` (str, bytes, or a File, e.g. an upload, which is
+    copied in chunks) into `storage_field` of `obj`.
+    """
+    filename = '%s/%s/%s' % (obj.__class__.__name__.lower(), obj.pk, filename)
+    if isinstance(content, File):
+        storage_field.save(filename, content)
+        return
+
     content_bytes = content or ''
     if type(content_bytes) is str:
         content_bytes = content_bytes.encode()
-    filename = '%s/%s/%s' % (obj.__class__.__name__.lower(), obj.pk, filename)
     storage_field.save(filename, ContentFile(content_bytes))
+
+
+class NulStrippingFile(File):
+    """
+    Wraps a file (e.g. an upload) so that NUL bytes are removed as it is
+    read, without loading the whole file in memory.
+    """
+
+    def __init__(self, file):
+        super(NulStrippingFile, self).__init__(file, name=getattr(file, 'name', None))
+
+    def read(self, size=-1):
+        while True:
+            data = self.file.read(size)
+            stripped = data.replace(b'\x00', b'')
+            # a chunk made only of NULs must not look like the end of file
+            if stripped or not data or size is None or size < 0:
+                return stripped
@@ -6,7 +6,7 @@ from django.db.models import Q, Prefetch
 from django.http import HttpResponseNotFound
 
 from squad.core.models import Project, Group, Build
-from squad.core.comparison import TestComparison, MetricComparison
+from squad.core.comparison import TestComparison, MetricComparison, PaginatedTestComparison
 from squad.frontend.utils import alphanum_sort
 
 
@@ -22,13 +22,16 @@ def __get_comparison_class(comparison_type):
         return TestComparison
 
 
-def __paginate(results, request):
+def __get_page(request):
     try:
-        page = int(request.GET.get('page', '1'))
+        return int(request.GET.get('page', '1'))
     except ValueError:
-        page = 1
+        return 1
+
+
+def __paginate(results, request):
     paginator = Paginator(tuple(results.items()), 50)
-    return paginator.page(page)
+    return paginator.page(__get_page(request))
 
 
 def __get_transitions(request):
@@ -76,13 +79,17 @@ def compare_projects(request):
         if len(filters) > 1:
             build_filters = reduce(lambda x, y: x | y, filters)
             builds = Build.objects.filter(build_filters)
-            comparison_class = __get_comparison_class(comparison_type)
-            comparison = comparison_class.compare_builds(*builds)
-
-            if comparison_type == 'test' and len(transitions):
-                comparison.apply_transitions([t for t, checked in transitions.items() if checked])
 
-            comparison.results = __paginate(comparison.results, request)
+            if comparison_type == 'test':
+                comparison = PaginatedTestComparison.compare_builds(
+                    *builds,
+                    transitions=[t for t, checked in transitions.items() if checked],
+                    page=__get_page(request),
+                )
+            else:
+                comparison_class = __get_comparison_class(comparison_type)
+                comparison = comparison_class.compare_builds(*builds)
+                comparison.results = __paginate(comparison.results, request)
 
     context = {
         'group': group,
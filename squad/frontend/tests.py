@@ -2,13 +2,13 @@ import json
 
 from collections import defaultdict
 
+from django.db.models import Count, Q, Window
 from django.shortcuts import render, get_object_or_404
 from django.http import Http404
 
 from squad.http import auth
-from squad.core.models import Build, Test, Suite, SuiteMetadata, Environment
+from squad.core.models import Build, BuildTestMatrix, Suite, SuiteMetadata, Environment
 from squad.core.history import TestHistory
-from squad.core.queries import test_confidence
 from squad.frontend.views import get_build
 
 
@@ -54,11 +54,11 @@ class TestResultTable(list):
         self.paginator = self
         self.paginator.num_pages = 0
         self.number = 0
-        self.all_tests = []
+        self.cells = BuildTestMatrix.objects.none()
 
-    def __get_all_tests__(self, build, search, env=None, suite=None):
+    def __get_cells__(self, build, search, env=None, suite=None):
 
-        queryset = Test.objects.filter(build=build)
+        queryset = BuildTestMatrix.objects.filter(build=build)
         if search:
             queryset = queryset.filter(metadata__name__icontains=search)
 
@@ -74,53 +74,65 @@ class TestResultTable(list):
                 self.filters['suite'] = suite_.first()
                 queryset = queryset.filter(suite=self.filters['suite'])
 
-        self.all_tests = queryset.only('result', 'has_known_issues', 'metadata_id').order_by()
+        self.cells = queryset.order_by()
 
     # count how many unique tests are represented in the given build, and sets
     # pagination data
-    def __count_pages__(self, per_page):
-        distinct_tests = set([test.metadata_id for test in self.all_tests])
-        count = len(distinct_tests)
+    def __count_pages__(self, count, per_page):
         self.num_pages = count // per_page
         if count % per_page > 0:
             self.num_pages += 1
 
-    def __get_page_filter__(self, page, per_page):
+    def __get_page_filter__(self, build, page, per_page):
         """
         Query to obtain one page os test results. It is used to know which tests
         should be in the page. It's ordered so that the tests with more failures
         come first, then tests with less failures, then tests with more skips.
+        The same query also counts the tests, for the pagination.
 
         After the tests in the page have been determined here, a new query is
         needed to obtain the data about per-environment test results.
         """
         offset = (page - 1) * per_page
 
-        stats = defaultdict(lambda: {'pass': 0, 'fail': 0, 'xfail': 0, 'skip': 0})
-        for test in self.all_tests:
-            stats[test.metadata_id][test.status] += 1
-
-        def keyfunc(item):
-            metadata_id = item[0]
-            statuses = item[1]
-            return tuple((-statuses[k] for k in ['fail', 'xfail', 'skip', 'pass'])) + (metadata_id,)
+        statuses = ['fail', 'xfail', 'skip', 'pass']
+        counts = {'count_' + s: Count('id', filter=Q(status=s)) for s in statuses}
+        ordering = ['-count_' + s for s in statuses] + ['metadata_id']
+
+        queryset = self.cells.values('metadata_id').annotate(
+            tests_count=Window(Count('metadata_id')),
+            **counts,
+        ).order_by(*ordering)[offset:offset + per_page]
+
+        tests_in_page = list(queryset)
+        if not tests_in_page and not BuildTestMatrix.objects.filter(build=build).exists():
+            # first visit to a build whose cells were not computed yet
+            BuildTestMatrix.refresh(build.id)
+            tests_in_page = list(queryset.all())
+
+        if tests_in_page:
+            count = tests_in_page[0]['tests_count']
+        elif offset > 0:
+            count = self.cells.values('metadata_id').distinct().count()
+        else:
+            count = 0
+        self.__count_pages__(count, per_page)
 
-        ordered = sorted(stats.items(), key=keyfunc)
-        tests_in_page = ordered[offset:offset + per_page]
-        metadata_ids = [t[0] for t in tests_in_page]
-        return metadata_ids
+        return [t['metadata_id'] for t in tests_in_page]
 
     @classmethod
     def get(cls, build, page, search, per_page=50, env=None, suite=None):
         table = cls()
-        table.__get_all_tests__(build, search, env=env, suite=suite)
+        table.__get_cells__(build, search, env=env, suite=suite)
         table.number = page
-        table.__count_pages__(per_page)
+        metadata_ids = table.__get_page_filter__(build, page, per_page)
 
         if table.filters['environment']:
             table.environments = {table.filters['environment']}
         else:
-            table.environments = set([t.environment for t in build.test_runs.prefetch_related('environment').all()])
+            table.environments = set(Environment.objects.filter(test_runs__build=build).distinct())
+        cells = table.cells.filter(metadata_id__in=metadata_ids).values_list('metadata_id', 'environment_id', 'status', 'confidence')
+        statuses = {(m, e): [status, confidence] for m, e, status, confidence in cells}
 
         queryset = build.tests
         if table.filters['environment']:
@@ -130,41 +142,35 @@ class TestResultTable(list):
             queryset = queryset.filter(suite=table.filters['suite'])
 
         tests = queryset.filter(
-            metadata_id__in=table.__get_page_filter__(page, per_page),
+            metadata_id__in=metadata_ids,
         ).prefetch_related(
             'suite__metadata',
             'metadata',
-        )
+        ).order_by('id')
 
-        memo = defaultdict(lambda: defaultdict(list))
+        memo = defaultdict(dict)
         for test in tests:
-            memo[test.full_name][test.environment_id].append(test)
-
-        # handle duplicates
-        for full_name in memo.keys():
-            env_ids = memo[full_name].keys()
-            for env_id in env_ids:
+            results = memo[test.full_name]
 
-                test = memo[full_name][env_id][0]
+            # the status of duplicates is resolved in the matrix; error
+            # information comes from the first one
+            if test.environment_id in results:
+                continue
 
-                if len(memo[full_name][env_id]) == 1:
-                    memo[full_name][env_id] = [test.status, None]
-                else:
-                    duplicates = memo[full_name][env_id]
-                    memo[full_name][env_id] = list(test_confidence(None, list_of_duplicates=duplicates))
+            status = statuses.get((test.metadata_id, test.environment_id), [test.status, None])
 
-                error_info = {
-                    "test_description": test.metadata.description if test.metadata else '',
-                    "suite_instructions": test.suite.metadata.instructions_to_reproduce if test.suite.metadata else '',
-                    "test_instructions": test.metadata.instructions_to_reproduce if test.metadata else '',
-                    "test_log": test.log or '',
-                }
-                info = json.dumps(error_info) if any(error_info.values()) else None
+            error_info = {
+                "test_description": test.metadata.description if test.metadata else '',
+                "suite_instructions": test.suite.metadata.instructions_to_reproduce if test.suite.metadata else '',
+                "test_instructions": test.metadata.instructions_to_reproduce if test.metadata else '',
+                "test_log": test.log or '',
+            }
+            info = json.dumps(error_info) if any(error_info.values()) else None
 
-                memo[full_name][env_id].append(info)
+            results[test.environment_id] = status + [info]
 
-            if 'test_metadata' not in memo[full_name].keys():
-                memo[full_name]['test_metadata'] = (test.test_run_id, test.suite, test.name)
+            if 'test_metadata' not in results:
+                results['test_metadata'] = (test.test_run_id, test.suite, test.name)
 
         for test_full_name, results in memo.items():
             test_result = TestResult(test_full_name)
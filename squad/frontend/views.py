@@ -11,7 +11,7 @@ from django.utils import timezone
 from dateutil.relativedelta import relativedelta
 
 from squad.ci.models import TestJob
-from squad.core.models import Group, Metric, ProjectStatus, Status, MetricThreshold, KnownIssue, Test
+from squad.core.models import Group, Metric, ProjectStatus, ProjectStatusChange, Status, MetricThreshold, KnownIssue, Test
 from squad.core.models import Build, Subscription, TestRun, SuiteMetadata, UserPreferences
 from squad.core.queries import get_metric_data, test_confidence
 from squad.frontend.queries import get_metrics_list
@@ -171,7 +171,7 @@ def group_home(request, group_slug):
 
 
 def __get_builds_with_status__(project, limit=None):
-    builds = project.builds.prefetch_related('status').order_by('-datetime')
+    builds = project.builds.prefetch_related('status', ProjectStatusChange.prefetch('status__changes')).order_by('-datetime')
     if limit:
         return builds[:limit]
     return builds
@@ -1,3 +1,5 @@
+import functools
+
 from django.core.exceptions import PermissionDenied
 from django.http import HttpResponseForbidden, JsonResponse
 from django.shortcuts import get_object_or_404
@@ -58,6 +60,7 @@ def auth_user_from_request(request, user):
 
 
 def auth(func, mode=AuthMode.READ, is_json=False):
+    @functools.wraps(func)
     def auth_wrapper(*args, **kwargs):
         request = args[0]
         request.is_json = is_json
@@ -104,10 +107,7 @@ def auth(func, mode=AuthMode.READ, is_json=False):
 
 
 def read_file_upload(stream):
-    data = bytes()
-    for chunk in stream.chunks():
-        data = data + chunk
-    return data
+    return b''.join(stream.chunks())
 
 
 def response_forbidden(message=None, is_json=False):
@@ -10,6 +10,7 @@ from django.conf import settings
 
 
 from squad.core.models import ProjectStatus
+from squad.core.patch_delivery import get_session, ssh_options
 from squad.core.plugins import Plugin as BasePlugin
 from squad.frontend.templatetags.squad import build_url as __build_url__
 
@@ -59,7 +60,8 @@ class Plugin(BasePlugin):
             change_id=change_id,
             patchset=patchset,
         )
-        result = requests.post(url, auth=auth, json=payload)
+        session = get_session(patch_source)
+        result = session.post(url, auth=auth, json=payload, timeout=settings.SQUAD_PATCH_SOURCE_TIMEOUT)
         if result.status_code != 200:
             logger.error('Gerrit post failed, %s returned %d' % (parsed_url.netloc, result.status_code))
             return False
@@ -84,11 +86,12 @@ class Plugin(BasePlugin):
 
         ssh = ['ssh']
         ssh += DEFAULT_SSH_OPTIONS
+        ssh += ssh_options()
         ssh += ['-p', DEFAULT_SSH_PORT, '%s@%s' % (patch_source.username, parsed_url.netloc)]
         ssh += [cmd]
         try:
-            result = subprocess.run(ssh, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        except subprocess.CalledProcessError as e:
+            result = subprocess.run(ssh, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=settings.SQUAD_PATCH_SOURCE_TIMEOUT)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
             logger.error('Failed do login to %s: %s' % (parsed_url.netloc, str(e)))
             return False
 
@@ -101,7 +104,8 @@ class Plugin(BasePlugin):
         regex = r'.+%s.+' % PATCH_SET_DIVIDER_REGEX
         if re.match(regex, build.patch_id) is None:
             logger.warning('patch_id "%s" for build "%s" failed to match "%s"' % (build.patch_id, build.id, regex))
-            return False
+            # not worth retrying
+            return None
 
         if build.patch_source.url.startswith('ssh'):
             return Plugin.__gerrit_ssh__(build, payload)
@@ -133,13 +137,12 @@ class Plugin(BasePlugin):
 
         return labels
 
-    def notify_patch_build_created(self, build):
-        data = {
+    def __created_payload__(self, build):
+        return {
             'message': Plugin.__message__(build),
         }
-        return self.__gerrit_request__(build, data)
 
-    def notify_patch_build_finished(self, build):
+    def __finished_payload__(self, build):
         try:
             if build.status.tests_fail == 0:
                 message = "All tests passed"
@@ -150,13 +153,43 @@ class Plugin(BasePlugin):
         except ProjectStatus.DoesNotExist:
             logger.error('ProjectStatus for build %s/%s does not exist' % (build.project.slug, build.version))
             message = "An error occurred"
+            success = False
 
-        data = {
+        return {
             'message': Plugin.__message__(build, finished=True, extra_message=message),
             'labels': self.__get_labels__(build, success=success)
         }
 
-        return self.__gerrit_request__(build, data)
+    def notify_patch_build_created(self, build):
+        return self.__gerrit_request__(build, self.__created_payload__(build))
+
+    def notify_patch_build_finished(self, build):
+        return self.__gerrit_request__(build, self.__finished_payload__(build))
+
+    def notify_patch_builds(self, updates):
+        """
+        Posts a single review with the messages of all updates. When
+        different builds vote on the same label, the lowest vote wins.
+        """
+        messages = []
+        labels = None
+        for build, event in updates:
+            if event == 'finished':
+                payload = self.__finished_payload__(build)
+            else:
+                payload = self.__created_payload__(build)
+            messages.append(payload['message'])
+
+            if 'labels' in payload:
+                labels = labels or {}
+                for label, value in payload['labels'].items():
+                    if label not in labels or int(value) < int(labels[label]):
+                        labels[label] = value
+
+        data = {'message': '\n\n'.join(messages)}
+        if labels is not None:
+            data['labels'] = labels
+        return self.__gerrit_request__(updates[-1][0], data)
 
     def get_url(self, build):
         if build.patch_source and build.patch_id:
@@ -169,7 +202,8 @@ class Plugin(BasePlugin):
                     host=parsed_url.netloc,
                     change_id=change_id,
                 )
-                result = requests.get(url, auth=auth)
+                session = get_session(build.patch_source)
+                result = session.get(url, auth=auth, timeout=settings.SQUAD_PATCH_SOURCE_TIMEOUT)
                 if result.status_code == 200:
                     # 4 leading characters from response has to be removed
                     # to get valid JSON
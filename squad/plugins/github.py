@@ -1,12 +1,16 @@
+import logging
 import re
-import requests
 from django.conf import settings
 from squad.core.models import ProjectStatus
+from squad.core.patch_delivery import get_session
 from squad.core.plugins import Plugin as BasePlugin
 from squad.frontend.templatetags.squad import project_url
 from urllib.parse import urljoin
 
 
+logger = logging.getLogger()
+
+
 def build_url(build):
     return settings.BASE_URL + project_url(build)
 
@@ -28,7 +32,8 @@ class Plugin(BasePlugin):
                 repository=repository,
                 commit=commit)
         )
-        return requests.post(url, headers=headers, json=payload)
+        session = get_session(build.patch_source)
+        return session.post(url, headers=headers, json=payload, timeout=settings.SQUAD_PATCH_SOURCE_TIMEOUT)
 
     def notify_patch_build_created(self, build):
         payload = {
@@ -61,6 +66,23 @@ class Plugin(BasePlugin):
         endpoint = '/repos/{owner}/{repository}/statuses/{commit}'
         return Plugin.__github_post__(build, endpoint, payload)
 
+    def notify_patch_builds(self, updates):
+        """
+        All builds of a commit report under the same status context, so
+        only the last update needs to be posted.
+        """
+        build, event = updates[-1]
+        if event == 'finished':
+            response = self.notify_patch_build_finished(build)
+        else:
+            response = self.notify_patch_build_created(build)
+
+        if response.status_code == 429 or response.status_code >= 500:
+            return False
+        if not response.ok:
+            logger.error('GitHub status update for build %s failed with %d' % (build.id, response.status_code))
+        return True
+
     def get_url(self, build):
         api_url = build.patch_source.url
         owner, repository, commit = re.split(r'[:/]', build.patch_id)
@@ -0,0 +1,224 @@
+"""
+Opt-in SQL profiling of views and Celery tasks.
+
+When SQUAD_PROFILING is enabled, every request handled by squad.frontend and
+squad.api views, and every task from squad.core.tasks and squad.ci.tasks, is
+profiled: the number of queries, the total time spent in the database, the
+slowest statements and the statements that were repeated with different
+parameters (usually a N+1 problem) are logged as a JSON object to the
+`squad.profiling` logger, and aggregated into counters that are exposed in
+the Prometheus text format at /_/metrics (see squad.urls).
+
+When profiling is disabled, the middleware is not installed and tasks only
+pay for checking a setting.
+"""
+
+import heapq
+import json
+import logging
+import re
+import threading
+import time
+
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger('squad.profiling')
+
+
+PROFILED_VIEWS = ('squad.frontend', 'squad.api')
+PROFILED_TASKS = ('squad.core.tasks', 'squad.ci.tasks')
+
+
+fingerprint_in_list = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+fingerprint_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+fingerprint_whitespace = re.compile(r'\s+')
+
+
+def fingerprint(sql):
+    """
+    Returns `sql` without its literal values, so that the same statement run
+    with different parameters has the same fingerprint.
+    """
+    sql = fingerprint_literals.sub('?', sql)
+    sql = fingerprint_in_list.sub('(...)', sql)
+    return fingerprint_whitespace.sub(' ', sql).strip()
+
+
+class QueryProfile(object):
+    """
+    Database execute wrapper (see Django's connection.execute_wrapper) that
+    records the queries executed while it is installed.
+    """
+
+    def __init__(self, kind, name=None):
+        self.kind = kind
+        self.name = name
+        self.queries = 0
+        self.db_time = 0.0
+        self.duration = 0.0
+        self.slowest = []
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.db_time += elapsed
+            self.fingerprints[fingerprint(sql)] += 1
+
+            top = settings.SQUAD_PROFILING_TOP_QUERIES
+            if len(self.slowest) < top:
+                heapq.heappush(self.slowest, (elapsed, self.queries, sql))
+            elif top and elapsed > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (elapsed, self.queries, sql))
+
+    @contextmanager
+    def active(self):
+        """
+        Records the queries executed in all database connections, from the
+        current thread, while the context is active.
+        """
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            try:
+                yield self
+            finally:
+                self.duration = time.perf_counter() - start
+
+    def duplicates(self):
+        threshold = settings.SQUAD_PROFILING_DUPLICATES
+        return [(sql, count) for sql, count in self.fingerprints.most_common() if count >= threshold]
+
+    def report(self):
+        return {
+            'kind': self.kind,
+            'name': self.name,
+            'duration': round(self.duration, 6),
+            'queries': self.queries,
+            'db_time': round(self.db_time, 6),
+            'slowest': [
+                {'time': round(elapsed, 6), 'sql': sql}
+                for elapsed, _, sql in sorted(self.slowest, reverse=True)
+            ],
+            'duplicates': [
+                {'count': count, 'fingerprint': sql}
+                for sql, count in self.duplicates()
+            ],
+        }
+
+
+class Metrics(object):
+    """
+    Counters aggregated from all the profiles of this process.
+    """
+
+    COUNTERS = (
+        ('squad_profiled_total', 'Number of profiled requests/tasks'),
+        ('squad_profiled_duration_seconds_total', 'Time spent in profiled requests/tasks'),
+        ('squad_db_queries_total', 'Number of database queries'),
+        ('squad_db_time_seconds_total', 'Time spent in database queries'),
+        ('squad_db_duplicate_queries_total', 'Number of database queries repeated with different parameters'),
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.collectors = []
+        self.reset()
+
+    def collector(self, function):
+        """
+        Registers `function` to export other metrics of this process along
+        with the counters above. It must return a list of (metric, type,
+        description, value) tuples, where type is "counter" or "gauge". Can
+        be used as a decorator.
+        """
+        self.collectors.append(function)
+        return function
+
+    def reset(self):
+        self.counters = defaultdict(lambda: [0, 0.0, 0, 0.0, 0])
+
+    def add(self, profile):
+        duplicates = sum(count for _, count in profile.duplicates())
+        with self.lock:
+            counters = self.counters[(profile.kind, profile.name)]
+            counters[0] += 1
+            counters[1] += profile.duration
+            counters[2] += profile.queries
+            counters[3] += profile.db_time
+            counters[4] += duplicates
+
+    def export(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+        lines = []
+        for index, (metric, description) in enumerate(self.COUNTERS):
+            lines.append('# HELP %s %s' % (metric, description))
+            lines.append('# TYPE %s counter' % metric)
+            for (kind, name), values in counters:
+                lines.append('%s{kind="%s",name="%s"} %s' % (metric, kind, escape_label(name), values[index]))
+        for collector in self.collectors:
+            for metric, metric_type, description, value in collector():
+                lines.append('# HELP %s %s' % (metric, description))
+                lines.append('# TYPE %s %s' % (metric, metric_type))
+                lines.append('%s %s' % (metric, value))
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = Metrics()
+
+
+def record(profile):
+    metrics.add(profile)
+    logger.info(json.dumps(profile.report()))
+
+
+@contextmanager
+def profile_task(task):
+    """
+    Profiles the execution of the given Celery task, if profiling is enabled
+    and the task is one of PROFILED_TASKS.
+    """
+    if not settings.SQUAD_PROFILING or not task.name.startswith(PROFILED_TASKS):
+        yield
+        return
+
+    profile = QueryProfile('task', task.name)
+    with profile.active():
+        yield
+    record(profile)
+
+
+class ProfilingMiddleware(object):
+    """
+    Profiles the requests handled by PROFILED_VIEWS. Only installed when
+    SQUAD_PROFILING is enabled.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = QueryProfile('request')
+        with profile.active():
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        if match is not None and match.func.__module__.startswith(PROFILED_VIEWS):
+            profile.name = match.view_name
+            record(profile)
+        return response
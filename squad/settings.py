@@ -78,6 +78,29 @@ django_allauth_middleware = None
 if find_spec('allauth'):
     django_allauth_middleware = 'allauth.account.middleware.AccountMiddleware'
 
+# SQL profiling of views and Celery tasks, see squad/profiling.py
+SQUAD_PROFILING = os.getenv('SQUAD_PROFILING', 'false').lower() in ['1', 'true', 'yes']
+SQUAD_PROFILING_TOP_QUERIES = int(os.getenv('SQUAD_PROFILING_TOP_QUERIES', 5))
+SQUAD_PROFILING_DUPLICATES = int(os.getenv('SQUAD_PROFILING_DUPLICATES', 5))
+profiling_middleware = None
+if SQUAD_PROFILING:
+    profiling_middleware = 'squad.profiling.ProfilingMiddleware'
+
+# Delivery of patch source notifications, see squad/core/patch_delivery.py
+SQUAD_PATCH_SOURCE_TIMEOUT = int(os.getenv('SQUAD_PATCH_SOURCE_TIMEOUT', 30))
+SQUAD_PATCH_SOURCE_CONCURRENCY = int(os.getenv('SQUAD_PATCH_SOURCE_CONCURRENCY', 4))
+SQUAD_PATCH_NOTIFICATION_DELAY = int(os.getenv('SQUAD_PATCH_NOTIFICATION_DELAY', 10))
+SQUAD_PATCH_NOTIFICATION_RETRIES = int(os.getenv('SQUAD_PATCH_NOTIFICATION_RETRIES', 5))
+
+# CI backends whose fetches take longer than this (in seconds) are polled less
+# aggressively, see Backend.fetch_backoff
+SQUAD_CI_SLOW_FETCH = int(os.getenv('SQUAD_CI_SLOW_FETCH', 60))
+
+# test runs submitted asynchronously that are still queued or processing
+# after this many seconds are queued again, see
+# squad.core.tasks.requeue_stale_test_runs
+SQUAD_TEST_RUN_PROCESSING_TIMEOUT = int(os.getenv('SQUAD_TEST_RUN_PROCESSING_TIMEOUT', 3600))
+
 
 __apps__ = [
     'django.contrib.admin',
@@ -133,6 +156,7 @@ SITE_ID = 1
 INSTALLED_APPS = [app for app in __apps__ if app]
 
 __middlewares__ = [
+    profiling_middleware,  # OPTIONAL
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -359,7 +383,17 @@ CELERY_BEAT_SCHEDULE = {
     'report_cleanup': {
         'task': 'squad.core.tasks.remove_delayed_reports',
         'schedule': crontab(hour='7', minute=21),
-    }
+    },
+    'requeue-stale-test-runs': {
+        'task': 'squad.core.tasks.requeue_stale_test_runs',
+        'schedule': crontab(minute='*/10'),
+    },
+    # picks up the patch notifications whose delivery task was lost, and
+    # the ones claimed by a worker that died (see PatchNotification.LEASE)
+    'deliver-patch-notifications': {
+        'task': 'squad.core.tasks.notification.deliver_patch_notifications',
+        'schedule': crontab(minute='*/10'),
+    },
 }
 
 # Explicitly declares default queue name
@@ -367,8 +401,10 @@ CELERY_TASK_DEFAULT_QUEUE = 'celery'
 CELERY_TASK_ROUTES = {
     'squad.core.tasks.prepare_report': {'queue': 'core_reporting'},
     'squad.core.tasks.postprocess_test_run': {'queue': 'core_postprocess'},
+    'squad.core.tasks.process_test_run': {'queue': 'core_submission'},
     'squad.core.tasks.cleanup_old_builds': {'queue': 'core_quick'},
     'squad.core.tasks.remove_delayed_reports': {'queue': 'core_quick'},
+    'squad.core.tasks.requeue_stale_test_runs': {'queue': 'core_quick'},
     'squad.core.tasks.cleanup_build': {'queue': 'core_quick'},
     'squad.core.tasks.update_build_patch_url': {'queue': 'core_quick'},
     'squad.core.tasks.notification.*': {'queue': 'core_notification'},
@@ -393,7 +429,7 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly'
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
+    'DEFAULT_PAGINATION_CLASS': 'squad.api.utils.KeysetPagination',
     'DEFAULT_FILTER_BACKENDS': (
         'rest_framework.filters.OrderingFilter',
         'rest_framework.filters.SearchFilter',
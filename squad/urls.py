@@ -18,10 +18,13 @@ from django.urls import re_path as url
 from django.conf import settings
 from django.shortcuts import render
 from django.contrib import admin
-from django.http import HttpResponseNotFound, HttpResponseForbidden
+from django.http import HttpResponse, HttpResponseNotFound, HttpResponseForbidden
 
 import django.contrib.auth.views as auth
 
+from squad import profiling
+from squad.http import auth_user_from_request
+
 
 import json
 
@@ -54,6 +57,21 @@ def page_not_found(request, exception, template_name='404.jinja2'):
     )
 
 
+def profiling_metrics(request):
+    """
+    Prometheus metrics for the requests and tasks profiled by this process
+    (see squad.profiling). Only available to staff users.
+    """
+    if not settings.SQUAD_PROFILING:
+        return HttpResponseNotFound()
+
+    user = auth_user_from_request(request, request.user)
+    if not (user and user.is_staff):
+        return HttpResponseForbidden()
+
+    return HttpResponse(profiling.metrics.export(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 handler403 = 'squad.urls.permission_denied'
 handler404 = 'squad.urls.page_not_found'
 
@@ -69,7 +87,6 @@ except ImportError:
 if 'health_check' in settings.INSTALLED_APPS:
     try:
         from health_check.views import MainView as MainHealthCheckView
-        from squad.http import auth_user_from_request
 
         def health_check_view(request):
             user = auth_user_from_request(request, request.user)
@@ -82,6 +99,7 @@ if 'health_check' in settings.INSTALLED_APPS:
         pass
 
 urlpatterns = extra_urls + [
+    url(r'^_/metrics$', profiling_metrics, name='profiling_metrics'),
     url(r'^admin/', admin.site.urls),
     url(r'^api/', include('squad.api.urls')),
     url(r'^login/', auth.LoginView.as_view(template_name='squad/login.jinja2')),
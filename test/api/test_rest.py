@@ -137,6 +137,9 @@ class RestApiTest(APITestCase):
                     testrun.tests.create(suite=suite, result=r, metadata=metadata, build=testrun.build, environment=testrun.environment)
         testrun.tests.create(suite=suite, result=None, metadata=metadata, build=testrun.build, environment=testrun.environment)
         testrun.tests.create(suite=suite, result=False, has_known_issues=True, metadata=metadata, build=testrun.build, environment=testrun.environment)
+        for testruns in testrun_sets:
+            for testrun in testruns:
+                models.TestResultHistory.add_testrun(testrun)
 
         metric_suite = 'mymetricsuite'
         suite, _ = self.project.suites.get_or_create(slug=metric_suite)
@@ -415,6 +418,33 @@ class RestApiTest(APITestCase):
         data = self.hit('/api/builds/')
         self.assertEqual(7, len(data['results']))
 
+    def test_builds_cursor_pagination(self):
+        data = self.hit('/api/builds/?pagination=cursor&limit=3')
+        self.assertNotIn('count', data)
+        self.assertIsNone(data['previous'])
+
+        builds = [b['id'] for b in data['results']]
+        while data['next']:
+            data = self.hit(data['next'].replace('http://testserver', ''))
+            builds += [b['id'] for b in data['results']]
+
+        expected = list(models.Build.objects.order_by('-datetime', '-id').values_list('id', flat=True))
+        self.assertEqual(expected, builds)
+
+    def test_builds_offset_pagination_is_still_the_default(self):
+        data = self.hit('/api/builds/?limit=3&offset=3')
+        self.assertEqual(7, data['count'])
+        self.assertEqual(3, len(data['results']))
+
+    def test_projects_cursor_pagination(self):
+        data = self.hit('/api/projects/?pagination=cursor&limit=2')
+        self.assertNotIn('count', data)
+        first = [p['id'] for p in data['results']]
+        data = self.hit(data['next'].replace('http://testserver', ''))
+        second = [p['id'] for p in data['results']]
+        self.assertEqual(3, len(set(first + second)))
+        self.assertIsNone(data['next'])
+
     def test_builds_id_filter(self):
         last = self.project.builds.last()
         data = self.hit(f'/api/builds/?id__lt={last.id}')
@@ -747,6 +777,39 @@ class RestApiTest(APITestCase):
         data = self.hit('/api/builds/%d/tests/?environment__slug=myenv&suite__slug=foooooooosuitedoestexist' % self.build.id)
         self.assertEqual(0, len(data['results']))
 
+    def test_build_tests_ndjson(self):
+        response = self.client.get('/api/builds/%d/tests.ndjson/' % self.build.id)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/x-ndjson; charset=utf-8', response['Content-Type'])
+
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        tests = [json.loads(line) for line in lines]
+        self.assertEqual(self.build.tests.count(), len(tests))
+        self.assertEqual(sorted(t['id'] for t in tests), [t['id'] for t in tests])
+
+        test = self.build.tests.get(metadata__suite='foo', metadata__name='test1', environment=self.environment)
+        self.assertIn({
+            'id': test.id,
+            'test_run': self.testrun.id,
+            'environment': 'myenv',
+            'suite': 'foo',
+            'name': 'foo/test1',
+            'short_name': 'test1',
+            'status': 'pass',
+            'result': True,
+            'has_known_issues': None,
+        }, tests)
+
+    def test_build_tests_csv(self):
+        response = self.client.get('/api/builds/%d/tests.csv' % self.build.id)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/csv; charset=utf-8', response['Content-Type'])
+
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual('id,test_run,environment,suite,name,short_name,status,result,has_known_issues', lines[0])
+        self.assertEqual(self.build.tests.count(), len(lines) - 1)
+        self.assertIn(',myenv,bar,bar/test2,test2,fail,False,', '\n'.join(lines))
+
     def test_build_failures_with_confidence(self):
         data = self.hit('/api/builds/%d/failures_with_confidence/' % self.build3.id)
 
@@ -784,6 +847,15 @@ class RestApiTest(APITestCase):
         self.assertEqual(failure['name'], 'foo/test2')
         self.assertEqual(failure['confidence'], {'count': 2, 'passes': 2, 'score': 100.0})
 
+    def test_build_failures_with_confidence_with_cursor_pagination(self):
+        data = self.hit('/api/builds/%d/failures_with_confidence/?pagination=cursor&limit=10' % self.build3.id)
+        self.assertNotIn('count', data)
+        self.assertEqual(len(data['results']), 10)
+
+        data = self.hit(data['next'].replace('http://testserver', ''))
+        self.assertEqual(len(data['results']), 8)
+        self.assertIsNone(data['next'])
+
     def test_build_failures_with_confidence_releases_only(self):
         data = self.hit('/api/builds/%d/failures_with_confidence/?releases_only=1' % self.build2.id)
 
@@ -1,16 +1,19 @@
 import os
-from io import StringIO
+from io import BytesIO, StringIO
 
 
 from django.contrib.auth.models import User
+from django.core.files.uploadedfile import UploadedFile
 from django.contrib.admin.models import LogEntry, ADDITION
 from django.test import TestCase
 from django.test import Client
 from django.utils.encoding import force_str as force_text
 from test.api import APIClient
+from test.mock import patch
 
 
 from squad.core import models
+from squad.core.tasks import ReceiveTestRun
 from rest_framework.authtoken.models import Token
 
 
@@ -188,6 +191,62 @@ class CreateTestRunApiTest(ApiTest):
         self.assertIsNotNone(models.TestRun.objects.last().log_file)
         self.assertIsNotNone(models.TestRun.objects.last().log_file_storage)
 
+    def test_receives_log_file_strips_nul_characters(self):
+        log = BytesIO(b'first line\x00\n' + b'\x00' * 100000 + 'second line ✓\n'.encode())
+        log.name = 'test_run.log'
+        response = self.client.post('/api/submit/mygroup/myproject/1.0.7/myenvironment', {'log': log})
+        self.assertEqual(201, response.status_code)
+        self.assertEqual('first line\nsecond line ✓\n', models.TestRun.objects.last().log_file)
+
+    def test_rejects_log_file_with_invalid_utf8(self):
+        log = BytesIO(b'first line\n\xff\xfe\n')
+        log.name = 'test_run.log'
+        response = self.client.post('/api/submit/mygroup/myproject/1.0.7/myenvironment', {'log': log})
+        self.assertEqual(400, response.status_code)
+        self.assertIn('log is not valid UTF-8', response.content.decode())
+        self.assertFalse(models.TestRun.objects.exists())
+
+    def test_tests_file_passed_as_upload(self):
+        tests = BytesIO(b'{"foo/bar": "pass"}')
+        tests.name = 'tests.json'
+        with patch.object(ReceiveTestRun, '__call__', autospec=True, side_effect=ReceiveTestRun.__call__) as receive:
+            response = self.client.post('/api/submit/mygroup/myproject/1.0.7/myenvironment', {'tests': tests})
+        self.assertEqual(201, response.status_code)
+        self.assertIsInstance(receive.call_args[1]['tests_file'], UploadedFile)
+        self.assertTrue(models.Test.objects.filter(metadata__name='bar', result=True).exists())
+
+    def test_rejects_tests_file_with_invalid_utf8(self):
+        tests = BytesIO(b'{"foo/bar": "\xff"}')
+        tests.name = 'tests.json'
+        response = self.client.post('/api/submit/mygroup/myproject/1.0.7/myenvironment', {'tests': tests})
+        self.assertEqual(400, response.status_code)
+        self.assertIn('tests is not valid UTF-8', response.content.decode())
+        self.assertFalse(models.TestRun.objects.exists())
+
+    def test_asynchronous_submission(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with open(tests_file) as f:
+                response = self.client.post('/api/submit/mygroup/myproject/1.0.0/myenvironment', {'tests': f, 'async': 'true'})
+        self.assertEqual(202, response.status_code)
+
+        testrun = models.TestRun.objects.get(pk=int(response.content))
+        self.assertEqual('http://testserver/api/testruns/%d/' % testrun.id, response['Location'])
+        self.assertEqual(models.TestRun.PROCESSED, testrun.processing_status)
+        self.assertTrue(testrun.tests.exists())
+
+        data = self.client.get(response['Location']).json()
+        self.assertEqual('processed', data['processing_status'])
+        self.assertIsNone(data['processing_error'])
+
+    def test_asynchronous_submission_with_invalid_data(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/submit/mygroup/myproject/1.0.0/myenvironment', {'tests': invalid_json(), 'async': 'true'})
+        self.assertEqual(202, response.status_code)
+
+        data = self.client.get(response['Location']).json()
+        self.assertEqual('failed', data['processing_status'])
+        self.assertIn('tests is not valid JSON', data['processing_error'])
+
     def test_receives_log_file_as_POST_param(self):
         self.client.post('/api/submit/mygroup/myproject/1.0.8/myenvironment',
                          {'log': "THIS IS THE LOG"})
@@ -269,6 +328,11 @@ class CreateTestRunApiTest(ApiTest):
         self.assertEqual(open(metadata_file, mode='rb').read(), bytes(attachment.data))
         self.assertEqual(open(metadata_file, mode='rb').read(), attachment.storage.read())
 
+    def test_attachment_length(self):
+        self.client.post('/api/submit/mygroup/myproject/1.0.0/test', {'attachment': open(log_file, mode='rb')})
+        attachment = models.TestRun.objects.last().attachments.first()
+        self.assertEqual(os.path.getsize(log_file), attachment.length)
+
     def test_multiple_attachments(self):
         self.client.post(
             '/api/submit/mygroup/myproject/1.0.15/myenvironment',
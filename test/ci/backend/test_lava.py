@@ -4,14 +4,15 @@ from io import BytesIO
 from test.mock import patch, MagicMock
 import os
 import requests
+import threading
 import requests_mock
 import yaml
 import xmlrpc
 
 
 from squad.ci.models import Backend, TestJob
-from squad.ci.backend.lava import Backend as LAVABackend
-from squad.ci.exceptions import SubmissionIssue, TemporarySubmissionIssue, TemporaryFetchIssue
+from squad.ci.backend.lava import Backend as LAVABackend, IndexedLog
+from squad.ci.exceptions import SubmissionIssue, TemporarySubmissionIssue, FetchIssue, TemporaryFetchIssue
 from squad.core.models import Group, Project
 
 
@@ -400,6 +401,11 @@ TEST_RESULTS_WITH_SUITE_VERSIONS = [
 LOG_DATA = open(os.path.join(os.path.dirname(__file__), 'example-lava-log.yaml'), 'rb').read()
 BROKEN_LOG_DATA = open(os.path.join(os.path.dirname(__file__), 'example-broken-log.yaml'), 'rb').read()
 
+
+def full_log(job_id, abandon=None):
+    return BytesIO(LOG_DATA)
+
+
 HTTP_400 = xmlrpc.client.Fault(400, 'Problem with submitted job data')
 HTTP_500 = xmlrpc.client.Fault(500, 'Internal Server Error')
 HTTP_503 = xmlrpc.client.Fault(503, 'Service Unavailable')
@@ -524,7 +530,7 @@ class LavaTest(TestCase):
         self.assertEqual('bar', testjob.name)
         __submit__.assert_called_with(test_definition)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS)
     def test_fetch_basics(self, get_results, get_details, test_log):
@@ -542,7 +548,7 @@ class LavaTest(TestCase):
         self.assertIsNotNone(testjob.started_at)
         self.assertIsNotNone(testjob.ended_at)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS_INVALID_DATES)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS)
     def test_fetch_invalid_dates(self, get_results, get_details, test_log):
@@ -560,7 +566,7 @@ class LavaTest(TestCase):
         self.assertIsNone(testjob.started_at)
         self.assertIsNone(testjob.ended_at)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS_START_DATE)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS)
     def test_fetch_missing_dates(self, get_results, get_details, test_log):
@@ -603,7 +609,7 @@ class LavaTest(TestCase):
         with self.assertRaises(TemporaryFetchIssue):
             lava.fetch(testjob)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS)
     def test_parse_results_metadata(self, get_results, get_details, test_log):
@@ -616,7 +622,7 @@ class LavaTest(TestCase):
 
         self.assertEqual(JOB_METADATA, metadata)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS_NO_METADATA)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS)
     def test_parse_results_empty_metadata(self, get_results, get_details, test_log):
@@ -629,7 +635,7 @@ class LavaTest(TestCase):
 
         self.assertEqual({}, metadata)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS_WITH_SUITE_VERSIONS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS_WITH_SUITE_VERSIONS)
     def test_parse_results_metadata_with_suite_versions(self, get_results, get_details, test_log):
@@ -642,7 +648,7 @@ class LavaTest(TestCase):
 
         self.assertEqual({"suite1": "1.0"}, metadata['suite_versions'])
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS)
     def test_parse_results_ignore_lava_suite_backend_settings(self, get_results, get_details, test_log):
@@ -669,7 +675,7 @@ class LavaTest(TestCase):
         self.assertEqual(0.0, metrics.filter(metadata__name='power-off').get().result)
         self.assertEqual(10.0, metrics.filter(metadata__name='case_foo').get().result)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS)
     def test_parse_results_ignore_lava_suite_project_settings(self, get_results, get_details, test_log):
@@ -695,7 +701,7 @@ class LavaTest(TestCase):
         self.assertEqual(0.0, metrics.filter(metadata__name='power-off').get().result)
         self.assertEqual(10.0, metrics.filter(metadata__name='case_foo').get().result)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS)
     def test_parse_results_ignore_lava_suite_empty_project_settings(self, get_results, get_details, test_log):
@@ -722,7 +728,7 @@ class LavaTest(TestCase):
         self.assertEqual(29.72, metrics.filter(metadata__name='time-device_foo').get().result)
         self.assertEqual(10.0, metrics.filter(metadata__name='case_foo').get().result)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS)
     def test_parse_results_ignore_lava_suite_project_settings_overwrites_backend(self, get_results, get_details, test_log):
@@ -754,7 +760,7 @@ class LavaTest(TestCase):
         self.assertEqual(0, metrics.filter(metadata__name='time-device_foo').count())
         self.assertEqual(10.0, metrics.filter(metadata__name='case_foo').get().result)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS)
     def test_parse_results_ignore_lava_boot(self, get_results, get_details, download_test_log):
@@ -779,7 +785,7 @@ class LavaTest(TestCase):
         self.assertEqual(1, metrics.filter(metadata__name='case_foo').count())
         self.assertEqual(10.0, metrics.filter(metadata__name='case_foo').get().result)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS_INCOMPLETE)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS_WITH_JOB_INFRA_ERROR)
     def test_parse_results_ignore_infra_errors(self, get_results, get_details, download_test_log):
@@ -805,7 +811,7 @@ class LavaTest(TestCase):
         self.assertEqual(1, metrics.filter(metadata__name='case_foo').count())
         self.assertEqual(10.0, metrics.filter(metadata__name='case_foo').get().result)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS_INCOMPLETE)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS_WITH_JOB_INFRA_ERROR)
     def test_parse_results_dont_ignore_infra_errors(self, get_results, get_details, download_test_log):
@@ -826,7 +832,7 @@ class LavaTest(TestCase):
         self.assertEqual(0, results.count())
         self.assertEqual(0, metrics.count())
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS)
     def test_parse_results_handle_lava_suite_and_ignore_lava_boot(self, get_results, get_details, download_test_log):
@@ -853,7 +859,7 @@ class LavaTest(TestCase):
         self.assertEqual(10.0, metrics.filter(metadata__name='case_foo').get().result)
         self.assertEqual(0, metrics.filter(metadata__name='time-device_foo').count())
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS)
     def test_parse_results(self, get_results, get_details, download_test_log):
@@ -870,7 +876,7 @@ class LavaTest(TestCase):
         self.assertEqual(10, metrics['DefinitionFoo/case_foo']["value"])
         self.assertEqual('job_foo', testjob.name)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS_REST)
     def test_parse_results_rest(self, get_results, get_details, download_test_log):
@@ -889,7 +895,7 @@ class LavaTest(TestCase):
         self.assertEqual(10, metrics['DefinitionFoo/case_foo']["value"])
         self.assertEqual('job_foo', testjob.name)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS)
     def test_parse_results_clone_measurements(self, get_results, get_details, test_log):
@@ -912,7 +918,7 @@ class LavaTest(TestCase):
         self.assertEqual(10, metrics['DefinitionFoo/case_foo']["value"])
         self.assertEqual('job_foo', testjob.name)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS_INFRA_FAILURE)
     def test_completed(self, get_results, get_details, get_logs):
@@ -924,7 +930,7 @@ class LavaTest(TestCase):
         status, completed, metadata, results, metrics, logs = lava.fetch(testjob)
         self.assertFalse(completed)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS_INFRA_FAILURE_STR)
     def test_incomplete_string_results_metadata(self, get_results, get_details, get_logs):
@@ -938,7 +944,7 @@ class LavaTest(TestCase):
         self.assertEqual(TEST_RESULTS_INFRA_FAILURE_STR[0]['metadata'], testjob.failure)
 
     @patch("squad.ci.backend.lava.Backend.__resubmit__")
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS_INFRA_FAILURE_STR_NO_MESSAGE)
     def test_incomplete_string_results_metadata_null_error_msg(self, get_results, get_details, get_logs, resubmit):
@@ -953,7 +959,7 @@ class LavaTest(TestCase):
         self.assertFalse(completed)
         resubmit.assert_not_called()
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS_CANCELED)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS)
     def test_canceled(self, get_results, get_details, get_logs):
@@ -965,7 +971,7 @@ class LavaTest(TestCase):
         status, completed, metadata, results, metrics, logs = lava.fetch(testjob)
         self.assertFalse(completed)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS_INFRA_FAILURE_RESUBMIT)
     def test_automated_resubmit_email(self, get_results, get_details, get_logs):
@@ -987,7 +993,7 @@ class LavaTest(TestCase):
         # there should be an admin email sent after resubmission
         self.assertEqual(1, len(mail.outbox))
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS_INFRA_FAILURE_RESUBMIT)
     def test_automated_dont_resubmit_email(self, get_results, get_details, get_logs):
@@ -1011,7 +1017,7 @@ class LavaTest(TestCase):
         # there should not be an admin email sent after resubmission
         self.assertEqual(0, len(mail.outbox))
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS_INFRA_FAILURE_RESUBMIT)
     @patch("squad.ci.backend.lava.Backend.__resubmit__", return_value="1235")
@@ -1027,7 +1033,7 @@ class LavaTest(TestCase):
         self.assertEqual(1, new_test_job.resubmitted_count)
         self.assertFalse(testjob.can_resubmit)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS_INFRA_FAILURE_CUSTOM)
     @patch("squad.ci.backend.lava.Backend.__resubmit__", return_value="1235")
@@ -1044,7 +1050,7 @@ class LavaTest(TestCase):
         self.assertEqual(1, new_test_job.resubmitted_count)
         self.assertFalse(testjob.can_resubmit)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS_INFRA_FAILURE_RESUBMIT2)
     @patch("squad.ci.backend.lava.Backend.__resubmit__", return_value="1235")
@@ -1060,7 +1066,7 @@ class LavaTest(TestCase):
         self.assertEqual(1, new_test_job.resubmitted_count)
         self.assertFalse(testjob.can_resubmit)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS_INFRA_FAILURE_RESUBMIT3)
     @patch("squad.ci.backend.lava.Backend.__resubmit__", return_value="1235")
@@ -1076,7 +1082,7 @@ class LavaTest(TestCase):
         self.assertEqual(1, new_test_job.resubmitted_count)
         self.assertFalse(testjob.can_resubmit)
 
-    @patch("squad.ci.backend.lava.Backend.__download_full_log__", return_value=LOG_DATA)
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__", side_effect=full_log)
     @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
     @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", return_value=TEST_RESULTS_INFRA_FAILURE_RESUBMIT4)
     @patch("squad.ci.backend.lava.Backend.__resubmit__", return_value="1235")
@@ -1209,15 +1215,15 @@ class LavaTest(TestCase):
         self.assertIn("feedback message", log)
         self.assertNotIn("info message", log)
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_lava_log_download(self, requests_get):
         lava1 = LAVABackend(self.backend)
         requests_get.side_effect = requests.exceptions.ChunkedEncodingError("Connection closed")
         log = lava1.__download_full_log__(999)
         requests_get.assert_called()
-        self.assertEqual(b'', log)
+        self.assertEqual(b'', log.read())
 
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_lava_log_download_rest(self, requests_get):
         # check REST API path
         self.backend.url.replace("RPC2/", "api/v0.2/")
@@ -1225,7 +1231,7 @@ class LavaTest(TestCase):
         requests_get.side_effect = requests.exceptions.ChunkedEncodingError("Connection closed")
         log = lava2.__download_full_log__(999)
         requests_get.assert_called()
-        self.assertEqual(b'', log)
+        self.assertEqual(b'', log.read())
 
     def test_broken_lava_log_parsing(self):
         lava = LAVABackend(self.backend)
@@ -1233,6 +1239,25 @@ class LavaTest(TestCase):
         log = lava.__parse_log__(log_data)
         self.assertEqual(0, len(log))
 
+    def test_lava_log_parsing_skips_broken_entries(self):
+        lava = LAVABackend(self.backend)
+        entry = b'- {"dt": "2018-02-16T18:16:46.738008", "lvl": "target", "msg": "after the broken entry"}\n'
+        log_data = BytesIO(BROKEN_LOG_DATA + entry)
+        log = lava.__parse_log__(log_data)
+        self.assertEqual("after the broken entry\n", log)
+
+    def test_lava_log_parsing_yaml_fallback(self):
+        lava = LAVABackend(self.backend)
+        log_data = BytesIO(
+            b'- {"dt": "2018-02-16T18:16:46.738008", "lvl": "info", "msg": "- {\\"lvl\\": \\"target\\"}"}\n'
+            b'- {"dt": "2018-02-16T18:16:46.738008", "lvl": "target", "msg": !!binary "bGF0aW4tMSDx"}\n'
+            b"- {dt: '2018-02-16T18:16:46.738008', lvl: feedback,\n"
+            b"   msg: 'spans two lines'}\n"
+            b'- {"dt": "2018-02-16T18:16:46.738008", "lvl": "target", "msg": "\\u00e9t\\u00e9"}\n'
+        )
+        log = lava.__parse_log__(log_data)
+        self.assertEqual("latin-1 \xf1\nspans two lines\n\xe9t\xe9\n", log)
+
     def test_empty_lava_log_parsing(self):
         lava = LAVABackend(self.backend)
         log_data = BytesIO()
@@ -1245,6 +1270,28 @@ class LavaTest(TestCase):
         test_log = lava.__download_test_log__(log_data, 1, 3)
         self.assertIn("a non-decodable unicode char:", test_log)
 
+    def test_indexed_log(self):
+        log = IndexedLog(BytesIO(b'line 1\nline 2\r\nline 3\n\nline 5'))
+        self.assertEqual(5, len(log))
+        self.assertEqual([b'line 2\r\n', b'line 3\n'], log.lines(2, 3))
+        self.assertEqual([b'\n', b'line 5'], log.lines(4, 10))
+        self.assertEqual([b'line 1\n'], log.lines(0, 1))
+        self.assertEqual([], log.lines(6, 8))
+
+    def test_test_log_from_indexed_log(self):
+        lava = LAVABackend(self.backend)
+        log = IndexedLog(BytesIO(b'line 1\nline 2\nline 3\nline 4\n'))
+        self.assertEqual("line 2\n\nline 3\n\n", lava.__download_test_log__(log, 2, 3))
+        self.assertEqual("line 3\n\nline 4\n\n", lava.__download_test_log__(log, 3, None))
+        self.assertEqual("", lava.__download_test_log__(log, 5, 6))
+
+    def test_lava_log_download_streams_to_file(self):
+        lava = LAVABackend(self.backend)
+        with requests_mock.Mocker() as m:
+            m.get("http://example.com/scheduler/job/999/log_file/plain", content=LOG_DATA)
+            log = lava.__download_full_log__(999)
+        self.assertEqual(LOG_DATA, log.read())
+
     @patch("squad.ci.backend.lava.Backend.__resubmit__", side_effect=HTTP_500)
     def test_resubmit_deleted_job(self, __resubmit__):
         lava = LAVABackend(None)
@@ -1289,3 +1336,108 @@ class LavaTest(TestCase):
                    status_code=405,
                    text="Method not allowed")
             self.assertRaises(TemporarySubmissionIssue, lava.resubmit, testjob)
+
+    def test_get_testjob_results_rest_concurrently(self):
+        self.backend.url = "http://example.com/api/v0.2/"
+        self.backend.backend_settings = '{"FETCH_CONCURRENCY": 3}'
+        lava = self.backend.get_implementation()
+        api = "http://example.com/api/v0.2/jobs/1234/suites/"
+        with requests_mock.Mocker() as m:
+            m.get(api, json={
+                'results': [{'id': 1, 'name': '0_suite1'}, {'id': 2, 'name': '1_suite2'}],
+                'next': api + '?page=2',
+            })
+            m.get(api + '?page=2', json={
+                'results': [{'id': 3, 'name': '2_suite3'}],
+                'next': None,
+            })
+            m.get(api + '1/tests', json={'results': [{'name': 'test1'}], 'next': api + '1/tests?page=2'})
+            m.get(api + '1/tests?page=2', json={'results': [{'name': 'test2'}], 'next': None})
+            m.get(api + '2/tests', json={'results': [{'name': 'test3'}, {'name': 'test4'}], 'next': None})
+            m.get(api + '3/tests', json={'results': [{'name': 'test5'}], 'next': None})
+
+            results = lava.__get_testjob_results_yaml__(1234)
+
+        self.assertEqual(
+            [
+                ('0_suite1', 'test1'),
+                ('0_suite1', 'test2'),
+                ('1_suite2', 'test3'),
+                ('1_suite2', 'test4'),
+                ('2_suite3', 'test5'),
+            ],
+            [(r['suite'], r['name']) for r in results],
+        )
+
+    def test_fetch_concurrency_setting(self):
+        lava = self.backend.get_implementation()
+        self.assertEqual(4, lava.fetch_concurrency)
+
+        self.backend.backend_settings = '{"FETCH_CONCURRENCY": 0}'
+        lava = self.backend.get_implementation()
+        self.assertEqual(1, lava.fetch_concurrency)
+
+    def test_get_testsuite_results_xmlrpc_uses_session(self):
+        lava = self.backend.get_implementation()
+        response = xmlrpc.client.dumps((yaml.dump([{'name': 'test1'}]),), methodresponse=True)
+        with requests_mock.Mocker() as m, patch.object(lava.session, 'post', wraps=lava.session.post) as post:
+            m.post(requests_mock.ANY, text=response)
+            results = lava.__get_testsuite_results_xmlrpc__(1234, '0_suite1')
+            lava.__get_testsuite_results_xmlrpc__(1234, '1_suite2')
+
+        self.assertEqual([{'name': 'test1'}], results)
+        self.assertEqual(2, post.call_count)
+
+    def test_session_is_shared_between_threads(self):
+        lava = self.backend.get_implementation()
+        sessions = lava.__map_concurrently__(lambda _: lava.session, range(lava.fetch_concurrency))
+        self.assertEqual(1, len(set(id(session) for session in sessions)))
+        self.assertIs(lava.session, sessions[0])
+
+    def test_map_concurrently_does_not_wait_on_error(self):
+        self.backend.backend_settings = '{"FETCH_CONCURRENCY": 2}'
+        lava = self.backend.get_implementation()
+        release = threading.Event()
+        finished = threading.Event()
+
+        def function(item):
+            if item == 'bad':
+                raise requests.exceptions.ConnectionError(item)
+            release.wait(10)
+            finished.set()
+
+        try:
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                lava.__map_concurrently__(function, ['slow', 'bad'])
+            self.assertFalse(finished.is_set())
+        finally:
+            release.set()
+
+    @patch("squad.ci.backend.lava.Backend.__download_full_log__")
+    @patch("squad.ci.backend.lava.Backend.__get_job_details__", return_value=JOB_DETAILS)
+    @patch("squad.ci.backend.lava.Backend.__get_testjob_results_yaml__", side_effect=requests.exceptions.ConnectionError)
+    def test_fetch_abandons_log_download_on_error(self, get_results, get_details, download_full_log):
+        release = threading.Event()
+        finished = threading.Event()
+        abandoned = []
+
+        def download(job_id, abandon):
+            release.wait(10)
+            abandoned.append(abandon.is_set())
+            finished.set()
+            return BytesIO()
+        download_full_log.side_effect = download
+
+        lava = LAVABackend(self.backend)
+        testjob = TestJob(
+            job_id='9999',
+            target=self.project,
+            backend=self.backend)
+        try:
+            with self.assertRaises(FetchIssue):
+                lava.fetch(testjob)
+            self.assertFalse(finished.is_set())
+        finally:
+            release.set()
+        self.assertTrue(finished.wait(10))
+        self.assertEqual([True], abandoned)
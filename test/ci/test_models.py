@@ -1,6 +1,8 @@
 from django.utils import timezone
 from dateutil.relativedelta import relativedelta
+from django.core.management import call_command
 from django.test import TestCase
+from django.test import override_settings
 from test.mock import patch, MagicMock
 import yaml
 
@@ -10,7 +12,7 @@ from squad.core import models as core_models
 
 from squad.ci import models
 from squad.ci.backend.null import Backend
-from squad.ci.exceptions import SubmissionIssue
+from squad.ci.exceptions import SubmissionIssue, TemporaryFetchIssue
 
 
 class BackendTest(TestCase):
@@ -82,9 +84,76 @@ class BackendPollTest(BackendTestBase):
         jobs = list(self.backend.poll())
         self.assertEqual([], jobs)
 
+    def test_poll_claims_test_jobs(self):
+        test_job = self.create_test_job(submitted=True)
+        self.assertEqual([test_job], self.backend.poll())
+        self.assertEqual([], self.backend.poll())
+
+        test_job.refresh_from_db()
+        self.assertIsNotNone(test_job.fetch_queued_at)
+        self.assertEqual(1, self.backend.inflight_fetches())
+
+    def test_poll_max_inflight_fetches(self):
+        for _ in range(3):
+            self.create_test_job(submitted=True)
+        self.backend.max_inflight_fetches = 2
+
+        self.assertEqual(2, len(self.backend.poll()))
+        self.assertEqual([], self.backend.poll())
+        self.assertEqual(1, self.backend.due_test_jobs().count())
+
+    def test_poll_with_backoff(self):
+        for _ in range(3):
+            self.create_test_job(submitted=True)
+        self.backend.max_inflight_fetches = 2
+        self.backend.fetch_backoff = 1
+
+        self.assertEqual(1, len(self.backend.poll()))
+
 
 class BackendFetchTest(BackendTestBase):
 
+    @override_settings(SQUAD_CI_SLOW_FETCH=-1)
+    @patch('squad.ci.models.Backend.get_implementation')
+    def test_slow_fetch_backs_off(self, get_implementation):
+        get_implementation.return_value.fetch.return_value = None
+        test_job = self.create_test_job(submitted=True)
+
+        self.backend.fetch(test_job.id)
+        self.backend.refresh_from_db()
+        self.assertEqual(1, self.backend.fetch_backoff)
+
+        self.backend.fetch(test_job.id)
+        self.backend.refresh_from_db()
+        self.assertEqual(2, self.backend.fetch_backoff)
+
+        test_job.refresh_from_db()
+        interval = test_job.next_fetch_at - test_job.last_fetch_attempt
+        self.assertGreaterEqual(interval.total_seconds(), 2 * self.backend.poll_interval * 60)
+
+    @patch('squad.ci.models.Backend.get_implementation')
+    def test_temporary_fetch_issue_backs_off(self, get_implementation):
+        get_implementation.return_value.fetch.side_effect = TemporaryFetchIssue('busy')
+        test_job = self.create_test_job(submitted=True)
+
+        self.backend.fetch(test_job.id)
+        self.backend.refresh_from_db()
+        self.assertEqual(1, self.backend.fetch_backoff)
+
+        test_job.refresh_from_db()
+        self.assertEqual(1, test_job.fetch_attempts)
+        self.assertGreater(test_job.next_fetch_at, timezone.now())
+
+    @patch('squad.ci.models.Backend.get_implementation')
+    def test_fast_fetch_recovers_from_backoff(self, get_implementation):
+        get_implementation.return_value.fetch.return_value = None
+        models.Backend.objects.filter(pk=self.backend.pk).update(fetch_backoff=2)
+        test_job = self.create_test_job(submitted=True)
+
+        self.backend.fetch(test_job.id)
+        self.backend.refresh_from_db()
+        self.assertEqual(1, self.backend.fetch_backoff)
+
     @patch("squad.ci.backend.null.Backend.fetch")
     def test_fetch_skips_already_fetched(self, fetch):
         test_job = self.create_test_job(submitted=True, fetched=True)
@@ -413,7 +482,7 @@ class BackendFetchTest(BackendTestBase):
 
     @patch('squad.ci.backend.null.Backend.job_url', return_value="http://example.com/123")
     @patch('squad.ci.backend.null.Backend.fetch')
-    @patch('squad.ci.models.ReceiveTestRun.__call__')
+    @patch('squad.ci.models.ReceiveTestRun.receive_parsed')
     def test_fetch_sets_fetched_at(self, receive, backend_fetch, backend_job_url):
         backend_fetch.return_value = ('Completed', True, {}, {}, {}, None)
 
@@ -433,7 +502,7 @@ class BackendFetchTest(BackendTestBase):
     @patch('squad.ci.models.Backend.__postprocess_testjob__')
     @patch('squad.ci.backend.null.Backend.job_url', return_value="http://example.com/123")
     @patch('squad.ci.backend.null.Backend.fetch')
-    @patch('squad.ci.models.ReceiveTestRun.__call__')
+    @patch('squad.ci.models.ReceiveTestRun.receive_parsed')
     def test_fetch_postprocessing(self, receive, backend_fetch, backend_job_url, postprocess):
         self.project.enabled_plugins_list = ['linux_log_parser']
         self.project.save()
@@ -795,3 +864,82 @@ class TestJobTest(TestCase):
         self.assertIsNone(testjob.input)
         testjob.input = "testing"
         self.assertEqual("testing", testjob.input)
+
+
+class TestJobCounterTest(BackendTestBase):
+
+    def counters(self):
+        return {
+            (c.environment, c.job_status, c.fetched): c.count
+            for c in models.TestJobCounter.objects.filter(build=self.build, count__gt=0)
+        }
+
+    def test_status_changes(self):
+        job1 = self.create_test_job(environment='env1')
+        job2 = self.create_test_job(environment='env1')
+        self.create_test_job(environment='env2', job_status='Running')
+        self.assertEqual({('env1', '', False): 2, ('env2', 'Running', False): 1}, self.counters())
+
+        job1.job_status = 'Complete'
+        job1.fetched = True
+        job1.save()
+        job2 = models.TestJob.objects.only('id').get(pk=job2.pk)
+        job2.job_status = 'Incomplete'
+        job2.save()
+        self.assertEqual(
+            {
+                ('env1', 'Complete', True): 1,
+                ('env1', 'Incomplete', False): 1,
+                ('env2', 'Running', False): 1,
+            },
+            self.counters(),
+        )
+
+        job1.delete()
+        self.assertEqual({('env1', 'Incomplete', False): 1, ('env2', 'Running', False): 1}, self.counters())
+
+    def test_stale_copies(self):
+        job = self.create_test_job(environment='env1', job_status='Running')
+        copy = models.TestJob.objects.get(pk=job.pk)
+
+        job.job_status = 'Complete'
+        job.save()
+        copy.job_status = 'Incomplete'
+        copy.save()
+        self.assertEqual({('env1', 'Incomplete', False): 1}, self.counters())
+
+    def test_compute_test_job_counters(self):
+        self.create_test_job(environment='env1', job_status='Complete', fetched=True)
+        self.create_test_job(environment='env1')
+        counters = self.counters()
+
+        models.TestJobCounter.objects.update(count=0)
+        call_command('compute_test_job_counters')
+        self.assertEqual(counters, self.counters())
+
+    def test_refresh(self):
+        self.create_test_job(environment='env1', job_status='Complete', fetched=True)
+        self.create_test_job(environment='env1')
+        counters = self.counters()
+
+        models.TestJobCounter.objects.all().delete()
+        models.TestJobCounter.refresh(self.build)
+        self.assertEqual(counters, self.counters())
+
+    def test_build_summary_and_finished(self):
+        job = self.create_test_job(environment='env1', job_status='Running')
+        self.create_test_job(environment='env2', job_status='Complete', fetched=True)
+
+        self.assertEqual({'Running': 1, 'Complete': 1}, self.build.test_jobs_summary())
+        self.assertEqual({'env1': {'Running': 1}, 'env2': {'Complete': 1}}, self.build.test_jobs_summary(per_environment=True))
+        self.assertFalse(self.build.finished[0])
+
+        job.job_status = 'Fetching'
+        job.fetched = True
+        job.save()
+        self.assertFalse(self.build.finished[0])
+
+        job.job_status = 'Complete'
+        job.save()
+        self.assertEqual({'Complete': 2}, self.build.test_jobs_summary())
+        self.assertTrue(self.build.finished[0])
@@ -1,5 +1,6 @@
 from django.test import TestCase, TransactionTestCase, tag
 from django.db import connection
+from django.utils import timezone
 from test.mock import patch
 import time
 import threading
@@ -46,6 +47,42 @@ class PollTest(TestCase):
         poll.apply()
         fetch_method.apply_async.assert_called_with(args=(testjob.id,), task_id=task_id(testjob))
 
+    @patch("squad.ci.tasks.poll.apply_async")
+    @patch("squad.ci.tasks.fetch")
+    def test_poll_again_when_all_fetch_slots_are_taken(self, fetch_method, poll_again):
+        group = core_models.Group.objects.create(slug='testgroup')
+        project = group.projects.create(slug='testproject')
+        backend = models.Backend.objects.create(name='b1', max_inflight_fetches=2)
+        for _ in range(3):
+            backend.test_jobs.create(target=project, submitted=True)
+
+        poll.apply()
+        self.assertEqual(2, fetch_method.apply_async.call_count)
+        poll_again.assert_called_once_with(args=(backend.id,), countdown=60)
+
+        # e.g. the periodic poll, or a poll from the admin, while the
+        # follow-up poll is still pending
+        poll.apply()
+        poll.apply(args=(backend.id,))
+        self.assertEqual(1, poll_again.call_count)
+
+        models.Backend.objects.filter(pk=backend.pk).update(poll_scheduled_at=timezone.now())
+        poll.apply(args=(backend.id,))
+        self.assertEqual(2, poll_again.call_count)
+
+    @patch("squad.ci.models.Backend.fetch")
+    def test_poll_fetches_all_due_test_jobs_in_batches(self, fetch_method):
+        group = core_models.Group.objects.create(slug='testgroup')
+        project = group.projects.create(slug='testproject')
+        backend = models.Backend.objects.create(name='b1', max_inflight_fetches=2)
+        for _ in range(3):
+            backend.test_jobs.create(target=project, submitted=True, job_id='1')
+
+        # fetches are run right away in the tests, so slots are freed up
+        poll.apply()
+        self.assertEqual(3, fetch_method.call_count)
+        self.assertEqual(0, backend.inflight_fetches())
+
 
 class FetchTest(TestCase):
 
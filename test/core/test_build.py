@@ -4,7 +4,7 @@ from django.utils import timezone
 from unittest.mock import patch
 
 
-from squad.core.models import Group, Project, Build, KnownIssue, SuiteMetadata
+from squad.core.models import Group, Project, Build, BuildMetadata, KnownIssue, SuiteMetadata
 from squad.ci.models import TestJob, Backend
 
 
@@ -90,6 +90,44 @@ class BuildTest(TestCase):
 
         self.assertEqual(metadata1, metadata2)
 
+    def test_metadata_is_updated_incrementally(self):
+        build = Build.objects.create(project=self.project, version='1.1')
+        env = self.project.environments.create(slug='env')
+        build.test_runs.create(environment=env, metadata_file='{"foo": "bar"}')
+        self.assertEqual({"foo": "bar"}, Build.objects.get(pk=build.pk).metadata)
+
+        build.test_runs.create(environment=env, metadata_file='{"foo": "baz", "qux": {"a": 1}}')
+        build.test_runs.create(environment=env, metadata_file='{"foo": "bar", "qux": {"a": 1}}')
+        self.assertTrue(BuildMetadata.objects.filter(build=build).exists())
+        build = Build.objects.get(pk=build.pk)
+        with self.assertNumQueries(1):
+            metadata = build.metadata
+        self.assertEqual({"foo": ["bar", "baz"], "qux": {"a": 1}}, metadata)
+
+    def test_metadata_row_created_but_not_computed(self):
+        build = Build.objects.create(project=self.project, version='1.1')
+        env = self.project.environments.create(slug='env')
+        build.test_runs.create(environment=env, metadata_file='{"foo": "bar"}')
+
+        # e.g. created by a concurrent request that is still computing it
+        BuildMetadata.objects.filter(build=build).update(data='')
+        build.test_runs.create(environment=env, metadata_file='{"foo": "baz"}')
+        self.assertEqual({"foo": ["bar", "baz"]}, Build.objects.get(pk=build.pk).metadata)
+
+    def test_metadata_after_test_run_changes(self):
+        build = Build.objects.create(project=self.project, version='1.1')
+        env = self.project.environments.create(slug='env')
+        testrun = build.test_runs.create(environment=env, metadata_file='{"foo": "bar"}')
+        build.test_runs.create(environment=env, metadata_file='{"foo": "baz"}')
+        self.assertEqual({"foo": ["bar", "baz"]}, Build.objects.get(pk=build.pk).metadata)
+
+        testrun.metadata["foo"] = "qux"
+        testrun.save()
+        self.assertEqual({"foo": ["baz", "qux"]}, Build.objects.get(pk=build.pk).metadata)
+
+        testrun.delete()
+        self.assertEqual({"foo": "baz"}, Build.objects.get(pk=build.pk).metadata)
+
     def test_finished_empty_expected_test_runs(self):
         env1 = self.project.environments.create(slug='env1', expected_test_runs=None)
         self.project.environments.create(slug='env2', expected_test_runs=None)
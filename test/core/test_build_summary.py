@@ -121,3 +121,27 @@ class BuildSummaryTest(TestCase):
         self.assertEqual(1, summary2.tests_fail)
         self.assertEqual(1, summary2.tests_skip)
         self.assertEqual(0, summary2.tests_xfail)
+
+    def test_incremental_update_matches_full_recompute(self):
+        build = self.project.builds.create(version='3')
+        self.receive_testrun(build.version, self.env1.slug, tests_file='{"suite1/foo": "pass", "suite1/bar": "fail"}', metrics_file='{"suite1/foo": 2}')
+        self.receive_testrun(build.version, self.env1.slug, tests_file='{"suite2/qux": "fail"}', metrics_file='{"suite2/baz": [4, 8]}')
+
+        summary = BuildSummary.objects.get(build=build, environment=self.env1)
+        self.assertEqual(3, summary.tests_total)
+        self.assertEqual(1, summary.tests_xfail)
+        self.assertEqual(2, summary.test_runs_total)
+        self.assertTrue(eq(geomean([2, 6]), summary.metrics_summary))
+
+        expected = BuildSummary.create_or_update(build, self.env1)
+        self.assertEqual(expected.tests_total, summary.tests_total)
+        self.assertEqual(expected.metrics_count, summary.metrics_count)
+        self.assertTrue(eq(expected.metrics_summary, summary.metrics_summary))
+
+    def test_refresh_recomputes_invalidated_summary(self):
+        summary = BuildSummary.objects.get(build=self.build1, environment=self.env1)
+        BuildSummary.invalidate(self.build1.id, self.env1.id)
+
+        summary = BuildSummary.refresh(self.build1, self.env1)
+        self.assertIsNotNone(summary.metrics_count)
+        self.assertTrue(eq(geomean([1, 2, 3, 4]), summary.metrics_summary))
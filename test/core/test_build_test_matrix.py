@@ -0,0 +1,87 @@
+import json
+
+from django.test import TestCase
+
+from squad.core.models import Group, BuildTestMatrix, KnownIssue, SuiteMetadata
+from squad.core.tasks import ReceiveTestRun
+
+
+class BuildTestMatrixTest(TestCase):
+
+    def setUp(self):
+        self.group = Group.objects.create(slug='mygroup')
+        self.project = self.group.projects.create(slug='myproject')
+        self.receive = ReceiveTestRun(self.project, update_project_status=False)
+
+    def receive_testrun(self, env, tests, version='1'):
+        testrun, _ = self.receive(version, env, tests_file=json.dumps(tests))
+        return testrun
+
+    def cells(self, build):
+        return {
+            (cell.environment.slug, cell.metadata.name): (cell.status, cell.confidence)
+            for cell in BuildTestMatrix.objects.filter(build=build).prefetch_related('environment', 'metadata')
+        }
+
+    def test_record(self):
+        env = self.project.environments.create(slug='env1')
+        issue = KnownIssue.objects.create(title='known', test_name='suite1/xfail')
+        issue.environments.add(env)
+
+        testrun = self.receive_testrun('env1', {'suite1/pass': 'pass', 'suite1/fail': 'fail', 'suite1/xfail': 'fail', 'suite1/skip': 'skip'})
+        self.receive_testrun('env2', {'suite1/pass': 'fail'})
+
+        self.assertEqual(
+            {
+                ('env1', 'pass'): ('pass', None),
+                ('env1', 'fail'): ('fail', None),
+                ('env1', 'xfail'): ('xfail', None),
+                ('env1', 'skip'): ('skip', None),
+                ('env2', 'pass'): ('fail', None),
+            },
+            self.cells(testrun.build),
+        )
+        cell = BuildTestMatrix.objects.get(build=testrun.build, environment=env, metadata__name='pass')
+        self.assertEqual('suite1', cell.suite.slug)
+
+    def test_duplicates(self):
+        testrun = self.receive_testrun('env1', {'suite1/a': 'pass', 'suite1/b': 'pass'})
+        self.receive_testrun('env1', {'suite1/a': 'fail', 'suite1/b': 'pass'})
+        self.receive_testrun('env1', {'suite1/a': 'fail'})
+
+        cells = self.cells(testrun.build)
+        self.assertEqual('fail', cells[('env1', 'a')][0])
+        self.assertAlmostEqual(200 / 3, cells[('env1', 'a')][1])
+        self.assertEqual(('pass', 100), cells[('env1', 'b')])
+
+    def test_delete_testrun(self):
+        testrun = self.receive_testrun('env1', {'suite1/a': 'pass', 'suite1/b': 'pass'})
+        self.receive_testrun('env1', {'suite1/a': 'fail'})
+
+        testrun.delete()
+        self.assertFalse(BuildTestMatrix.objects.filter(build=testrun.build).exists())
+
+        BuildTestMatrix.refresh(testrun.build_id)
+        cells = BuildTestMatrix.objects.filter(build=testrun.build)
+        self.assertEqual([('fail', None)], list(cells.values_list('status', 'confidence')))
+
+    def test_refresh(self):
+        build = self.project.builds.create(version='1')
+        env = self.project.environments.create(slug='env1')
+        suite = self.project.suites.create(slug='suite1')
+        metadata, _ = SuiteMetadata.objects.get_or_create(suite='suite1', name='a', kind='test')
+        testrun = build.test_runs.create(environment=env)
+        testrun.tests.create(build=build, environment=env, suite=suite, metadata=metadata, result=False)
+
+        BuildTestMatrix.refresh(build.id)
+        self.assertEqual([('fail', None)], list(BuildTestMatrix.objects.filter(build=build).values_list('status', 'confidence')))
+
+    def test_new_testrun_after_invalidation(self):
+        testrun = self.receive_testrun('env1', {'suite1/a': 'pass'})
+        BuildTestMatrix.invalidate(testrun.build_id)
+
+        self.receive_testrun('env2', {'suite1/a': 'fail'})
+        self.assertEqual(
+            {('env1', 'a'): ('pass', None), ('env2', 'a'): ('fail', None)},
+            self.cells(testrun.build),
+        )
@@ -24,3 +24,32 @@ class TestEmailTemplateTest(TestCase):
         emailTemplate = models.EmailTemplate.objects.get(name='fooTemplate')
         emailTemplate.subject = 'This is a {{ template }}'
         self.assertEqual(emailTemplate.full_clean(), None)
+
+    def test_compiled(self):
+        info = models.EmailTemplate.compiled_cache_info()
+        template = self.email_template.compiled('plain_text')
+        self.assertEqual('text template', template.render({}))
+        self.assertIs(template, self.email_template.compiled('plain_text'))
+
+        new_info = models.EmailTemplate.compiled_cache_info()
+        self.assertEqual(info['misses'] + 1, new_info['misses'])
+        self.assertEqual(info['hits'] + 1, new_info['hits'])
+
+    def test_compiled_after_change(self):
+        self.email_template.compiled('plain_text')
+        self.email_template.plain_text = 'changed {{ foo }}'
+        self.assertEqual('changed bar', self.email_template.compiled('plain_text').render({'foo': 'bar'}))
+
+    def test_compiled_invalidated_on_save(self):
+        self.email_template.compiled('plain_text')
+        keys = [k for k in models.EmailTemplate.__compiled__ if k[0] == self.email_template.id]
+        self.assertEqual(1, len(keys))
+
+        self.email_template.save()
+        keys = [k for k in models.EmailTemplate.__compiled__ if k[0] == self.email_template.id]
+        self.assertEqual([], keys)
+
+    def test_compiled_cache_size(self):
+        for i in range(models.EmailTemplate.COMPILED_CACHE_SIZE + 10):
+            models.EmailTemplate.compile(None, 'subject', 'subject %d' % i)
+        self.assertEqual(models.EmailTemplate.COMPILED_CACHE_SIZE, models.EmailTemplate.compiled_cache_info()['size'])
@@ -1,6 +1,6 @@
 from django.test import TestCase
 from squad.core.failures import failures_with_confidence
-from squad.core.models import Build, Group, SuiteMetadata
+from squad.core.models import Build, Group, SuiteMetadata, TestResultHistory
 
 
 def get_build_failures(build):
@@ -27,14 +27,17 @@ class FailuresWithConfidenceTest(TestCase):
         b1 = Build.objects.create(project=self.project, version='1.1')
         tr1 = b1.test_runs.create(environment=env)
         tr1.tests.create(build=tr1.build, environment=tr1.environment, suite=suite, metadata=metadata, result=True)
+        TestResultHistory.add_testrun(tr1)
 
         b2 = Build.objects.create(project=self.project, version='1.2')
         tr2 = b2.test_runs.create(environment=env)
         tr2.tests.create(build=tr2.build, environment=tr2.environment, suite=suite, metadata=metadata, result=True)
+        TestResultHistory.add_testrun(tr2)
 
         b3 = Build.objects.create(project=self.project, version='1.3')
         tr3 = b3.test_runs.create(environment=env)
         tr3.tests.create(build=tr3.build, environment=tr3.environment, suite=suite, metadata=metadata, result=False)
+        TestResultHistory.add_testrun(tr3)
 
         f1 = failures_with_confidence(self.project, b1, get_build_failures(b1))
         self.assertEqual(len(f1), 0)
@@ -61,6 +64,7 @@ class FailuresWithConfidenceTest(TestCase):
         b1 = Build.objects.create(project=self.project, version='1.1')
         tr1 = b1.test_runs.create(environment=env)
         tr1.tests.create(build=tr1.build, environment=tr1.environment, suite=suite, metadata=metadata, result=False)
+        TestResultHistory.add_testrun(tr1)
 
         f1 = failures_with_confidence(self.project, b1, get_build_failures(b1))
         self.assertEqual(len(f1), 1)
@@ -72,3 +76,29 @@ class FailuresWithConfidenceTest(TestCase):
         self.assertEqual(test.confidence.count, 0)
         self.assertEqual(test.confidence.score, 0)
         self.assertEqual(test.confidence.threshold, self.project.build_confidence_threshold)
+
+    def test_failures_with_confidence_number_of_queries(self):
+        env = self.project.environments.create(slug="env")
+        suite = self.project.suites.create(slug="suite")
+
+        b1 = Build.objects.create(project=self.project, version='1.1')
+        tr1 = b1.test_runs.create(environment=env)
+        b2 = Build.objects.create(project=self.project, version='1.2')
+        tr2 = b2.test_runs.create(environment=env)
+        for i in range(20):
+            metadata, _ = SuiteMetadata.objects.get_or_create(suite=suite.slug, name="test%d" % i, kind="test")
+            tr1.tests.create(build=b1, environment=env, suite=suite, metadata=metadata, result=(i % 2 == 0))
+            tr2.tests.create(build=b2, environment=env, suite=suite, metadata=metadata, result=False)
+        TestResultHistory.add_testrun(tr1)
+        TestResultHistory.add_testrun(tr2)
+
+        failures = list(get_build_failures(b2))
+        # builds, test metadata and histories
+        with self.assertNumQueries(3):
+            failures_with_confidence(self.project, b2, failures)
+
+        self.assertEqual(20, len(failures))
+        for failure in failures:
+            passes = 1 if failure.metadata.name in ['test%d' % i for i in range(0, 20, 2)] else 0
+            self.assertEqual(passes, failure.confidence.passes)
+            self.assertEqual(1, failure.confidence.count)
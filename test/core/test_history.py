@@ -120,3 +120,15 @@ class TestHistoryTest(TestCase):
 
         with self.assertRaises(models.Build.DoesNotExist):
             TestHistory(empty_project, test_name)
+
+    def test_known_issues_with_wildcards(self):
+        env1 = self.project1.environments.get(slug='env1')
+        env2 = self.project1.environments.get(slug='env2')
+        issue = models.KnownIssue.objects.create(title='foo is flaky', test_name='foo/*')
+        issue.environments.add(env1)
+
+        history = TestHistory(self.project1, 'foo/bar')
+
+        build2 = self.project1.builds.get(version='2')
+        self.assertEqual([issue], history.results[build2][env1.id].known_issues)
+        self.assertIsNone(history.results[build2][env2.id].known_issues)
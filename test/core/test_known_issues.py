@@ -1,6 +1,9 @@
+from unittest.mock import MagicMock, patch
+
 from django.test import TestCase
 from django.utils import timezone
 
+from squad.core.known_issues import KnownIssueMatcher
 from squad.core.models import Group, KnownIssue, SuiteMetadata
 from squad.core.tasks import ParseTestRunData
 
@@ -113,3 +116,95 @@ class KnownIssueTest(TestCase):
         for test in testrun.tests.filter(suite__slug__in="suite1,suite2").all():
             self.assertTrue(test.has_known_issues)
             self.assertIn(known_issue, test.known_issues.all())
+
+    def test_matcher_for_environment(self):
+        literal = KnownIssue.objects.create(title="foo", test_name="suite1/foo")
+        literal.environments.add(self.env1)
+        pattern = KnownIssue.objects.create(title="bar", test_name="suite*/bar")
+        pattern.environments.add(self.env1)
+
+        matcher = KnownIssue.matcher_for_environment(self.env1)
+        self.assertEqual([literal], matcher.match("suite1/foo"))
+        self.assertEqual([pattern], matcher.match("suite2/bar"))
+        self.assertEqual([], matcher.match("suite2/foo"))
+
+    def test_matcher_for_environment_is_cached(self):
+        issue = KnownIssue.objects.create(title="foo", test_name="suite1/foo")
+        issue.environments.add(self.env1)
+
+        matcher = KnownIssue.matcher_for_environment(self.env1)
+        with self.assertNumQueries(1):
+            self.assertIs(matcher, KnownIssue.matcher_for_environment(self.env1))
+
+    def test_matcher_for_environment_invalidated_by_other_processes(self):
+        issue = KnownIssue.objects.create(title="foo", test_name="suite1/foo")
+        issue.environments.add(self.env1)
+        matcher = KnownIssue.matcher_for_environment(self.env1)
+
+        # changes made elsewhere do not clear the cache of this process
+        with patch.object(KnownIssue, '__matchers__', {}):
+            KnownIssue.objects.create(title="bar", test_name="suite1/bar").environments.add(self.env1)
+
+        self.assertIsNot(matcher, KnownIssue.matcher_for_environment(self.env1))
+        self.assertEqual(1, len(KnownIssue.matcher_for_environment(self.env1).match("suite1/bar")))
+
+    def test_matcher_for_environment_invalidated_on_changes(self):
+        issue = KnownIssue.objects.create(title="foo", test_name="suite1/foo")
+        issue.environments.add(self.env1)
+        self.assertEqual([issue], KnownIssue.matcher_for_environment(self.env1).match("suite1/foo"))
+
+        issue.test_name = "suite2/foo"
+        issue.save()
+        self.assertEqual([], KnownIssue.matcher_for_environment(self.env1).match("suite1/foo"))
+
+        issue.environments.remove(self.env1)
+        self.assertEqual([], KnownIssue.matcher_for_environment(self.env1).match("suite2/foo"))
+
+
+class KnownIssueMatcherTest(TestCase):
+
+    def issue(self, test_name):
+        return KnownIssue(title=test_name, test_name=test_name)
+
+    def test_literal(self):
+        issue = self.issue("suite1/foo")
+        matcher = KnownIssueMatcher([issue])
+        self.assertEqual([issue], matcher.match("suite1/foo"))
+        self.assertEqual([], matcher.match("suite1/bar"))
+
+    def test_literal_matches_beginning_of_test_name(self):
+        issue = self.issue("suite1/foo")
+        matcher = KnownIssueMatcher([issue])
+        self.assertEqual([issue], matcher.match("suite1/foo[variant]"))
+        self.assertEqual([], matcher.match("suite1/fo"))
+
+    def test_wildcards(self):
+        issue1 = self.issue("suite*/foo")
+        issue2 = self.issue("suite1/*")
+        matcher = KnownIssueMatcher([issue1, issue2])
+        self.assertEqual([issue1, issue2], matcher.match("suite1/foo"))
+        self.assertEqual([issue1], matcher.match("suite2/foo"))
+        self.assertEqual([issue2], matcher.match("suite1/bar"))
+        self.assertEqual([], matcher.match("other/foo"))
+
+    def test_only_patterns_sharing_the_prefix_are_tried(self):
+        ltp = self.issue("ltp/*")
+        kselftest = self.issue("kselftest/*")
+        matcher = KnownIssueMatcher([ltp, kselftest])
+        regex = MagicMock()
+        matcher.patterns["kselftest/"] = [(regex, [kselftest])]
+
+        self.assertEqual([ltp], matcher.match("ltp/foo"))
+        regex.match.assert_not_called()
+
+    def test_special_characters(self):
+        issue = self.issue("suite1/foo[bar.baz]")
+        matcher = KnownIssueMatcher([issue])
+        self.assertEqual([issue], matcher.match("suite1/foo[bar.baz]"))
+        self.assertEqual([], matcher.match("suite1/foo[barXbaz]"))
+
+    def test_multiple_issues_for_same_test(self):
+        issue1 = self.issue("suite1/foo")
+        issue2 = self.issue("suite1/foo")
+        matcher = KnownIssueMatcher([issue1, issue2])
+        self.assertEqual([issue1, issue2], matcher.match("suite1/foo"))
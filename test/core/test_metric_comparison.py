@@ -196,6 +196,19 @@ class MetricComparisonTest(TestCase):
                 self.assertNotIn(metric_name, comparison.regressions[self.environment_a.slug])
                 self.assertNotIn(metric_name, comparison.fixes[self.environment_a.slug])
 
+    def test_cached_comparison_invalidated_by_threshold_changes(self):
+        metric_name = 'suite_a/thresholdless-metric'
+        self.receive_test_run(self.project, self.build_a.version, self.environment_a.slug, {metric_name: 1})
+        self.receive_test_run(self.project, self.build_b.version, self.environment_a.slug, {metric_name: 2})
+
+        comparison = MetricComparison(self.build_a, self.build_b, regressions_and_fixes_only=True)
+        self.assertEqual({}, comparison.regressions)
+        self.assertTrue(models.BuildComparison.objects.filter(target=self.build_b, kind='metrics').exists())
+
+        self.project.thresholds.create(name=metric_name, is_higher_better=False)
+        comparison = MetricComparison(self.build_a, self.build_b, regressions_and_fixes_only=True)
+        self.assertEqual({self.environment_a.slug: [metric_name]}, comparison.regressions)
+
     def different_environments(self):
         metric_name = 'suite_a/different-env-metric'
         build_a_result = 1
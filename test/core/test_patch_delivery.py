@@ -0,0 +1,125 @@
+from datetime import timedelta
+from unittest.mock import patch, MagicMock
+
+from django.test import TestCase
+from django.test import override_settings
+from django.utils import timezone
+
+from squad.core import patch_delivery
+from squad.core.models import Group, PatchSource, PatchNotification
+from squad.core.plugins import Plugin
+from squad.core.tasks.notification import deliver_patch_notifications
+
+
+class PatchDeliveryTest(TestCase):
+
+    def setUp(self):
+        group = Group.objects.create(slug='mygroup')
+        self.project1 = group.projects.create(slug='myproject1')
+        self.project2 = group.projects.create(slug='myproject2')
+        self.patch_source = PatchSource.objects.create(
+            name='foo',
+            url='https://foo.example.com',
+            implementation='example',
+        )
+        self.build1 = self.project1.builds.create(version='1', patch_source=self.patch_source, patch_id='1,1')
+        self.build2 = self.project2.builds.create(version='1', patch_source=self.patch_source, patch_id='1,1')
+        self.build3 = self.project1.builds.create(version='2', patch_source=self.patch_source, patch_id='2,1')
+
+    def notify(self, build, event):
+        return PatchNotification.objects.create(build=build, event=event)
+
+    def claim(self):
+        return PatchNotification.claim(patch_delivery.BATCH_SIZE)
+
+    def test_group_by_change(self):
+        self.notify(self.build1, 'created')
+        self.notify(self.build2, 'created')
+        self.notify(self.build3, 'created')
+        self.notify(self.build1, 'finished')
+        self.notify(self.build1, 'finished')
+
+        changes = patch_delivery.group_by_change(self.claim())
+        self.assertEqual(2, len(changes))
+        self.assertEqual(4, len(changes[0].notifications))
+        self.assertEqual([(self.build2, 'created'), (self.build1, 'finished')], changes[0].updates)
+        self.assertEqual([(self.build3, 'created')], changes[1].updates)
+        self.assertEqual('foo.example.com', changes[0].destination)
+
+    def test_claim(self):
+        self.notify(self.build1, 'created')
+        self.assertEqual(1, len(self.claim()))
+        self.assertEqual([], self.claim())
+
+    def test_get_session(self):
+        session = patch_delivery.get_session(self.patch_source)
+        self.assertIs(session, patch_delivery.get_session(self.patch_source))
+
+    @patch('squad.core.models.PatchSource.get_implementation')
+    def test_deliver(self, get_implementation):
+        plugin = MagicMock()
+        plugin.notify_patch_builds.return_value = True
+        get_implementation.return_value = plugin
+
+        self.notify(self.build1, 'created')
+        self.notify(self.build3, 'created')
+        self.notify(self.build2, 'finished')
+        deliver_patch_notifications()
+
+        self.assertEqual(2, plugin.notify_patch_builds.call_count)
+        plugin.notify_patch_builds.assert_any_call([(self.build1, 'created'), (self.build2, 'finished')])
+        plugin.notify_patch_builds.assert_any_call([(self.build3, 'created')])
+        self.assertFalse(PatchNotification.objects.exists())
+
+    @override_settings(SQUAD_PATCH_NOTIFICATION_RETRIES=2)
+    @patch('squad.core.models.PatchSource.get_implementation')
+    def test_retry(self, get_implementation):
+        plugin = MagicMock()
+        plugin.notify_patch_builds.side_effect = [False, ConnectionError('down')]
+        get_implementation.return_value = plugin
+
+        self.notify(self.build1, 'finished')
+        deliver_patch_notifications()
+
+        notification = PatchNotification.objects.get()
+        self.assertEqual(1, notification.attempts)
+        self.assertGreater(notification.next_attempt_at, timezone.now())
+
+        PatchNotification.objects.update(next_attempt_at=timezone.now())
+        deliver_patch_notifications()
+        self.assertEqual(2, plugin.notify_patch_builds.call_count)
+        self.assertFalse(PatchNotification.objects.exists())
+
+    @patch('squad.core.models.PatchSource.get_implementation')
+    def test_retry_only_failed_updates(self, get_implementation):
+        plugin = MagicMock()
+        plugin.notify_patch_builds.return_value = [True, False]
+        get_implementation.return_value = plugin
+
+        self.notify(self.build1, 'created')
+        self.notify(self.build2, 'created')
+        self.notify(self.build2, 'finished')
+        deliver_patch_notifications()
+
+        plugin.notify_patch_builds.assert_called_once_with([(self.build1, 'created'), (self.build2, 'finished')])
+        # the notification that build2 was created goes with the one that it finished
+        self.assertEqual(
+            [(self.build2.id, 'created'), (self.build2.id, 'finished')],
+            sorted(PatchNotification.objects.values_list('build_id', 'event')),
+        )
+
+    def test_default_notify_patch_builds_reports_each_update(self):
+        plugin = Plugin()
+        plugin.notify_patch_build_created = MagicMock(return_value=None)
+        plugin.notify_patch_build_finished = MagicMock(return_value=False)
+        self.assertEqual([True, False], plugin.notify_patch_builds([(self.build1, 'created'), (self.build2, 'finished')]))
+
+    @patch('squad.core.models.PatchSource.get_implementation')
+    def test_not_due(self, get_implementation):
+        notification = self.notify(self.build1, 'finished')
+        notification.next_attempt_at = timezone.now() + timedelta(minutes=5)
+        notification.save()
+
+        deliver_patch_notifications()
+        get_implementation.assert_not_called()
+        self.assertTrue(PatchNotification.objects.exists())
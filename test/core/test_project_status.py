@@ -1,9 +1,11 @@
-from django.core.exceptions import ValidationError
+import yaml
+
 from django.utils import timezone
 from django.test import TestCase
 from dateutil.relativedelta import relativedelta
 
-from squad.core.models import Group, ProjectStatus, MetricThreshold, SuiteMetadata
+from squad.core import models
+from squad.core.models import Group, ProjectStatus, ProjectStatusChange, MetricThreshold, SuiteMetadata
 from squad.core.tasks import ReceiveTestRun, notification
 
 
@@ -331,6 +333,57 @@ class ProjectStatusTest(TestCase):
         self.assertIsNotNone(status2.fixes)
         self.assertIsNone(status2.regressions)
 
+    def test_regressions_and_fixes_are_indexed(self):
+        foo_metadata, _ = SuiteMetadata.objects.get_or_create(suite=self.suite.slug, name='foo', kind='test')
+        bar_metadata, _ = SuiteMetadata.objects.get_or_create(suite=self.suite.slug, name='bar', kind='test')
+        results = [(True, False), (False, True), (True, False)]
+        builds = []
+        for n, (foo, bar) in enumerate(results):
+            build = self.create_build(str(n), datetime=h(10 - n))
+            test_run = build.test_runs.first()
+            test_run.tests.create(build=build, environment=self.environment, metadata=foo_metadata, suite=self.suite, result=foo)
+            test_run.tests.create(build=build, environment=self.environment, metadata=bar_metadata, suite=self.suite, result=bar)
+            ProjectStatus.create_or_update(build)
+            builds.append(build)
+
+        status = ProjectStatus.objects.get(build=builds[1])
+        self.assertEqual({'theenvironment': ['suite_/foo']}, status.get_regressions())
+        self.assertEqual({'theenvironment': ['suite_/bar']}, status.get_fixes())
+        self.assertEqual(status.get_regressions(), yaml.load(status.regressions, Loader=yaml.Loader))
+        self.assertIsNone(status.metric_regressions)
+
+        change = ProjectStatusChange.objects.get(status=status, kind=ProjectStatusChange.REGRESSION)
+        self.assertEqual(self.environment, change.environment)
+        self.assertEqual(self.suite, change.suite)
+        self.assertEqual(foo_metadata, change.metadata)
+
+        with self.assertNumQueries(1):
+            regressed = list(self.project.builds.filter(
+                status_changes__kind=ProjectStatusChange.REGRESSION,
+                status_changes__metadata=bar_metadata,
+            ))
+        self.assertEqual([builds[2]], regressed)
+
+    def test_regressions_and_fixes_are_replaced_on_update(self):
+        foo_metadata, _ = SuiteMetadata.objects.get_or_create(suite=self.suite.slug, name='foo', kind='test')
+        build1 = self.create_build('1', datetime=h(10))
+        test_run1 = build1.test_runs.first()
+        test_run1.tests.create(build=build1, environment=self.environment, metadata=foo_metadata, suite=self.suite, result=True)
+        ProjectStatus.create_or_update(build1)
+
+        build2 = self.create_build('2', datetime=h(9))
+        test_run2 = build2.test_runs.first()
+        test = test_run2.tests.create(build=build2, environment=self.environment, metadata=foo_metadata, suite=self.suite, result=False)
+        status = ProjectStatus.create_or_update(build2)
+        self.assertEqual(1, status.changes.count())
+
+        test.result = True
+        test.save()
+        models.BuildComparison.invalidate(build2.id)
+        status = ProjectStatus.refresh(build2)
+        self.assertEqual(0, status.changes.count())
+        self.assertIsNone(status.regressions)
+
     def test_get_exceeded_thresholds(self):
         build = self.create_build('1')
         testrun = build.test_runs.create(environment=self.environment)
@@ -438,18 +491,52 @@ class ProjectStatusTest(TestCase):
         self.assertEqual(build2.status.baseline, build1)
         self.assertEqual(build3.status.baseline, build1)
 
-    def test_save_malformed_yaml(self):
-        build = self.project.builds.create(version="bad-yaml")
-        build.status.fixes = """!!python/object/apply:collections.OrderedDict
-            - - - env
-            - [suite/test"""
-        with self.assertRaises(ValidationError):
-            build.status.save()
-
-    def test_get_malformed_yaml(self):
-        # For backwards compatibility, records with bad yaml already saved
-        build = self.project.builds.create(version="bad-yaml")
-        build.status.fixes = """!!python/object/apply:collections.OrderedDict
-            - - - env
-            - [suite/test"""
-        self.assertEqual(0, len(build.status.get_fixes()))
+    def assertSameCounters(self, status, expected):
+        fields = [
+            'tests_pass', 'tests_fail', 'tests_xfail', 'tests_skip',
+            'test_runs_total', 'test_runs_completed', 'test_runs_incomplete',
+            'has_metrics', 'metrics_count',
+        ]
+        for field in fields:
+            self.assertEqual(getattr(expected, field), getattr(status, field), field)
+        self.assertAlmostEqual(expected.metrics_summary, status.metrics_summary)
+
+    def test_incremental_update_matches_full_recompute(self):
+        build = self.create_build('1', create_test_run=False)
+        self.receive_testrun(build.version, self.environment.slug, tests_file='{"a/a": "pass", "a/b": "fail"}', metrics_file='{"a/m": 2}')
+        self.receive_testrun(build.version, self.environment.slug, tests_file='{"b/a": "skip"}', metrics_file='{"b/m": [4, 8]}', log_file='log', metadata_file='{"job_id": "2"}')
+        self.receive_testrun(build.version, self.environment_a.slug, tests_file='{"c/a": "pass"}', completed=False)
+
+        status = ProjectStatus.objects.get(build=build)
+        self.assertEqual(3, status.test_runs_total)
+        self.assertEqual(2, status.tests_pass)
+        self.assertEqual(2, status.metrics_count)
+
+        ProjectStatus.create_or_update(build)
+        self.assertSameCounters(status, ProjectStatus.objects.get(build=build))
+
+    def test_refresh_does_not_recompute_counters(self):
+        build = self.create_build('1', create_test_run=False)
+        self.receive_testrun(build.version, self.environment.slug, tests_file='{"a/a": "pass"}')
+        ProjectStatus.objects.filter(build=build).update(tests_pass=10)
+
+        status = ProjectStatus.refresh(build)
+        self.assertEqual(10, status.tests_pass)
+
+    def test_refresh_recomputes_invalidated_status(self):
+        build = self.create_build('1', create_test_run=False)
+        self.receive_testrun(build.version, self.environment.slug, tests_file='{"a/a": "pass"}')
+        ProjectStatus.objects.filter(build=build).update(tests_pass=10)
+        ProjectStatus.invalidate(build.id)
+
+        status = ProjectStatus.refresh(build)
+        self.assertEqual(1, status.tests_pass)
+        self.assertEqual(0, status.metrics_count)
+
+    def test_deleting_testrun_invalidates_status(self):
+        build = self.create_build('1', create_test_run=False)
+        testrun, _ = self.receive_testrun(build.version, self.environment.slug, tests_file='{"a/a": "pass"}')
+        testrun.delete()
+
+        self.assertIsNone(ProjectStatus.objects.get(build=build).metrics_count)
+        self.assertEqual(0, ProjectStatus.refresh(build).tests_pass)
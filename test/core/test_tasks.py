@@ -1,16 +1,19 @@
 import datetime
+import io
 import json
 import re
 import yaml
 
 
 from dateutil.relativedelta import relativedelta
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from unittest.mock import patch
 
 
-from squad.core.models import Group, TestRun, Status, Build, ProjectStatus, SuiteVersion, PatchSource, KnownIssue, EmailTemplate, Callback
+from squad.core.models import Group, TestRun, Status, Build, BuildSummary, ProjectStatus, SuiteVersion, PatchSource, KnownIssue, EmailTemplate, Callback, SuiteMetadata
 from squad.core.tasks import ParseTestRunData
 from squad.core.tasks import PostProcessTestRun
 from squad.core.tasks import RecordTestRunStatus
@@ -24,6 +27,8 @@ from squad.core.tasks import exceptions
 from squad.core.tasks import cleanup_old_builds
 from squad.core.tasks import cleanup_build
 from squad.core.tasks import prepare_report
+from squad.core.tasks import process_test_run
+from squad.core.tasks import requeue_stale_test_runs
 from squad.core.tasks import update_delayed_report
 
 
@@ -336,6 +341,39 @@ class ParseTestRunDataTest(CommonTestCase):
         self.assertEqual(4, testrun.tests.count())
         self.assertEqual(2, testrun.metrics.count())
 
+    def test_reuses_existing_suites_and_metadata(self):
+        suite = self.build.project.suites.create(slug='foobar')
+        metadata = SuiteMetadata.objects.create(kind='test', suite='foobar', name='test1')
+
+        ParseTestRunData()(self.testrun)
+
+        test = self.testrun.tests.get(metadata__suite='foobar', metadata__name='test1')
+        self.assertEqual(suite, test.suite)
+        self.assertEqual(metadata, test.metadata)
+        self.assertEqual(1, self.build.project.suites.filter(slug='foobar').count())
+
+    def test_links_known_issues(self):
+        issue = KnownIssue.objects.create(title='foo fails', test_name='foobar/*')
+        issue.environments.add(self.environment)
+
+        ParseTestRunData()(self.testrun)
+
+        test = self.testrun.tests.get(metadata__suite='foobar', metadata__name='test1')
+        self.assertTrue(test.has_known_issues)
+        self.assertEqual([issue], list(test.known_issues.all()))
+        self.assertFalse(self.testrun.tests.get(metadata__name='test0').has_known_issues)
+
+    def test_number_of_queries_does_not_depend_on_number_of_tests(self):
+        testrun = TestRun.objects.create(build=self.build, environment=self.environment)
+        tests = {'suite%d/test%d' % (i % 3, i): 'pass' for i in range(500)}
+        testrun.save_tests_file(json.dumps(tests))
+
+        with CaptureQueriesContext(connection) as queries:
+            ParseTestRunData()(testrun)
+
+        self.assertEqual(500, testrun.tests.count())
+        self.assertLess(len(queries), 50)
+
 
 class ProcessAllTestRunsTest(CommonTestCase):
 
@@ -440,6 +478,30 @@ class RecordTestRunStatusTest(CommonTestCase):
         self.assertEqual(1, SuiteVersion.objects.filter(version='5', suite__slug='special').count())
         self.assertIsNotNone(self.testrun.status.by_suite().first().suite_version)
 
+    def test_adds_testrun_to_summaries(self):
+        ParseTestRunData()(self.testrun)
+        RecordTestRunStatus()(self.testrun)
+
+        self.assertTrue(self.testrun.status_summarized)
+        status = ProjectStatus.objects.get(build=self.build)
+        self.assertEqual(3, status.tests_pass)
+        self.assertEqual(1, status.tests_fail)
+        self.assertEqual(1, status.test_runs_total)
+        self.assertEqual(3, status.metrics_count)
+        summary = BuildSummary.objects.get(build=self.build, environment=self.environment)
+        self.assertEqual(5, summary.tests_total)
+
+    def test_recording_again_invalidates_summaries(self):
+        ParseTestRunData()(self.testrun)
+        RecordTestRunStatus()(self.testrun)
+
+        self.testrun.status.all().delete()
+        self.testrun.status_recorded = False
+        RecordTestRunStatus()(self.testrun)
+
+        self.assertIsNone(ProjectStatus.objects.get(build=self.build).metrics_count)
+        self.assertIsNone(BuildSummary.objects.get(build=self.build).metrics_count)
+
 
 class UpdateProjectStatusTest(CommonTestCase):
 
@@ -520,6 +582,13 @@ class ReceiveTestRunTest(TestCase):
         self.assertEqual(metadata['resubmit_url'], testrun.resubmit_url)
         self.assertEqual(metadata['build_url'], testrun.build_url)
 
+    def test_duplicate_tests_last_value_wins(self):
+        receive = ReceiveTestRun(self.project)
+        testrun, _ = receive('199', 'myenv', tests_file='{"foo/bar": "pass", "foo/baz": "pass", "foo/bar": "fail"}')
+
+        self.assertEqual(2, testrun.tests.count())
+        self.assertFalse(testrun.tests.get(metadata__name='bar').result)
+
     def test_metadata_non_string_values(self):
         receive = ReceiveTestRun(self.project)
         metadata_in = {
@@ -622,6 +691,127 @@ class ReceiveTestRunTest(TestCase):
         receive('199', 'myenv')
         UpdateProjectStatus.assert_not_called()
 
+    @patch('squad.core.models.TestRun.open_metrics_file')
+    @patch('squad.core.models.TestRun.open_tests_file')
+    def test_receive_parsed(self, open_tests_file, open_metrics_file):
+        receive = ReceiveTestRun(self.project)
+        metadata = {"job_id": '999', "foo": "bar"}
+        tests = {"suite1/test1": "pass", "suite1/test2": {"result": "fail", "log": "failed"}}
+        metrics = {"suite1/metric1": {"value": 1.5, "unit": "s"}, "suite2/metric2": [1, 3]}
+
+        testrun, _ = receive.receive_parsed('199', 'myenv', metadata=metadata, tests=tests, metrics=metrics, log_file='log')
+
+        open_tests_file.assert_not_called()
+        open_metrics_file.assert_not_called()
+
+        testrun = TestRun.objects.get(pk=testrun.pk)
+        self.assertEqual('999', testrun.job_id)
+        self.assertEqual(metadata, testrun.metadata)
+        self.assertEqual(tests, json.loads(testrun.tests_file))
+        self.assertEqual(metrics, json.loads(testrun.metrics_file))
+        self.assertEqual('log', testrun.log_file)
+        self.assertTrue(testrun.data_processed)
+
+        results = {t.full_name: (t.result, t.log) for t in testrun.tests.all()}
+        self.assertEqual({'suite1/test1': (True, None), 'suite1/test2': (False, 'failed')}, results)
+        metric_results = {m.full_name: (m.result, m.unit) for m in testrun.metrics.all()}
+        self.assertEqual({'suite1/metric1': (1.5, 's'), 'suite2/metric2': (2.0, None)}, metric_results)
+        self.assertEqual(1, testrun.status.filter(suite=None).get().tests_fail)
+
+    def test_receive_parsed_validates_data(self):
+        receive = ReceiveTestRun(self.project)
+        with self.assertRaises(exceptions.InvalidMetadata):
+            receive.receive_parsed('199', 'myenv', metadata={"job_id": "foo/bar"})
+        with self.assertRaises(exceptions.InvalidMetricsData):
+            receive.receive_parsed('199', 'myenv', metrics={"foo": {"value": "bar"}})
+        with self.assertRaises(exceptions.InvalidTestsData):
+            receive.receive_parsed('199', 'myenv', tests=["foo"])
+        self.assertFalse(TestRun.objects.exists())
+
+    def test_receive_asynchronously(self):
+        self.project.environments.create(slug='myenv', expected_test_runs=1)
+        receive = ReceiveTestRun(self.project)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            testrun, build = receive('199', 'myenv', tests_file='{"suite1/test1": "pass"}', asynchronous=True)
+
+        self.assertEqual(TestRun.QUEUED, testrun.processing_status)
+        self.assertFalse(testrun.tests.exists())
+        self.assertFalse(build.finished[0])
+
+        callbacks[0]()
+        testrun.refresh_from_db()
+        self.assertEqual(TestRun.PROCESSED, testrun.processing_status)
+        self.assertEqual(1, testrun.tests.count())
+        self.assertTrue(testrun.status_recorded)
+        self.assertTrue(build.finished[0])
+        self.assertEqual(1, ProjectStatus.objects.get(build=build).tests_pass)
+
+    def test_receive_asynchronously_invalid_data(self):
+        receive = ReceiveTestRun(self.project)
+        with self.captureOnCommitCallbacks(execute=True):
+            testrun, _ = receive('199', 'myenv', tests_file='{', asynchronous=True)
+
+        testrun.refresh_from_db()
+        self.assertEqual(TestRun.FAILED, testrun.processing_status)
+        self.assertIn('tests is not valid JSON', testrun.processing_error)
+        self.assertFalse(testrun.data_processed)
+
+        # a failed test run counts as received, so the build is finished
+        self.assertTrue(testrun.build.finished[0])
+        self.assertTrue(ProjectStatus.objects.get(build=testrun.build).finished)
+
+        # processed only once
+        process_test_run(testrun.id)
+        testrun.refresh_from_db()
+        self.assertEqual(TestRun.FAILED, testrun.processing_status)
+
+    def test_process_test_run_claimed_by_another_worker(self):
+        receive = ReceiveTestRun(self.project)
+        with self.captureOnCommitCallbacks():
+            testrun, _ = receive('199', 'myenv', tests_file='{"suite1/test1": "pass"}', asynchronous=True)
+
+        atomic = transaction.atomic
+
+        def requeued_and_claimed_again(*args, **kwargs):
+            TestRun.objects.filter(pk=testrun.pk).update(processing_updated_at=timezone.now())
+            return atomic(*args, **kwargs)
+
+        with patch('squad.core.tasks.transaction.atomic', side_effect=requeued_and_claimed_again):
+            process_test_run(testrun.id)
+
+        testrun.refresh_from_db()
+        self.assertEqual(TestRun.PROCESSING, testrun.processing_status)
+        self.assertFalse(testrun.tests.exists())
+
+    def test_requeue_stale_test_runs(self):
+        receive = ReceiveTestRun(self.project)
+        with self.captureOnCommitCallbacks():
+            # lost before being processed
+            lost, _ = receive('199', 'myenv', tests_file='{"suite1/test1": "pass"}', asynchronous=True)
+            # being processed by a worker that died
+            dead, _ = receive('199', 'myenv', tests_file='{"suite1/test2": "pass"}', asynchronous=True)
+            # still queued, but recently
+            recent, _ = receive('199', 'myenv', tests_file='{"suite1/test3": "pass"}', asynchronous=True)
+
+        long_ago = timezone.now() - timezone.timedelta(hours=2)
+        TestRun.objects.filter(pk=lost.pk).update(processing_updated_at=long_ago)
+        TestRun.objects.filter(pk=dead.pk).update(processing_status=TestRun.PROCESSING, processing_updated_at=long_ago)
+
+        requeue_stale_test_runs()
+        for testrun in (lost, dead, recent):
+            testrun.refresh_from_db()
+        self.assertEqual(TestRun.PROCESSED, lost.processing_status)
+        self.assertEqual(TestRun.PROCESSED, dead.processing_status)
+        self.assertEqual(1, dead.tests.count())
+        self.assertEqual(TestRun.QUEUED, recent.processing_status)
+
+    def test_receive_asynchronously_validates_metadata(self):
+        receive = ReceiveTestRun(self.project)
+        with self.assertRaises(exceptions.InvalidMetadata):
+            receive('199', 'myenv', metadata_file='{"job_id": "foo/bar"}', asynchronous=True)
+        self.assertFalse(TestRun.objects.exists())
+
 
 class TestValidateTestRun(TestCase):
 
@@ -660,6 +850,10 @@ class TestValidateTestRun(TestCase):
     def test_invalid_metrics_str_as_values(self):
         self.assertInvalidMetrics('{ "foo" : {"value": "bar", "unit": ""}}')
 
+    def test_invalid_metrics_file_object(self):
+        self.assertInvalidMetrics(io.BytesIO(b'{"foo": {"value": "bar"}}'))
+        self.assertInvalidMetrics(io.BytesIO(b'{"foo": '), exceptions.InvalidMetricsDataJSON)
+
     def test_invalid_metrics_list_of_str_as_values(self):
         self.assertInvalidMetrics('{ "foo" : {"value": ["bar"], "unit": ""}}')
 
@@ -682,6 +876,22 @@ class TestValidateTestRun(TestCase):
     def test_invalid_tests_type(self):
         self.assertInvalidTests('[]')
 
+    def test_valid_tests_duplicate_keys(self):
+        ValidateTestRun()(tests_file='{"foo/bar": "pass", "foo/bar": "fail"}')
+
+    def test_invalid_metrics_utf8(self):
+        self.assertInvalidMetrics(io.BytesIO(b'{"foo": "\xff"}'))
+
+    def test_invalid_tests_utf8(self):
+        self.assertInvalidTests(io.BytesIO(b'{"foo": "\xff"}'))
+
+    def test_invalid_tests_file_object(self):
+        self.assertInvalidTests(io.BytesIO(b'[]'))
+        self.assertInvalidTests(io.BytesIO(b'{"foo": "pass",'), exceptions.InvalidTestsDataJSON)
+
+    def test_valid_tests_file_object(self):
+        ValidateTestRun()(tests_file=io.BytesIO(b'{"foo": "pass"}'))
+
 
 class CreateBuildTest(TestCase):
 
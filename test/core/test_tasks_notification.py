@@ -8,6 +8,7 @@ from django.utils import timezone
 
 
 from squad.core.models import Group, ProjectStatus, PatchSource, DelayedReport
+from squad.core.plugins import Plugin
 from squad.core.tasks.notification import maybe_notify_project_status
 from squad.core.tasks.notification import notify_project_status
 from squad.core.tasks.notification import notification_timeout
@@ -289,7 +290,8 @@ class TestPatchNotificationTasks(TestCase):
             patch_id='0123456789',
         )
 
-        plugin = MagicMock()
+        plugin = Plugin()
+        plugin.notify_patch_build_created = MagicMock()
         get_implementation.return_value = plugin
 
         notify_patch_build_created(build.id)
@@ -303,7 +305,8 @@ class TestPatchNotificationTasks(TestCase):
             patch_id='0123456789',
         )
 
-        plugin = MagicMock()
+        plugin = Plugin()
+        plugin.notify_patch_build_finished = MagicMock()
         get_implementation.return_value = plugin
 
         notify_patch_build_finished(build.id)
@@ -3,7 +3,7 @@ from django.test import TestCase
 from django.utils import timezone
 
 from unittest.mock import patch
-from squad.core.models import Group, Test, Suite, SuiteMetadata
+from squad.core.models import Group, Test, TestResultHistory, Suite, SuiteMetadata
 
 
 def create_test(**kwargs):
@@ -106,6 +106,7 @@ class TestFailureHistoryTest(TestCase):
         test_run = build.test_runs.create(environment=environment)
         metadata, _ = SuiteMetadata.objects.get_or_create(suite=self.suite.slug, name=test, kind='test')
         test = test_run.tests.create(suite=self.suite, result=result, metadata=metadata, build=test_run.build, environment=test_run.environment)
+        TestResultHistory.add_testrun(test_run)
 
         self.date = self.date + relativedelta(days=1)
         return test
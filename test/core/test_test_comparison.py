@@ -5,7 +5,7 @@ from django.test import TestCase
 
 
 from squad.core import models
-from squad.core.comparison import TestComparison
+from squad.core.comparison import TestComparison, PaginatedTestComparison
 from squad.core.tasks import ReceiveTestRun
 
 
@@ -294,3 +294,127 @@ class TestComparisonTest(TestCase):
         self.assertEqual({'envA', 'envB'}, comparison.all_environments)
         self.assertEqual(2, len(comparison.results))
         self.assertEqual(None, comparison.results['testB'].get((buildB, 'envB')))
+
+    def test_results_with_duplicates(self):
+        comparison = compare(self.build1, self.build3)
+        self.assertEqual(['pass', 66.66666666666666], comparison.results['a'][self.build3, 'myenv'])
+        self.assertEqual(['fail', 66.66666666666666], comparison.results['b'][self.build3, 'myenv'])
+
+    def test_number_of_queries_does_not_depend_on_duplicates(self):
+        for i in range(10):
+            self.receive_test_run(self.project3, '2', 'myenv', {'a': 'fail', 'b': 'fail'})
+
+        with self.assertNumQueries(4):
+            comparison = compare(self.build1, self.build3)
+        self.assertEqual(['fail', 84.61538461538461], comparison.results['a'][self.build3, 'myenv'])
+
+    def test_regressions_and_fixes_are_cached(self):
+        comparison = TestComparison(self.build1, self.build2, regressions_and_fixes_only=True)
+        self.assertTrue(models.BuildComparison.objects.filter(baseline=self.build1, target=self.build2, kind='tests').exists())
+
+        with self.assertNumQueries(1):
+            cached = TestComparison(self.build1, self.build2, regressions_and_fixes_only=True)
+        self.assertEqual(comparison.regressions, cached.regressions)
+        self.assertEqual(comparison.fixes, cached.fixes)
+        self.assertEqual(comparison.diff, cached.diff)
+        self.assertEqual(['myenv', 'otherenv'], cached.environments[self.build2])
+        self.assertEqual('fail', cached.results['a'][self.build2, 'myenv'])
+        self.assertEqual('pass', cached.results['a'][self.build1, 'myenv'])
+
+    def test_cached_comparison_invalidated_by_new_test_run(self):
+        TestComparison(self.build1, self.build2, regressions_and_fixes_only=True)
+        self.receive_test_run(self.project2, '1', 'myenv', {'d/e': 'fail'})
+        self.assertFalse(models.BuildComparison.objects.filter(target=self.build2).exists())
+
+        comparison = TestComparison(self.build1, self.build2, regressions_and_fixes_only=True)
+        self.assertEqual(['a', 'd/e'], sorted(comparison.regressions['myenv']))
+
+    def test_cached_comparison_invalidated_by_test_run_deletion(self):
+        TestComparison(self.build1, self.build2, regressions_and_fixes_only=True)
+        self.build1.test_runs.first().delete()
+        self.assertFalse(models.BuildComparison.objects.filter(baseline=self.build1).exists())
+
+    def test_cached_comparison_invalidated_again_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            models.BuildComparison.invalidate(self.build2.id)
+            # e.g. computed concurrently, before the new test run was committed
+            TestComparison(self.build1, self.build2, regressions_and_fixes_only=True)
+            self.assertTrue(models.BuildComparison.objects.filter(target=self.build2).exists())
+        self.assertFalse(models.BuildComparison.objects.filter(target=self.build2).exists())
+
+    def test_cached_comparison_invalidated_by_known_issues_of_its_projects(self):
+        TestComparison(self.build1, self.build2, regressions_and_fixes_only=True)
+        issue = models.KnownIssue.objects.create(title='foo', test_name='a')
+
+        issue.environments.add(self.project3.environments.first())
+        self.assertTrue(models.BuildComparison.objects.filter(target=self.build2).exists())
+
+        issue.environments.add(self.project2.environments.first())
+        self.assertFalse(models.BuildComparison.objects.filter(target=self.build2).exists())
+
+        TestComparison(self.build1, self.build2, regressions_and_fixes_only=True)
+        issue.environments.clear()
+        self.assertFalse(models.BuildComparison.objects.filter(target=self.build2).exists())
+
+
+class PaginatedTestComparisonTest(TestCase):
+
+    def receive_test_run(self, project, version, env, tests):
+        receive = ReceiveTestRun(project, update_project_status=False)
+        receive(version, env, tests_file=json.dumps(tests))
+
+    def setUp(self):
+        group = models.Group.objects.create(slug='mygroup')
+        self.project = group.projects.create(slug='myproject')
+
+        self.receive_test_run(self.project, 'buildA', 'envA', {'testA': 'pass', 'testB': 'pass', 'testC': 'pass'})
+        self.receive_test_run(self.project, 'buildA', 'envB', {'testA': 'fail', 'testB': 'skip', 'testC': 'pass'})
+        self.receive_test_run(self.project, 'buildA', 'envC', {'testA': 'xfail', 'testB': 'xfail', 'testC': 'pass'})
+
+        self.receive_test_run(self.project, 'buildB', 'envA', {'testA': 'fail', 'testB': 'skip', 'testC': 'pass'})
+        self.receive_test_run(self.project, 'buildB', 'envB', {'testA': 'pass', 'testC': 'pass'})
+        self.receive_test_run(self.project, 'buildB', 'envC', {'testA': 'xfail', 'testB': 'xfail', 'testC': 'pass'})
+        self.receive_test_run(self.project, 'buildB', 'envC', {'testA': 'pass', 'testB': 'xfail', 'testC': 'fail'})
+
+        self.buildA = self.project.builds.get(version='buildA')
+        self.buildB = self.project.builds.get(version='buildB')
+
+    def test_without_transitions(self):
+        comparison = PaginatedTestComparison(self.buildA, self.buildB)
+        self.assertEqual(['envA', 'envB', 'envC'], comparison.environments[self.buildB])
+        self.assertEqual(['testA', 'testB', 'testC'], [name for name, _ in comparison.results])
+
+        results = dict(comparison.results)
+        self.assertEqual('pass', results['testA'][self.buildA, 'envA'])
+        self.assertEqual(['fail', 50.0], results['testC'][self.buildB, 'envC'])
+        self.assertEqual(['skip', 100.0], results['testB'][self.buildB, 'envC'])
+
+    def test_apply_transitions(self):
+        comparison = PaginatedTestComparison(self.buildA, self.buildB, transitions=[('fail', 'pass'), ('skip', 'n/a')])
+        self.assertEqual({'envB'}, comparison.all_environments)
+        self.assertEqual(['envB'], comparison.environments[self.buildA])
+        self.assertEqual(['testA', 'testB'], [name for name, _ in comparison.results])
+        self.assertIsNone(dict(comparison.results)['testB'].get((self.buildB, 'envB')))
+
+    def test_duplicates_tie(self):
+        # fail wins ties, then pass; see test_confidence
+        comparison = PaginatedTestComparison(self.buildA, self.buildB, transitions=[('pass', 'fail'), ('skip', 'pass')])
+        self.assertEqual({'envA', 'envC'}, comparison.all_environments)
+        self.assertEqual(['testA', 'testC'], [name for name, _ in comparison.results])
+        results = dict(comparison.results)
+        self.assertEqual(['pass', 50.0], results['testA'][self.buildB, 'envC'])
+        self.assertEqual(['fail', 50.0], results['testC'][self.buildB, 'envC'])
+
+    def test_no_changes(self):
+        comparison = PaginatedTestComparison(self.buildA, self.buildB, transitions=[('n/a', 'pass')])
+        self.assertEqual(0, len(comparison.results))
+        self.assertEqual(set(), comparison.all_environments)
+
+    def test_pagination(self):
+        comparison = PaginatedTestComparison(self.buildA, self.buildB, page=2, per_page=2)
+        self.assertEqual(2, comparison.paginator.num_pages)
+        self.assertEqual(['testC'], [name for name, _ in comparison.results])
+
+    def test_number_of_queries(self):
+        with self.assertNumQueries(4):
+            PaginatedTestComparison(self.buildA, self.buildB, transitions=[('pass', 'fail')])
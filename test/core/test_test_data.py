@@ -1,6 +1,8 @@
+import io
+import json
 from unittest import TestCase
 
-from squad.core.data import JSONTestDataParser
+from squad.core.data import JSONTestDataParser, NotAJSONObject, iterate_json_object
 
 
 TEST_DATA = """
@@ -57,3 +59,62 @@ class JSONTestDataParserTest(TestCase):
         test1 = [t for t in data if t['test_name'] == 'mytest1'][0]
         self.assertEqual('/', test1['group_name'])
         self.assertEqual("mytest1", test1['test_name'])
+
+    def test_iterate_file(self):
+        data = list(json_parser.iterate(io.BytesIO(TEST_DATA.encode())))
+        self.assertEqual(json_parser(TEST_DATA), data)
+
+
+class IterateJSONObjectTest(TestCase):
+
+    DATA = {
+        "foo/bar": "pass",
+        "foo/baz": {"result": "fail", "log": "x" * 1000},
+        "ünïcödé": [1, 2.5, None, True],
+        "number": 1234567890,
+    }
+
+    def test_string(self):
+        self.assertEqual(list(self.DATA.items()), list(iterate_json_object(json.dumps(self.DATA))))
+
+    def test_binary_file_in_small_chunks(self):
+        data = io.BytesIO(json.dumps(self.DATA, ensure_ascii=False).encode())
+        self.assertEqual(list(self.DATA.items()), list(iterate_json_object(data, chunk_size=3)))
+
+    def test_text_file_in_small_chunks(self):
+        data = io.StringIO(json.dumps(self.DATA, indent=4))
+        self.assertEqual(list(self.DATA.items()), list(iterate_json_object(data, chunk_size=1)))
+
+    def test_empty(self):
+        self.assertEqual([], list(iterate_json_object(None)))
+        self.assertEqual([], list(iterate_json_object('')))
+        self.assertEqual([], list(iterate_json_object(' {} ')))
+
+    def test_not_an_object(self):
+        with self.assertRaises(NotAJSONObject) as context:
+            list(iterate_json_object('[1, 2]'))
+        self.assertEqual([1, 2], context.exception.obj)
+
+    def test_invalid_json(self):
+        for data in ['{', '{"a": 1,}', '{"a" 1}', '{"a": 1 "b": 2}', '{1: 2}', '{"a": 1} []']:
+            with self.assertRaises(json.JSONDecodeError):
+                list(iterate_json_object(io.StringIO(data), chunk_size=2))
+
+    def test_duplicate_keys_last_value_wins(self):
+        data = '{"a": 1, "b": 2, "a": 3}'
+        self.assertEqual([('b', 2), ('a', 3)], list(iterate_json_object(data)))
+        self.assertEqual([('b', 2), ('a', 3)], list(iterate_json_object(io.BytesIO(data.encode()), chunk_size=2)))
+        self.assertEqual(json.loads(data), dict(iterate_json_object(data)))
+
+    def test_file_read_from_its_initial_position(self):
+        data = io.BytesIO(b'xx{"a": 1}')
+        data.seek(2)
+        self.assertEqual([('a', 1)], list(iterate_json_object(data)))
+
+    def test_invalid_input_reported_before_any_pair(self):
+        pairs = iterate_json_object('{"a": 1, "b": }')
+        with self.assertRaises(json.JSONDecodeError):
+            next(pairs)
+
+    def test_not_an_object_message(self):
+        self.assertEqual('[1, 2] is not an object', str(NotAJSONObject([1, 2])))
@@ -0,0 +1,107 @@
+import json
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from squad.core.models import Group, KnownIssue, SuiteMetadata, TestResultHistory
+from squad.core.tasks import ReceiveTestRun, RecordTestRunStatus
+
+
+class TestResultHistoryTest(TestCase):
+
+    def setUp(self):
+        group = Group.objects.create(slug='mygroup')
+        self.project = group.projects.create(slug='myproject')
+        self.receive_testrun = ReceiveTestRun(self.project, update_project_status=False)
+
+    def receive(self, version, env, tests):
+        testrun, _ = self.receive_testrun(version, env, tests_file=json.dumps(tests))
+        return testrun
+
+    def history(self, test_name, env='myenv'):
+        suite, name = test_name.split('/')
+        metadata = SuiteMetadata.objects.get(suite=suite, name=name, kind='test')
+        return TestResultHistory.objects.get(
+            metadata=metadata,
+            environment__slug=env,
+        )
+
+    def test_appended_on_ingestion(self):
+        t1 = self.receive('1', 'myenv', {'a/pass': 'pass', 'a/fail': 'fail', 'a/skip': 'skip'})
+        t2 = self.receive('2', 'myenv', {'a/pass': 'fail'})
+        t3 = self.receive('2', 'myenv', {'a/pass': 'pass'})
+
+        self.assertEqual('%dp%df%dp' % (t1.build_id, t2.build_id, t3.build_id), self.history('a/pass').entries)
+        self.assertEqual({t1.build_id: [True], t2.build_id: [False, True]}, self.history('a/pass').results)
+        self.assertEqual({t1.build_id: [None]}, self.history('a/skip').results)
+        self.assertEqual({t1.build_id: ['f']}, self.history('a/fail').codes)
+
+    def test_per_environment(self):
+        self.receive('1', 'myenv', {'a/b': 'pass'})
+        t2 = self.receive('1', 'otherenv', {'a/b': 'fail'})
+        self.assertEqual({t2.build_id: [False]}, self.history('a/b', 'otherenv').results)
+
+    def test_xfail(self):
+        env = self.project.environments.create(slug='myenv')
+        known_issue = KnownIssue.objects.create(title='foo', test_name='a/b')
+        known_issue.environments.add(env)
+
+        t1 = self.receive('1', 'myenv', {'a/b': 'fail'})
+        self.assertEqual('%dx' % t1.build_id, self.history('a/b').entries)
+        self.assertEqual({t1.build_id: [False]}, self.history('a/b').results)
+
+    def test_recording_again_rebuilds_history(self):
+        t1 = self.receive('1', 'myenv', {'a/b': 'pass'})
+        t2 = self.receive('2', 'myenv', {'a/b': 'pass'})
+
+        t2.tests.update(result=False)
+        t2.status.all().delete()
+        t2.status_recorded = False
+        RecordTestRunStatus()(t2)
+
+        self.assertEqual('%dp%df' % (t1.build_id, t2.build_id), self.history('a/b').entries)
+
+    def test_compute_test_history(self):
+        t1 = self.receive('1', 'myenv', {'a/b': 'pass'})
+        t2 = self.receive('2', 'myenv', {'a/b': 'fail'})
+        TestResultHistory.objects.all().delete()
+
+        call_command('compute_test_history', '--project=mygroup/myproject')
+        self.assertEqual('%dp%df' % (t1.build_id, t2.build_id), self.history('a/b').entries)
+
+    def test_compute_test_history_keeps_latest_builds(self):
+        self.project.build_confidence_count = 1
+        self.project.save()
+        testruns = [self.receive(str(i), 'myenv', {'a/b': 'pass'}) for i in range(4)]
+        TestResultHistory.objects.all().delete()
+
+        with patch.object(TestResultHistory, 'MAX_BUILDS', 2):
+            call_command('compute_test_history', '--project=mygroup/myproject')
+
+        self.assertEqual(
+            {testruns[2].build_id: [True], testruns[3].build_id: [True]},
+            self.history('a/b').results,
+        )
+
+    def test_trimmed_to_latest_builds(self):
+        self.project.build_confidence_count = 3
+        self.project.save()
+        testruns = [self.receive(str(i), 'myenv', {'a/b': 'pass'}) for i in range(5)]
+
+        with patch.object(TestResultHistory, 'MAX_BUILDS', 2), patch.object(TestResultHistory, 'TRIM_LENGTH', 1):
+            testrun = self.receive('5', 'myenv', {'a/b': 'fail'})
+
+        self.assertEqual(
+            {testruns[3].build_id: [True], testruns[4].build_id: [True], testrun.build_id: [False]},
+            self.history('a/b').results,
+        )
+
+    def test_deleted_test_run_removed(self):
+        t1 = self.receive('1', 'myenv', {'a/b': 'pass'})
+        t2 = self.receive('2', 'myenv', {'a/b': 'fail', 'a/c': 'pass'})
+        t3 = self.receive('2', 'myenv', {'a/b': 'pass'})
+
+        t2.delete()
+        self.assertEqual({t1.build_id: [True], t3.build_id: [True]}, self.history('a/b').results)
+        self.assertEqual({}, self.history('a/c').results)
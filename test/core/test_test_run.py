@@ -1,4 +1,5 @@
 import os
+from django.core.files.base import ContentFile
 from django.test import TestCase
 from squad.core.models import Group, TestRun
 
@@ -48,6 +49,26 @@ class TestRunTest(TestCase):
         self.assertEqual(metrics_file_content, testrun.metrics_file_storage.read().decode())
         self.assertEqual(log_file_content, testrun.log_file_storage.read().decode())
 
+    def test_save_log_file_from_file(self):
+        testrun = TestRun.objects.create(build=self.build, environment=self.env)
+        testrun.save_log_file(ContentFile(b'log file content'))
+        self.assertEqual('log file content', testrun.log_file)
+
+    def test_open_tests_and_metrics_files(self):
+        testrun = TestRun.objects.create(build=self.build, environment=self.env)
+        with testrun.open_tests_file() as f:
+            self.assertEqual('', f.read())
+
+        testrun.save_tests_file('{"foo": "pass"}')
+        testrun.save_metrics_file('{"bar": 1}')
+        with testrun.open_tests_file() as f:
+            self.assertEqual(b'{"foo": "pass"}', f.read())
+        with testrun.open_metrics_file() as f:
+            self.assertEqual(b'{"bar": 1}', f.read())
+
+        # does not interfere with reading the files contents
+        self.assertEqual('{"foo": "pass"}', testrun.tests_file)
+
     def test_delete_storage_fields_on_model_deletion(self):
         tests_file_content = 'tests file content'
         metrics_file_content = 'metrics file content'
@@ -1,5 +1,7 @@
+from io import BytesIO
+
 from django.test import TestCase
-from squad.core.utils import join_name, parse_name, encrypt, decrypt, split_dict, split_list
+from squad.core.utils import join_name, parse_name, encrypt, decrypt, split_dict, split_list, NulStrippingFile
 
 
 class TestParseName(TestCase):
@@ -95,3 +97,14 @@ class TestSplitList(TestCase):
         self.assertEqual([3, 4], chunks[1])
         self.assertEqual([5, 6], chunks[2])
         self.assertEqual([7], chunks[3])
+
+
+class TestNulStrippingFile(TestCase):
+
+    def test_chunks(self):
+        f = NulStrippingFile(BytesIO(b'ab\x00cd' + b'\x00' * 10 + b'ef'))
+        self.assertEqual([b'ab', b'cd', b'ef'], list(f.chunks(3)))
+
+    def test_read(self):
+        f = NulStrippingFile(BytesIO(b'\x00a\x00b\x00'))
+        self.assertEqual(b'ab', f.read())
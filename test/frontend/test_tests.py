@@ -4,6 +4,7 @@ from django.test import TestCase
 from django.test import Client
 import json
 
+from squad.frontend.tests import TestResultTable
 from squad.frontend.views import get_user_preferences
 
 tests_file = {
@@ -86,6 +87,21 @@ class AllTestResultsTest(TestCase):
         self.assertTrue("suite2" not in page3)
         self.assertTrue("suite3" in page3)
 
+    def test_pagination_num_pages(self):
+        build = self.test_run.build
+        self.assertEqual(3, TestResultTable.get(build, 1, '').num_pages)
+
+        table = TestResultTable.get(build, 4, '')
+        self.assertEqual(3, table.num_pages)
+        self.assertEqual(0, len(table))
+
+    def test_cells_computed_on_first_visit(self):
+        models.BuildTestMatrix.invalidate(self.test_run.build_id)
+
+        table = TestResultTable.get(self.test_run.build, 1, '')
+        self.assertEqual(3, table.num_pages)
+        self.assertEqual(50, len(table))
+
     def test_no_metadata(self):
         suite, _ = self.test_run.build.project.suites.get_or_create(slug='a-suite')
         metadata, _ = models.SuiteMetadata.objects.get_or_create(suite=suite.slug, name='no_metadata_test', kind='test')
@@ -2,11 +2,25 @@ from contextlib import contextmanager
 import json
 import os
 import re
+import time
+import tracemalloc
 from django.conf import settings
 from django.db import connection, reset_queries
 
 
 count = {}
+measurements = {}
+
+
+# how much slower (or more memory hungry) a benchmark can get, relative to
+# the previous run, before it is reported as a regression. This is only a
+# warning: timings from a local previous run are too noisy to fail the test
+# suite on, so only the query budgets are gates.
+BENCHMARK_THRESHOLD = float(os.getenv('SQUAD_BENCHMARK_THRESHOLD', '0.5'))
+
+# differences below these are considered noise
+BENCHMARK_MIN_TIME = 0.05  # seconds
+BENCHMARK_MIN_MEMORY = 1024 * 1024  # bytes
 
 
 @contextmanager
@@ -26,6 +40,32 @@ def count_queries(k):
     return q
 
 
+@contextmanager
+def benchmark(k):
+    """
+    Like count_queries, but also records wall time and peak (Python) memory
+    usage. Yields a dictionary that has 'queries', 'time' and 'memory' filled
+    in when the block exits.
+    """
+    m = {}
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    elif hasattr(tracemalloc, 'reset_peak'):  # Python >= 3.9
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        with count_queries(k):
+            yield m
+            m['queries'] = len(connection.queries)
+    finally:
+        m['time'] = time.perf_counter() - start
+        m['memory'] = tracemalloc.get_traced_memory()[1]
+        if not tracing:
+            tracemalloc.stop()
+    measurements[k] = m
+
+
 def log_queries(k, queries):
     os.makedirs('tmp/queries', exist_ok=True)
     with open('tmp/queries/%s.log' % re.sub('/', '_', k), 'w') as log:
@@ -34,7 +74,7 @@ def log_queries(k, queries):
             log.write("\n")
 
 
-def export(f='tmp/queries.json'):
+def export(f='tmp/queries.json', b='tmp/benchmarks.json'):
     d = os.path.dirname(f)
     if not os.path.exists(d):
         os.makedirs(d)
@@ -44,9 +84,18 @@ def export(f='tmp/queries.json'):
     if rc == 0:
         with open(f, 'w') as output:
             output.write(json.dumps(count, indent=4))
+    if measurements:
+        export_benchmarks(b)
     return rc
 
 
+def export_benchmarks(f):
+    if os.path.exists(f):
+        diff_benchmarks(f)
+    with open(f, 'w') as output:
+        output.write(json.dumps(measurements, indent=4, sort_keys=True))
+
+
 def diff(previous_file):
     previous = json.loads(open(previous_file).read())
     improvements = []
@@ -69,11 +118,34 @@ def diff(previous_file):
     return 0
 
 
-def list_changes(data, title):
+def diff_benchmarks(previous_file):
+    previous = json.loads(open(previous_file).read())
+    regressions = {'time': [], 'memory': []}
+    minimum = {'time': BENCHMARK_MIN_TIME, 'memory': BENCHMARK_MIN_MEMORY}
+    for k, m in measurements.items():
+        if k not in previous:
+            continue
+        for field in regressions.keys():
+            v0 = previous[k][field]
+            v = m[field]
+            if v - v0 > minimum[field] and v > v0 * (1 + BENCHMARK_THRESHOLD):
+                regressions[field].append((k, v0, v))
+
+    if regressions['time']:
+        list_changes(regressions['time'], 'WALL TIME REGRESSIONS', unit='seconds', fmt='%.3f')
+    if regressions['memory']:
+        list_changes(regressions['memory'], 'PEAK MEMORY REGRESSIONS', unit='bytes')
+    if regressions['time'] or regressions['memory']:
+        print('')
+        print('WARNING: benchmarks got more than %d%% worse than in the previous run (`%s`).' % (BENCHMARK_THRESHOLD * 100, previous_file))
+        print('This does not fail the test suite, but you might want to investigate it.')
+
+
+def list_changes(data, title, unit='number of database queries', fmt='%d'):
     print('')
     print(title)
     print(re.sub('.', '-', title))
-    print('Unit: number of database queries')
+    print('Unit: %s' % unit)
     print('')
     for k, v0, v in data:
-        print("%s: %d -> %d" % (k, v0, v))
+        print(("%s: " + fmt + " -> " + fmt) % (k, v0, v))
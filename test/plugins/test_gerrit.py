@@ -4,6 +4,7 @@ from unittest.mock import patch
 
 
 from squad.core.models import Group, PatchSource
+from squad.core.patch_delivery import ssh_options
 from squad.plugins import gerrit
 
 plugins_settings = """
@@ -58,14 +59,17 @@ class FakeSubprocess():
         def __str__(self):
             return 'Could not establish connection to host'
 
+    class TimeoutExpired(BaseException):
+        pass
+
     @staticmethod
-    def run(cmd, stdout=0, stderr=0):
+    def run(cmd, stdout=0, stderr=0, timeout=None):
         FakeSubprocess.__last_cmd__ = ' '.join(cmd)
         gerrit_cmd = 'gerrit review'
-        options = ' '.join(gerrit.DEFAULT_SSH_OPTIONS)
+        options = ' '.join(gerrit.DEFAULT_SSH_OPTIONS + ssh_options())
         port = gerrit.DEFAULT_SSH_PORT
-        if 'ssh %s -p %s theuser@the.host' % (options, port) != ' '.join(cmd[0:10]) \
-                or not cmd[10].startswith(gerrit_cmd):
+        if 'ssh %s -p %s theuser@the.host' % (options, port) != ' '.join(cmd[0:-1]) \
+                or not cmd[-1].startswith(gerrit_cmd):
             raise FakeSubprocess.CalledProcessError()
 
         obj = FakeObject()
@@ -88,7 +92,7 @@ class FakeRequests():
                 self.password = password
 
     @staticmethod
-    def post(url, auth=None, json=None):
+    def post(url, auth=None, json=None, timeout=None):
         FakeRequests.__last_json__ = json
         result = FakeObject()
         result.status_code = 200
@@ -99,7 +103,7 @@ class FakeRequests():
         return result
 
     @staticmethod
-    def get(url, auth=None, json=None):
+    def get(url, auth=None, json=None, timeout=None):
         FakeRequests.__last_json__ = json
         result = FakeObject()
         result.status_code = 200
@@ -114,6 +118,10 @@ class FakeRequests():
         return FakeRequests.__last_json__
 
 
+def fake_session(patch_source):
+    return FakeRequests
+
+
 class GerritPluginTest(TestCase):
 
     def setUp(self):
@@ -151,41 +159,48 @@ class GerritPluginTest(TestCase):
         self.assertFalse(validation_error)
 
     @patch('squad.plugins.gerrit.requests', FakeRequests)
+    @patch('squad.plugins.gerrit.get_session', fake_session)
     def test_http(self):
         plugin = self.build1.patch_source.get_implementation()
         self.assertTrue(plugin.notify_patch_build_created(self.build1))
 
     @patch('squad.plugins.gerrit.requests', FakeRequests)
+    @patch('squad.plugins.gerrit.get_session', fake_session)
     def test_http_notify_patch_build_created(self):
         plugin = self.build1.patch_source.get_implementation()
         self.assertTrue(plugin.notify_patch_build_created(self.build1))
         self.assertIn('Build created', FakeRequests.given_json()['message'])
 
     @patch('squad.plugins.gerrit.requests', FakeRequests)
+    @patch('squad.plugins.gerrit.get_session', fake_session)
     def test_get_url(self):
         self.build1.patch_source.get_implementation()
         gerrit_url = self.build1.patch_source.get_url(self.build1)
         self.assertEqual(gerrit_url, "https://the.host/c/foo/bar/+/1/1")
 
     @patch('squad.plugins.gerrit.requests', FakeRequests)
+    @patch('squad.plugins.gerrit.get_session', fake_session)
     def test_get_url_ssh(self):
         self.build2.patch_source.get_implementation()
         gerrit_url = self.build2.patch_source.get_url(self.build2)
         self.assertEqual(gerrit_url, None)
 
     @patch('squad.plugins.gerrit.requests', FakeRequests)
+    @patch('squad.plugins.gerrit.get_session', fake_session)
     def test_http_notify_patch_build_finished(self):
         plugin = self.build1.patch_source.get_implementation()
         self.assertTrue(plugin.notify_patch_build_finished(self.build1))
         self.assertIn('Build finished', FakeRequests.given_json()['message'])
 
     @patch('squad.plugins.gerrit.requests', FakeRequests)
+    @patch('squad.plugins.gerrit.get_session', fake_session)
     def test_http_notify_patch_build4_finished(self):
         plugin = self.build4.patch_source.get_implementation()
         self.assertTrue(plugin.notify_patch_build_finished(self.build4))
         self.assertIn('Build finished', FakeRequests.given_json()['message'])
 
     @patch('squad.plugins.gerrit.requests', FakeRequests)
+    @patch('squad.plugins.gerrit.get_session', fake_session)
     def test_http_notify_patch_build_finished_with_failures(self):
         self.build1.status.tests_fail = 1
         self.build1.status.save()
@@ -265,6 +280,7 @@ class GerritPluginTest(TestCase):
         self.assertNotIn('--label custom-code-review=-1', FakeSubprocess.given_cmd())
 
     @patch('squad.plugins.gerrit.requests', FakeRequests)
+    @patch('squad.plugins.gerrit.get_session', fake_session)
     def test_rest_default_labels(self):
         self.build1.status.tests_fail = 1
         self.build1.status.save()
@@ -281,6 +297,7 @@ class GerritPluginTest(TestCase):
         self.assertEqual(None, labels.get('Code-Review'))
 
     @patch('squad.plugins.gerrit.requests', FakeRequests)
+    @patch('squad.plugins.gerrit.get_session', fake_session)
     def test_rest_custom_labels(self):
         self.project.project_settings = plugins_settings
         self.project.save()
@@ -301,3 +318,35 @@ class GerritPluginTest(TestCase):
         labels = FakeRequests.given_json()['labels']
         self.assertEqual('+1', labels.get('My-Custom-Label'))
         self.assertEqual(None, labels.get('Custom-Code-Review'))
+
+    @patch('squad.plugins.gerrit.requests', FakeRequests)
+    @patch('squad.plugins.gerrit.get_session', fake_session)
+    def test_notify_patch_builds(self):
+        self.project.project_settings = plugins_settings
+        self.project.save()
+        self.build1.status.tests_fail = 1
+        self.build1.status.save()
+        build5 = self.project.builds.create(version='5', patch_source=self.http_patch_source, patch_id='1,1')
+
+        plugin = self.build1.patch_source.get_implementation()
+        self.assertTrue(plugin.notify_patch_builds([(build5, 'created'), (self.build1, 'finished')]))
+
+        payload = FakeRequests.given_json()
+        self.assertIn('Build created: 5', payload['message'])
+        self.assertIn('Build finished: 1', payload['message'])
+        self.assertEqual({'Custom-Code-Review': '-1', 'Other-Label': '-2'}, payload['labels'])
+
+    @patch('squad.plugins.gerrit.subprocess', FakeSubprocess)
+    def test_ssh_notify_patch_builds_lowest_vote(self):
+        self.project.project_settings = plugins_settings
+        self.project.save()
+        self.build2.status.tests_fail = 0
+        self.build2.status.save()
+        build5 = self.project.builds.create(version='5', patch_source=self.ssh_patch_source, patch_id='1,1')
+        build5.status.tests_fail = 1
+        build5.status.save()
+
+        plugin = self.build2.patch_source.get_implementation()
+        self.assertTrue(plugin.notify_patch_builds([(self.build2, 'finished'), (build5, 'finished')]))
+        self.assertIn('--label my-custom-label=+1', FakeSubprocess.given_cmd())
+        self.assertIn('--label custom-code-review=-1', FakeSubprocess.given_cmd())
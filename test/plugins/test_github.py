@@ -28,22 +28,25 @@ class GithubPluginTest(TestCase):
 
         self.github = Plugin()
 
-    @patch('squad.plugins.github.requests')
-    def test_github_post(self, requests):
+    @patch('squad.plugins.github.get_session')
+    def test_github_post(self, get_session):
         Plugin.__github_post__(self.build_wrong, '/test/{owner}/{repository}/{commit}', {"a": "b"})
-        requests.post.assert_called_with(
+        get_session.assert_called_with(self.patch_source_wrong)
+        get_session.return_value.post.assert_called_with(
             'https://api.github.com/test/foo/bar/deadbeef',
             headers={'Authorization': 'token 123456789'},
             json={"a": "b"},
+            timeout=30,
         )
 
-    @patch('squad.plugins.github.requests')
-    def test_github_post_wrong_url(self, requests):
+    @patch('squad.plugins.github.get_session')
+    def test_github_post_wrong_url(self, get_session):
         Plugin.__github_post__(self.build, '/test/{owner}/{repository}/{commit}', {"a": "b"})
-        requests.post.assert_called_with(
+        get_session.return_value.post.assert_called_with(
             'https://api.github.com/test/foo/bar/deadbeef',
             headers={'Authorization': 'token 123456789'},
             json={"a": "b"},
+            timeout=30,
         )
 
     @patch('squad.plugins.github.Plugin.__github_post__')
@@ -74,3 +77,24 @@ class GithubPluginTest(TestCase):
         expected_url = "https://api.github.com/repos/foo/bar/commits/deadbeef"
         actual_url = self.github.get_url(self.build)
         self.assertEqual(expected_url, actual_url)
+
+    @patch('squad.plugins.github.get_session')
+    def test_notify_patch_builds(self, get_session):
+        response = get_session.return_value.post.return_value
+        response.status_code = 201
+        response.ok = True
+
+        build = self.project.builds.create(version='3', patch_source=self.patch_source, patch_id='foo/bar/deadbeef')
+        self.assertTrue(self.github.notify_patch_builds([(build, 'created'), (self.build, 'finished')]))
+        self.assertEqual(1, get_session.return_value.post.call_count)
+        self.assertEqual('success', get_session.return_value.post.call_args[1]['json']['state'])
+
+    @patch('squad.plugins.github.get_session')
+    def test_notify_patch_builds_retry(self, get_session):
+        response = get_session.return_value.post.return_value
+        response.status_code = 502
+        response.ok = False
+        self.assertFalse(self.github.notify_patch_builds([(self.build, 'created')]))
+
+        response.status_code = 422
+        self.assertTrue(self.github.notify_patch_builds([(self.build, 'created')]))
@@ -0,0 +1,99 @@
+"""
+Synthetic project data, for benchmarks.
+
+The scale can be set with the SQUAD_BENCHMARK_SCALE environment variable,
+e.g.::
+
+    SQUAD_BENCHMARK_SCALE=builds=20,environments=8,tests=2000 ./manage.py test test.test_benchmarks
+"""
+
+import os
+
+from datetime import timedelta
+
+from django.utils import timezone
+
+from squad.core import models
+from squad.core.tasks import ReceiveTestRun
+
+
+DEFAULT_SCALE = {
+    'builds': 4,
+    'environments': 3,
+    'suites': 4,
+    'tests': 100,  # per suite
+    'metrics': 10,  # per suite
+}
+
+
+def get_scale():
+    scale = dict(DEFAULT_SCALE)
+    for item in os.getenv('SQUAD_BENCHMARK_SCALE', '').split(','):
+        if item:
+            key, value = item.split('=')
+            if key not in scale:
+                raise ValueError('invalid SQUAD_BENCHMARK_SCALE key: %s' % key)
+            scale[key] = int(value)
+    return scale
+
+
+def synthetic_result(build, suite, test):
+    # a few tests flip between builds (so there are regressions and fixes),
+    # some are always failing, some are skipped
+    if test % 10 == 3:
+        return 'fail'
+    if test % 17 == 0:
+        return 'skip'
+    if (test + suite) % 7 == 0:
+        return 'fail' if build % 2 else 'pass'
+    return 'pass'
+
+
+def create_project(group, slug, builds, environments, suites, tests, metrics):
+    """
+    Creates a project with `builds` builds, each with one test run per each
+    of the `environments` environments. Every test run has `suites` suites
+    with `tests` tests and `metrics` metrics each. Known issues cover part of
+    the failures, and metric thresholds make metric changes count as
+    regressions/fixes.
+
+    Data is submitted with ReceiveTestRun, so that all the derived data
+    (statuses, summaries, history, regressions and fixes) is there.
+    """
+    project = group.projects.create(slug=slug)
+    envs = [project.environments.create(slug='env%d' % e) for e in range(environments)]
+
+    for s in range(suites):
+        issue = models.KnownIssue.objects.create(
+            title='known failures in suite%d' % s,
+            test_name='suite%d/test13' % s,
+        )
+        issue.environments.set(envs)
+        intermittent = models.KnownIssue.objects.create(
+            title='intermittent failures in suite%d' % s,
+            test_name='suite%d/test23' % s,
+            intermittent=True,
+        )
+        intermittent.environments.set(envs)
+
+    project.thresholds.create(name='suite0/*', is_higher_better=False)
+
+    receive = ReceiveTestRun(project)
+    start = timezone.now() - timedelta(days=builds)
+    for b in range(builds):
+        version = 'v%d' % b
+        for e, env in enumerate(envs):
+            test_results = {}
+            metric_results = {}
+            for s in range(suites):
+                for t in range(tests):
+                    test_results['suite%d/test%d' % (s, t)] = synthetic_result(b, s, t)
+                for m in range(metrics):
+                    metric_results['suite%d/metric%d' % (s, m)] = [float(b % 3 + m + e), float(m + 1)]
+            metadata = {
+                'job_id': '%d-%d' % (b, e),
+                'datetime': (start + timedelta(days=b)).isoformat(),
+            }
+            receive.receive_parsed(version, env.slug, metadata=metadata, tests=test_results, metrics=metric_results)
+
+    return project
@@ -0,0 +1,92 @@
+from django.test import TestCase
+from django.test import Client
+
+from squad.core import models
+from test.performance import benchmark
+from test.synthetic import create_project, get_scale
+
+
+# Maximum number of database queries for each benchmark. These must not
+# depend on the scale of the synthetic project: if one of them grows with
+# the number of builds, environments, or tests, that is a N+1 problem.
+QUERY_BUDGET = {
+    'api_build_status': 6,
+    'api_failures_with_confidence': 8,
+    'api_project_compare_builds': 9,
+    'api_build_compare': 5,
+    'api_metrics_data': 5,
+    'frontend_build': 24,
+    'frontend_tests': 23,
+    'frontend_test_history': 13,
+    'frontend_metrics': 8,
+}
+
+
+class BenchmarkTest(TestCase):
+    """
+    Measures the number of queries, wall time and peak memory of the hot
+    API and frontend views on a synthetic project (see test.synthetic).
+
+    Query counts are checked against QUERY_BUDGET, and are the only gate;
+    wall time and memory are only compared with the previous local run when
+    running `./manage.py test`, and reported as warnings (see
+    test.performance.export).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.scale = get_scale()
+        cls.group = models.Group.objects.create(slug='benchmark')
+        cls.project = create_project(cls.group, 'synthetic', **cls.scale)
+        builds = cls.project.builds.order_by('datetime')
+        cls.baseline = builds[len(builds) - 2]
+        cls.build = builds[len(builds) - 1]
+
+    def setUp(self):
+        self.client = Client()
+
+    def hit(self, name, url):
+        with benchmark('benchmark:' + name) as m:
+            response = self.client.get(url)
+        self.assertEqual(200, response.status_code, url)
+        self.assertLessEqual(m['queries'], QUERY_BUDGET[name], '%s: %d queries' % (url, m['queries']))
+        return response
+
+    @property
+    def project_url(self):
+        return '/%s/%s' % (self.group.slug, self.project.slug)
+
+    def test_api_build_status(self):
+        response = self.hit('api_build_status', '/api/builds/%d/status/' % self.build.id)
+        self.assertTrue(response.json()['finished'])
+
+    def test_api_failures_with_confidence(self):
+        response = self.hit('api_failures_with_confidence', '/api/builds/%d/failures_with_confidence/?limit=50' % self.build.id)
+        self.assertTrue(response.json()['results'])
+
+    def test_api_project_compare_builds(self):
+        url = '/api/projects/%d/compare_builds/?baseline=%d&to_compare=%d' % (self.project.id, self.baseline.id, self.build.id)
+        response = self.hit('api_project_compare_builds', url)
+        self.assertTrue(response.json()['regressions'])
+
+    def test_api_build_compare(self):
+        url = '/api/builds/%d/compare/?target=%d' % (self.baseline.id, self.build.id)
+        response = self.hit('api_build_compare', url)
+        self.assertTrue(response.json()['regressions'])
+
+    def test_api_metrics_data(self):
+        url = '/api/data/%s/%s/?metric=suite0/metric1&metric=:tests:&environment=env0' % (self.group.slug, self.project.slug)
+        response = self.hit('api_metrics_data', url)
+        self.assertEqual(self.scale['builds'], len(response.json()['suite0/metric1']['env0']))
+
+    def test_frontend_build(self):
+        self.hit('frontend_build', '%s/build/%s/' % (self.project_url, self.build.version))
+
+    def test_frontend_tests(self):
+        self.hit('frontend_tests', '%s/build/%s/tests/' % (self.project_url, self.build.version))
+
+    def test_frontend_test_history(self):
+        self.hit('frontend_test_history', '%s/tests/suite0/test7' % self.project_url)
+
+    def test_frontend_metrics(self):
+        self.hit('frontend_metrics', '%s/metrics/' % self.project_url)
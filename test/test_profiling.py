@@ -0,0 +1,107 @@
+import json
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client, TestCase
+from django.test import modify_settings, override_settings
+
+from squad import profiling
+from squad.core import models
+from squad.core.tasks import remove_delayed_reports
+
+
+class FingerprintTest(TestCase):
+
+    def test_literals(self):
+        self.assertEqual(
+            profiling.fingerprint("SELECT * FROM t WHERE a = 1 AND b = 'x' AND c = %s"),
+            "SELECT * FROM t WHERE a = ? AND b = ? AND c = %s",
+        )
+
+    def test_in_lists(self):
+        self.assertEqual(
+            profiling.fingerprint('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+            'SELECT * FROM t WHERE id IN (...)',
+        )
+        self.assertEqual(
+            profiling.fingerprint('SELECT * FROM t WHERE id IN (1, 2)'),
+            'SELECT * FROM t WHERE id IN (...)',
+        )
+
+
+@override_settings(SQUAD_PROFILING=True, SQUAD_PROFILING_TOP_QUERIES=2, SQUAD_PROFILING_DUPLICATES=3)
+class QueryProfileTest(TestCase):
+
+    def test_records_queries(self):
+        profile = profiling.QueryProfile('test', 'test')
+        with profile.active():
+            for i in range(4):
+                list(models.Group.objects.filter(id=i))
+            models.Project.objects.count()
+
+        report = profile.report()
+        self.assertEqual(5, report['queries'])
+        self.assertEqual(2, len(report['slowest']))
+        self.assertEqual(1, len(report['duplicates']))
+        self.assertEqual(4, report['duplicates'][0]['count'])
+        self.assertIn('core_group', report['duplicates'][0]['fingerprint'])
+
+    def test_not_active(self):
+        profile = profiling.QueryProfile('test', 'test')
+        with profile.active():
+            pass
+        models.Group.objects.count()
+        self.assertEqual(0, profile.queries)
+        self.assertEqual([], connection.execute_wrappers)
+
+
+@override_settings(SQUAD_PROFILING=True)
+@modify_settings(MIDDLEWARE={'prepend': 'squad.profiling.ProfilingMiddleware'})
+class ProfilingTest(TestCase):
+
+    def setUp(self):
+        profiling.metrics.reset()
+        self.group = models.Group.objects.create(slug='mygroup')
+        self.project = self.group.projects.create(slug='myproject')
+        self.client = Client()
+
+    def test_request(self):
+        with self.assertLogs('squad.profiling', 'INFO') as logs:
+            response = self.client.get('/mygroup/myproject/')
+        self.assertEqual(200, response.status_code)
+
+        report = json.loads(logs.records[0].getMessage())
+        self.assertEqual('request', report['kind'])
+        self.assertEqual('project', report['name'])
+        self.assertGreater(report['queries'], 0)
+        self.assertIn('squad_db_queries_total{kind="request",name="project"} %d' % report['queries'], profiling.metrics.export())
+
+    def test_task(self):
+        with self.assertLogs('squad.profiling', 'INFO') as logs:
+            remove_delayed_reports.delay()
+
+        report = json.loads(logs.records[0].getMessage())
+        self.assertEqual('task', report['kind'])
+        self.assertEqual('squad.core.tasks.remove_delayed_reports', report['name'])
+        self.assertIn('squad_profiled_total{kind="task",name="squad.core.tasks.remove_delayed_reports"} 1', profiling.metrics.export())
+
+    def test_metrics_endpoint(self):
+        self.assertEqual(403, self.client.get('/_/metrics').status_code)
+
+        staff = User.objects.create(username='staff', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get('/_/metrics')
+        self.assertEqual(200, response.status_code)
+        self.assertIn('# TYPE squad_db_queries_total counter', response.content.decode())
+
+    def test_metrics_include_email_template_cache(self):
+        models.EmailTemplate.compile(None, 'subject', 'profiled subject')
+        info = models.EmailTemplate.compiled_cache_info()
+        exported = profiling.metrics.export()
+        self.assertIn('# TYPE squad_email_template_cache_hits_total counter', exported)
+        self.assertIn('squad_email_template_cache_misses_total %d' % info['misses'], exported)
+        self.assertIn('squad_email_template_cache_size %d' % info['size'], exported)
+
+    @override_settings(SQUAD_PROFILING=False)
+    def test_metrics_endpoint_disabled(self):
+        self.assertEqual(404, self.client.get('/_/metrics').status_code)